@@ -23,6 +23,7 @@ from collections import defaultdict
 
 from database import SessionLocal
 from models import Branch, MenuItem, Category, AIConfig, DiningTable
+from menu_resolver import branch_menu_query
 
 # ============== FastAPI App ==============
 app = FastAPI(title="S2O AI Chatbot API - Enhanced", version="2.0.0")
@@ -112,14 +113,11 @@ def get_rich_branch_context(branch_id: str, db: Session) -> tuple[str, Branch]:
         for item in all_branch_items[:3]:  # Show first 3
             print(f"     - {item.item_name} (status: {item.status}, category: {item.category_id})")
         
-        # Query menu items that belong to both this branch AND this tenant's categories
+        # Branch items + the tenant's master menu with this branch's overrides applied
         # Note: Check for both 'active' and 'available' status
-        menu_query = db.query(MenuItem, Category).join(
-            Category, MenuItem.category_id == Category.category_id
-        ).filter(
-            MenuItem.branch_id == branch_id,
-            Category.tenant_id == tenant_id,
-            MenuItem.status.in_(["active", "available"])  # Accept both statuses
+        menu_query = branch_menu_query(
+            db, branch_id, tenant_id, MenuItem, Category,
+            statuses=["active", "available"]  # Accept both statuses
         ).order_by(Category.category_name, MenuItem.item_name).all()
         
         print(f"✅ Found {len(menu_query)} active menu items with categories")
@@ -163,12 +161,13 @@ Hoàn tiền: {branch.cashback_percent or 0}% cho mọi giao dịch
         total_items = 0
         discounted_items = []
         
-        for item, category in menu_query:
+        for row in menu_query:
+            item, category = row.MenuItem, row.Category
             total_items += 1
             
-            # Calculate price info
-            original_price = float(item.price)
-            discount = float(item.discount_percent or 0)
+            # Calculate price info (effective values for this branch)
+            original_price = float(row.effective_price)
+            discount = float(row.effective_discount or 0)
             
             item_info = {
                 'name': item.item_name,
@@ -176,7 +175,7 @@ Hoàn tiền: {branch.cashback_percent or 0}% cho mọi giao dịch
                 'price': original_price,
                 'discount': discount,
                 'final_price': original_price * (1 - discount/100) if discount > 0 else original_price,
-                'status': item.status
+                'status': row.effective_status
             }
             
             categories_data[category.category_name].append(item_info)
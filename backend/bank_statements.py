@@ -0,0 +1,370 @@
+"""
+Bank statement reconciliation for QR (bank transfer) payments
+
+Staff upload the branch account's statement as CSV or OFX; transactions
+are read one at a time from the uploaded file (spooled to disk by the
+endpoint) and matched against the branch's 'paid' bank_transfer bills
+through a hash index keyed by (amount in whole VND, bill reference). The
+reference is the one the VietQR payload puts in the transfer message
+(vietqr.bill_reference), so a transfer made by scanning the payment QR
+carries it in its memo.
+
+Bills paid together (the sessions of one tab) form one payment: the index
+holds the tab's total under every bill's reference, plus each bill's own
+total. A transaction matches only when both amount and reference agree;
+everything else is returned unmatched, with a reason, for staff to check
+by hand.
+
+CSV: the header row is found among the first CSV_HEADER_SCAN_ROWS rows
+(bank exports often start with account details). Column names are matched
+without accents or case, in English or Vietnamese, e.g. "Credit" /
+"Ghi có" / "Số tiền" for the amount and "Description" / "Nội dung" /
+"Diễn giải" for the memo. A signed amount column or separate credit and
+debit columns are both accepted. Debits are skipped.
+
+OFX: 1.x (SGML, unclosed leaf tags) and 2.x (XML); the STMTTRN elements
+are read with TRNAMT, NAME + MEMO, FITID and DTPOSTED.
+"""
+
+import csv
+import io
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import Bill, DiningTable, Session as DBSession
+from text_folding import fold_text
+import vietqr
+
+STATEMENT_FORMATS = ("csv", "ofx")
+CSV_HEADER_SCAN_ROWS = 30
+OFX_READ_SIZE = 64 * 1024
+MAX_REPORTED_ROWS = 1000
+
+# Folded header name -> column role
+CSV_COLUMNS = {
+    "credit": ("credit", "credit amount", "ghi co", "so tien ghi co", "phat sinh co", "so tien co"),
+    "debit": ("debit", "debit amount", "ghi no", "so tien ghi no", "phat sinh no", "so tien no"),
+    "amount": ("amount", "so tien", "transaction amount", "so tien giao dich"),
+    "memo": ("description", "memo", "content", "details", "narrative", "remark", "remarks",
+             "noi dung", "noi dung giao dich", "dien giai", "mo ta", "chi tiet giao dich"),
+    "reference": ("reference", "reference number", "transaction id", "ref", "fitid",
+                  "so tham chieu", "ma giao dich", "so giao dich", "so but toan"),
+    "posted": ("date", "transaction date", "posted", "posting date", "value date",
+               "ngay", "ngay giao dich", "ngay hieu luc", "thoi gian"),
+}
+_COLUMN_ROLES = {name: role for role, names in CSV_COLUMNS.items() for name in names}
+
+_HEADER_NOISE = re.compile(r"\(.*?\)|[^a-z0-9 ]")
+_REFERENCE = re.compile(r"SO[0-9A-F]{10}")
+_MEMO_NOISE = re.compile(r"[^0-9A-Z]")
+_OFX_TAG = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class Transaction:
+    row: int
+    amount: Decimal  # Negative for debits
+    memo: str
+    reference: Optional[str] = None  # The bank's own transaction id
+    posted: Optional[str] = None
+
+    def summary(self) -> dict:
+        return {
+            "row": self.row,
+            "amount": float(self.amount),
+            "memo": self.memo,
+            "reference": self.reference,
+            "posted": self.posted,
+        }
+
+
+# ============== Reading ==============
+
+def parse_amount(value) -> Optional[Decimal]:
+    """
+    Statement amount in VND: "1.650.000", "1,650,000.00", "165000", "-50,000 VND".
+    A lone separator followed by exactly three digits groups thousands.
+    """
+    text = re.sub(r"[^\d.,+-]", "", str(value or ""))
+    digits = text.strip("+-")
+    if not digits:
+        if str(value or "").strip():
+            raise RowError(f"Amount is not a number: {value!r}")
+        return None
+    negative = "-" in text
+
+    if "." in digits and "," in digits:
+        decimal_mark = "." if digits.rfind(".") > digits.rfind(",") else ","
+        digits = digits.replace("," if decimal_mark == "." else ".", "").replace(decimal_mark, ".")
+    elif "." in digits or "," in digits:
+        mark = "." if "." in digits else ","
+        whole, _, fraction = digits.rpartition(mark)
+        if digits.count(mark) > 1 or len(fraction) == 3:
+            digits = digits.replace(mark, "")
+        else:
+            digits = whole + "." + fraction
+
+    try:
+        amount = Decimal(digits)
+    except InvalidOperation:
+        raise RowError(f"Amount is not a number: {value!r}")
+    return -amount if negative else amount
+
+
+def whole_vnd(amount) -> int:
+    return int(Decimal(str(amount)).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def _header_role(name: str) -> Optional[str]:
+    folded = " ".join(_HEADER_NOISE.sub(" ", fold_text(name)).split())
+    return _COLUMN_ROLES.get(folded)
+
+
+def _csv_transactions(text) -> Iterator[Tuple[int, object]]:
+    reader = csv.reader(text)
+    columns: Dict[str, int] = {}
+    for cells in reader:
+        roles = [_header_role(cell) for cell in cells]
+        if "memo" in roles and {"credit", "amount"} & set(roles):
+            # First column of each role wins
+            for index, role in reversed(list(enumerate(roles))):
+                if role:
+                    columns[role] = index
+            break
+        if reader.line_num >= CSV_HEADER_SCAN_ROWS:
+            break
+    if not columns:
+        raise ValueError("No header row with an amount (or credit) and a description column")
+
+    def cell(cells, role):
+        index = columns.get(role)
+        return cells[index].strip() if index is not None and index < len(cells) else ""
+
+    for cells in reader:
+        if not any(cell.strip() for cell in cells):
+            continue
+        try:
+            credit = parse_amount(cell(cells, "credit")) if "credit" in columns else None
+            if credit is None and "amount" in columns:
+                credit = parse_amount(cell(cells, "amount"))
+            if credit is None and "debit" in columns:
+                debit = parse_amount(cell(cells, "debit"))
+                credit = -abs(debit) if debit is not None else None
+            if credit is None:
+                raise RowError("No amount")
+        except RowError as e:
+            yield reader.line_num, e
+            continue
+        yield reader.line_num, Transaction(
+            row=reader.line_num,
+            amount=credit,
+            memo=cell(cells, "memo"),
+            reference=cell(cells, "reference") or None,
+            posted=cell(cells, "posted") or None,
+        )
+
+
+def _ofx_elements(text) -> Iterator[Tuple[bool, str, str]]:
+    """(closing?, TAG, text after the tag), read in chunks"""
+    buffer = ""
+    while True:
+        chunk = text.read(OFX_READ_SIZE)
+        buffer += chunk
+        # Only text up to the last "<" is complete (a value runs to the next tag)
+        end = buffer.rfind("<") if chunk else len(buffer)
+        if end <= 0:
+            if not chunk:
+                return
+            continue
+        for match in _OFX_TAG.finditer(buffer, 0, end):
+            yield bool(match.group(1)), match.group(2).upper(), match.group(3).strip()
+        buffer = buffer[end:]
+        if not chunk:
+            return
+
+
+def _ofx_transactions(text) -> Iterator[Tuple[int, object]]:
+    number = 0
+    current: Optional[Dict[str, str]] = None
+    for closing, tag, value in _ofx_elements(text):
+        if tag == "STMTTRN":
+            if closing and current is not None:
+                number += 1
+                try:
+                    amount = parse_amount(current.get("TRNAMT"))
+                    if amount is None:
+                        raise RowError("No TRNAMT")
+                except RowError as e:
+                    yield number, e
+                else:
+                    memo = " ".join(filter(None, (current.get("NAME"), current.get("MEMO"))))
+                    yield number, Transaction(
+                        row=number,
+                        amount=amount,
+                        memo=memo,
+                        reference=current.get("FITID"),
+                        posted=current.get("DTPOSTED"),
+                    )
+            current = None if closing else {}
+        elif current is not None and not closing and value:
+            current[tag] = value
+
+
+def read_transactions(upload, fmt: str) -> Iterator[Tuple[int, object]]:
+    """
+    Yield (row_number, Transaction or RowError) from a binary file object.
+    CSV rows are numbered like spreadsheet lines, OFX transactions from 1.
+    """
+    text = io.TextIOWrapper(upload, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        if fmt == "csv":
+            yield from _csv_transactions(text)
+        else:
+            yield from _ofx_transactions(text)
+    finally:
+        text.detach()
+
+
+# ============== Matching ==============
+
+def memo_references(memo: str) -> List[str]:
+    """Bill references in a transfer message (banks may add spaces or dashes inside it)"""
+    return _REFERENCE.findall(_MEMO_NOISE.sub("", fold_text(memo).upper()))
+
+
+@dataclass
+class PaymentIndex:
+    # (amount, reference) -> ids of the bills that transfer pays
+    by_key: Dict[Tuple[int, str], Tuple[str, ...]] = field(default_factory=dict)
+    # reference -> amounts it can be paid with (to explain mismatches)
+    amounts: Dict[str, Set[int]] = field(default_factory=lambda: defaultdict(set))
+
+    def add(self, amount: int, bill_ids: Tuple[str, ...], references: Iterable[str]):
+        for reference in references:
+            self.by_key.setdefault((amount, reference), bill_ids)
+            self.amounts[reference].add(amount)
+
+
+def paid_transfer_index(db: Session, branch_id: str) -> PaymentIndex:
+    """Index of the branch's QR-paid bills waiting for verification"""
+    rows = db.query(
+        Bill.bill_id, Bill.total_amount, Bill.session_id, DBSession.tab_id
+    ).join(
+        DBSession, Bill.session_id == DBSession.session_id
+    ).join(
+        DiningTable, DBSession.table_id == DiningTable.table_id
+    ).filter(
+        DiningTable.branch_id == branch_id,
+        Bill.status == "paid",
+        Bill.payment_method == "bank_transfer"
+    ).all()
+
+    payments = defaultdict(list)
+    for row in rows:
+        payments[row.tab_id or row.session_id].append(row)
+
+    index = PaymentIndex()
+    for bills in payments.values():
+        references = {row.bill_id: vietqr.bill_reference(row.bill_id) for row in bills}
+        # The whole tab paid at once (what the payment QR asks for)...
+        index.add(
+            whole_vnd(sum(Decimal(str(row.total_amount)) for row in bills)),
+            tuple(sorted(references)),
+            references.values()
+        )
+        # ...or a single bill on its own
+        if len(bills) > 1:
+            for row in bills:
+                index.add(whole_vnd(row.total_amount), (row.bill_id,), (references[row.bill_id],))
+    return index
+
+
+@dataclass
+class ReconcileResult:
+    transactions: int = 0
+    skipped: int = 0  # Debits and zero amounts
+    matched: int = 0
+    unmatched: int = 0
+    failed: int = 0
+    bill_ids: List[str] = field(default_factory=list)
+    matches: List[dict] = field(default_factory=list)
+    unmatched_rows: List[dict] = field(default_factory=list)
+    errors: List[dict] = field(default_factory=list)
+
+    def add_unmatched(self, transaction: Transaction, reason: str):
+        self.unmatched += 1
+        if len(self.unmatched_rows) < MAX_REPORTED_ROWS:
+            self.unmatched_rows.append({**transaction.summary(), "reason": reason})
+
+    def add_error(self, row_number: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ROWS:
+            self.errors.append({"row": row_number, "error": message})
+
+    def summary(self) -> dict:
+        return {
+            "transactions": self.transactions,
+            "skipped": self.skipped,
+            "matched": self.matched,
+            "unmatched": self.unmatched,
+            "failed": self.failed,
+            "bills_matched": len(self.bill_ids),
+            "matches": self.matches,
+            "unmatched_rows": self.unmatched_rows,
+            "errors": self.errors,
+            "truncated": (self.matched > len(self.matches)
+                          or self.unmatched > len(self.unmatched_rows)
+                          or self.failed > len(self.errors)),
+        }
+
+
+def reconcile(index: PaymentIndex, rows: Iterable[Tuple[int, object]]) -> ReconcileResult:
+    """Match statement rows to the index; each bill is matched by at most one transaction"""
+    result = ReconcileResult()
+    claimed: Set[str] = set()
+
+    for row_number, transaction in rows:
+        if isinstance(transaction, RowError):
+            result.add_error(row_number, str(transaction))
+            continue
+        result.transactions += 1
+        if transaction.amount <= 0:
+            result.skipped += 1
+            continue
+
+        references = memo_references(transaction.memo)
+        if not references:
+            result.add_unmatched(transaction, "No bill reference in the description")
+            continue
+
+        amount = whole_vnd(transaction.amount)
+        bill_ids = next(
+            (index.by_key[(amount, ref)] for ref in references if (amount, ref) in index.by_key),
+            None
+        )
+        if bill_ids is None:
+            expected = sorted(set().union(*(index.amounts.get(ref, ()) for ref in references)))
+            reason = (f"Amount differs from the bill ({', '.join(map(str, expected))})"
+                      if expected else "No QR-paid bill waiting for verification with this reference")
+            result.add_unmatched(transaction, reason)
+            continue
+        if claimed.intersection(bill_ids):
+            result.add_unmatched(transaction, "Bill already matched by another transaction")
+            continue
+
+        claimed.update(bill_ids)
+        result.matched += 1
+        result.bill_ids.extend(bill_ids)
+        if len(result.matches) < MAX_REPORTED_ROWS:
+            result.matches.append({**transaction.summary(), "bill_ids": list(bill_ids)})
+
+    return result
@@ -0,0 +1,235 @@
+"""
+In-memory branch directory for the Scan&Order API
+
+Holds one summary per branch (every column except the base64 image) plus
+menu item counts per status, so the public branch listings never run a
+COUNT/GROUP BY against MySQL. A branch's count includes the tenant's
+shared master menu items (per-branch overrides are not reflected).
+
+The directory is loaded lazily with two queries and then kept current by
+the branch, menu and tenant write paths in main.py. Each worker process
+has its own copy, so it is also fully reloaded every
+BRANCH_DIRECTORY_TTL seconds to pick up writes made by other workers.
+"""
+
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, load_only
+
+from models import Branch, Category, MenuItem, Tenant
+
+BRANCH_DIRECTORY_TTL = int(os.getenv("BRANCH_DIRECTORY_TTL", "300"))
+
+# Item statuses that count as "on the menu" for the public listing
+ACTIVE_ITEM_STATUSES = ("active", "available")
+
+SUMMARY_COLUMNS = (
+    "branch_id", "tenant_id", "branch_name", "address", "province", "phone",
+    "manager_name", "status", "cashback_percent", "bank_code",
+    "bank_account_number", "bank_account_name", "opening_hours",
+    "closing_hours", "google_maps_link", "latitude", "longitude", "created_at",
+)
+
+
+@dataclass
+class BranchSummary:
+    branch_id: str
+    tenant_id: str
+    branch_name: Optional[str] = None
+    address: Optional[str] = None
+    province: Optional[str] = None
+    phone: Optional[str] = None
+    manager_name: Optional[str] = None
+    status: Optional[str] = None
+    cashback_percent: Optional[Decimal] = None
+    bank_code: Optional[str] = None
+    bank_account_number: Optional[str] = None
+    bank_account_name: Optional[str] = None
+    opening_hours: Optional[str] = None
+    closing_hours: Optional[str] = None
+    google_maps_link: Optional[str] = None
+    latitude: Optional[Decimal] = None
+    longitude: Optional[Decimal] = None
+    created_at: Optional[object] = None
+    tenant_name: Optional[str] = None
+    tenant_status: Optional[str] = None
+    item_counts: Counter = field(default_factory=Counter)
+    # Shared with every branch of the tenant: counts of its master menu items
+    master_counts: Counter = field(default_factory=Counter)
+
+    @property
+    def menu_item_count(self) -> int:
+        return sum(self.item_counts.values()) + sum(self.master_counts.values())
+
+    @property
+    def active_item_count(self) -> int:
+        return sum(self.item_counts[s] + self.master_counts[s] for s in ACTIVE_ITEM_STATUSES)
+
+    @property
+    def is_listed(self) -> bool:
+        """Shown to guests: both the branch and its tenant are active"""
+        return self.status == "active" and self.tenant_status == "active"
+
+
+class BranchDirectory:
+    def __init__(self, ttl: int = BRANCH_DIRECTORY_TTL):
+        self.ttl = ttl
+        self._branches: Dict[str, BranchSummary] = {}
+        self._master_counts: Dict[str, Counter] = defaultdict(Counter)
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.RLock()
+        # Bumped on every change so derived indexes know when to rebuild
+        self.version = 0
+        self.on_change: Optional[Callable[[], None]] = None
+
+    # ---------- loading ----------
+
+    def ensure_loaded(self, db: Session):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        self.reload(db)
+
+    def reload(self, db: Session):
+        rows = db.query(Branch, Tenant.tenant_name, Tenant.status).options(
+            load_only(*[getattr(Branch, c) for c in SUMMARY_COLUMNS])
+        ).join(Tenant, Branch.tenant_id == Tenant.tenant_id).all()
+
+        counts = db.query(
+            MenuItem.branch_id, Category.tenant_id, MenuItem.status, func.count(MenuItem.menu_item_id)
+        ).join(Category, MenuItem.category_id == Category.category_id).group_by(
+            MenuItem.branch_id, Category.tenant_id, MenuItem.status
+        ).all()
+
+        master_counts = defaultdict(Counter)
+        for branch_id, tenant_id, item_status, count in counts:
+            if branch_id is None:
+                master_counts[tenant_id][item_status] = count
+
+        branches = {}
+        for branch, tenant_name, tenant_status in rows:
+            summary = self._summarize(branch)
+            summary.tenant_name = tenant_name
+            summary.tenant_status = tenant_status
+            summary.master_counts = master_counts[branch.tenant_id]
+            branches[branch.branch_id] = summary
+
+        for branch_id, tenant_id, item_status, count in counts:
+            if branch_id in branches:
+                branches[branch_id].item_counts[item_status] = count
+
+        with self._lock:
+            self._branches = branches
+            self._master_counts = master_counts
+            self._loaded_at = time.monotonic()
+        print(f"📇 Branch directory loaded: {len(branches)} branches")
+        self._changed()
+
+    @staticmethod
+    def _summarize(branch: Branch) -> BranchSummary:
+        return BranchSummary(**{c: getattr(branch, c) for c in SUMMARY_COLUMNS})
+
+    def _changed(self):
+        self.version += 1
+        if self.on_change:
+            self.on_change()
+
+    # ---------- reads ----------
+
+    def get(self, db: Session, branch_id: str) -> Optional[BranchSummary]:
+        self.ensure_loaded(db)
+        return self._branches.get(branch_id)
+
+    def listed(self, db: Session) -> List[BranchSummary]:
+        """Active branches of active tenants, for the public listings"""
+        self.ensure_loaded(db)
+        return [b for b in self._branches.values() if b.is_listed]
+
+    def for_tenant(self, db: Session, tenant_id: str) -> List[BranchSummary]:
+        self.ensure_loaded(db)
+        return [b for b in self._branches.values() if b.tenant_id == tenant_id]
+
+    def menu_item_count(self, db: Session, branch_id: str) -> int:
+        summary = self.get(db, branch_id)
+        return summary.menu_item_count if summary else 0
+
+    # ---------- incremental updates (call after commit) ----------
+    # Before the first load there is nothing to update: the load reads
+    # the committed state anyway.
+
+    def upsert_branch(self, branch: Branch, tenant: Optional[Tenant] = None):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            existing = self._branches.get(branch.branch_id)
+            summary = self._summarize(branch)
+            if existing:
+                summary.item_counts = existing.item_counts
+                summary.tenant_name = existing.tenant_name
+                summary.tenant_status = existing.tenant_status
+            if tenant is not None:
+                summary.tenant_name = tenant.tenant_name
+                summary.tenant_status = tenant.status
+            summary.master_counts = self._master_counts[branch.tenant_id]
+            self._branches[branch.branch_id] = summary
+        self._changed()
+
+    def remove_branch(self, branch_id: str):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            self._branches.pop(branch_id, None)
+        self._changed()
+
+    def update_tenant(self, tenant: Tenant):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            for summary in self._branches.values():
+                if summary.tenant_id == tenant.tenant_id:
+                    summary.tenant_name = tenant.tenant_name
+                    summary.tenant_status = tenant.status
+        self._changed()
+
+    def remove_tenant(self, tenant_id: str):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            self._branches = {k: v for k, v in self._branches.items() if v.tenant_id != tenant_id}
+            self._master_counts.pop(tenant_id, None)
+        self._changed()
+
+    # branch_id None = a tenant master menu item (tenant_id required)
+
+    def item_added(self, branch_id: Optional[str], item_status: str, count: int = 1, tenant_id: str = None):
+        self._adjust(branch_id, item_status, count, tenant_id)
+
+    def item_removed(self, branch_id: Optional[str], item_status: str, count: int = 1, tenant_id: str = None):
+        self._adjust(branch_id, item_status, -count, tenant_id)
+
+    def item_status_changed(self, branch_id: Optional[str], old_status: str, new_status: str, tenant_id: str = None):
+        if old_status != new_status:
+            self._adjust(branch_id, old_status, -1, tenant_id)
+            self._adjust(branch_id, new_status, 1, tenant_id)
+
+    def _adjust(self, branch_id: Optional[str], item_status: str, delta: int, tenant_id: str = None):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            if branch_id is None:
+                counts = self._master_counts[tenant_id]
+            else:
+                summary = self._branches.get(branch_id)
+                if summary is None:
+                    return
+                counts = summary.item_counts
+            counts[item_status] += delta
+            if counts[item_status] <= 0:
+                del counts[item_status]
+        self._changed()
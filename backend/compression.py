@@ -0,0 +1,259 @@
+"""
+Response compression for the Scan&Order API
+
+- CompressionMiddleware: gzip (and brotli when the `brotli` package is
+  installed) for any response above a size threshold.
+- PrecompressedCache: versioned store for cacheable JSON bodies (menu
+  snapshots, branch directory). Each body is serialized and compressed once
+  per version instead of once per request.
+"""
+
+import gzip
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict, defaultdict
+from typing import Callable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+from fast_json import dumps
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+# Responses we never touch: already encoded, streamed events, or bodiless
+SKIP_CONTENT_TYPES = ("text/event-stream", "image/", "application/zip", "application/pdf")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick the best encoding the client accepts ('br', 'gzip' or None)"""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 1.0
+        if name and quality > 0:
+            accepted.add(name)
+
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress_body(body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class _StreamCompressor:
+    """Incremental compressor used for streaming (more_body) responses"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses larger than minimum_size"""
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start_message = None
+        self.passthrough = False
+        self.compressor = None
+
+    async def send(self, message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            # Hold the headers back until we know the body size
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            if (
+                "content-encoding" in headers
+                or message["status"] in (204, 304)
+                or content_type.startswith(SKIP_CONTENT_TYPES)
+            ):
+                self.passthrough = True
+                await self._send(message)
+            return
+
+        if message_type != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None and self.start_message is not None:
+            headers = MutableHeaders(raw=self.start_message["headers"])
+
+            if not more_body and len(body) < self.middleware.minimum_size:
+                # Small enough that compression costs more than it saves
+                self.passthrough = True
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+
+            if not more_body:
+                compressed = compress_body(body, self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+                headers["Content-Length"] = str(len(compressed))
+                await self._send(self.start_message)
+                await self._send({"type": "http.response.body", "body": compressed})
+                self.passthrough = True
+                return
+
+            # Streaming body: compress chunk by chunk
+            if "content-length" in headers:
+                del headers["Content-Length"]
+            self.compressor = _StreamCompressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+            await self._send(self.start_message)
+            self.start_message = None
+
+        data = self.compressor.chunk(body)
+        if not more_body:
+            data += self.compressor.finish()
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+
+# ============== Precompressed Response Cache ==============
+
+class CachedBody:
+    """One serialized JSON body plus its precompressed variants"""
+
+    __slots__ = ("version", "etag", "identity", "encoded")
+
+    def __init__(self, version: int, etag: str, identity: bytes, encoded: dict):
+        self.version = version
+        self.etag = etag
+        self.identity = identity
+        self.encoded = encoded
+
+
+class PrecompressedCache:
+    """
+    Versioned cache of JSON response bodies.
+
+    Entries are grouped by scope (e.g. "branches" or "menu:<branch_id>").
+    Write paths call bump(scope); the next read rebuilds, re-serializes and
+    re-compresses the body once, and every request until the next bump is
+    served straight from memory.
+    """
+
+    def __init__(self, minimum_size: int = 1024, max_entries: int = 2048,
+                 gzip_level: int = 6, brotli_quality: int = 5):
+        self.minimum_size = minimum_size
+        self.max_entries = max_entries
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._entries: "OrderedDict[str, CachedBody]" = OrderedDict()
+        self._versions = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def bump(self, *scopes: str):
+        """Invalidate every cached body in the given scopes"""
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] += 1
+
+    def version(self, scope: str) -> int:
+        return self._versions[scope]
+
+    def serialize(self, payload) -> bytes:
+        return dumps(payload)
+
+    def get(self, key: str, scope: str, build: Callable) -> CachedBody:
+        # Read the version before building so a concurrent bump() marks
+        # the freshly built entry stale instead of being lost
+        version = self._versions[scope]
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version:
+            return entry
+
+        body = self.serialize(build())
+        encoded = {}
+        if len(body) >= self.minimum_size:
+            encoded["gzip"] = compress_body(body, "gzip", self.gzip_level)
+            if brotli is not None:
+                encoded["br"] = compress_body(body, "br", brotli_quality=self.brotli_quality)
+
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        entry = CachedBody(version, f'W/"{digest}"', body, encoded)
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def respond(self, request: Request, key: str, scope: str, build: Callable) -> Response:
+        """Serve a cached body, honouring Accept-Encoding and If-None-Match"""
+        entry = self.get(key, scope, build)
+        headers = {"ETag": entry.etag, "Vary": "Accept-Encoding"}
+
+        if request.headers.get("if-none-match") == entry.etag:
+            return Response(status_code=304, headers=headers)
+
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        if encoding in entry.encoded:
+            headers["Content-Encoding"] = encoding
+            return Response(entry.encoded[encoding], media_type="application/json", headers=headers)
+
+        return Response(entry.identity, media_type="application/json", headers=headers)
@@ -0,0 +1,209 @@
+"""
+Daily branch stats rollup
+
+BranchDailyStats holds one row per (branch_id, business_date) with the
+day's revenue, settled bills, orders and covers, so dashboards read a few
+small rows instead of summing bills over the session/table/branch joins.
+
+Rows are kept up to date in the transactions that change them:
+    orders   +1 when an order is created (dated like Order.order_time)
+    revenue  + bill total and bills +1 when a bill first reaches a paid
+             status (dated like Session.end_time, which is set then);
+             paid -> verified adds nothing
+    covers   + the tab's sessions when a table's tab closes
+
+record() adds with one relative UPDATE (like add_to_bill), so concurrent
+requests never overwrite each other's counts. rebuild() recomputes a date
+range from the bills, orders and sessions (scripts/rebuild_daily_stats.py).
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Bill, Branch, BranchDailyStats, DiningTable, Order, Session as DBSession
+
+SETTLED_STATUSES = ("paid", "verified", "completed")  # Same as PAID_BILL_STATUSES in main.py
+
+
+def order_date() -> date:
+    """Business date of an order placed now (Order.order_time is local time)"""
+    return datetime.now().date()
+
+
+def settlement_date() -> date:
+    """Business date of a bill settled now (Session.end_time is set with utcnow)"""
+    return datetime.utcnow().date()
+
+
+def record(db: Session, branch_id: str, business_date: date, revenue: Decimal = Decimal('0'),
+           bills: int = 0, orders: int = 0, covers: int = 0):
+    """Add to a branch's stats for business_date, in the caller's transaction"""
+    if not (revenue or bills or orders or covers):
+        return
+    stats = BranchDailyStats.__table__
+
+    def apply_delta() -> bool:
+        result = db.execute(
+            update(stats).where(
+                stats.c.branch_id == branch_id,
+                stats.c.business_date == business_date
+            ).values(
+                revenue=stats.c.revenue + revenue,
+                bills=stats.c.bills + bills,
+                orders=stats.c.orders + orders,
+                covers=stats.c.covers + covers
+            )
+        )
+        return result.rowcount > 0
+
+    if apply_delta():
+        return
+
+    try:
+        with db.begin_nested():
+            db.execute(insert(stats).values(
+                branch_id=branch_id, business_date=business_date,
+                revenue=revenue, bills=bills, orders=orders, covers=covers
+            ))
+    except IntegrityError:
+        # Another request opened the day's row first: add to it instead
+        apply_delta()
+
+
+# ============== Rollup Reads ==============
+
+def average_ticket(revenue, bills) -> float:
+    return float(revenue) / bills if bills else 0.0
+
+
+def totals(db: Session, branch_ids=None, start: Optional[date] = None, end: Optional[date] = None,
+           tenant_id: Optional[str] = None):
+    """(revenue, bills, orders, covers) summed over the matching rows"""
+    query = db.query(
+        func.coalesce(func.sum(BranchDailyStats.revenue), 0),
+        func.coalesce(func.sum(BranchDailyStats.bills), 0),
+        func.coalesce(func.sum(BranchDailyStats.orders), 0),
+        func.coalesce(func.sum(BranchDailyStats.covers), 0)
+    )
+    if tenant_id is not None:
+        query = query.join(Branch, Branch.branch_id == BranchDailyStats.branch_id).filter(
+            Branch.tenant_id == tenant_id
+        )
+    if branch_ids is not None:
+        query = query.filter(BranchDailyStats.branch_id.in_(list(branch_ids)))
+    if start is not None:
+        query = query.filter(BranchDailyStats.business_date >= start)
+    if end is not None:
+        query = query.filter(BranchDailyStats.business_date <= end)
+    return query.one()
+
+
+def tenant_totals(db: Session, start: Optional[date] = None):
+    """Subquery: (tenant_id, revenue, bills, orders) summed over each tenant's branches since start"""
+    query = db.query(
+        Branch.tenant_id.label("tenant_id"),
+        func.sum(BranchDailyStats.revenue).label("revenue"),
+        func.sum(BranchDailyStats.bills).label("bills"),
+        func.sum(BranchDailyStats.orders).label("orders")
+    ).join(Branch, Branch.branch_id == BranchDailyStats.branch_id)
+    if start is not None:
+        query = query.filter(BranchDailyStats.business_date >= start)
+    return query.group_by(Branch.tenant_id).subquery()
+
+
+# ============== Rebuild ==============
+
+def _in_range(column, start: date, end: date):
+    return func.date(column).between(start, end)
+
+
+def rebuild(db: Session, start: date, end: date, branch_ids: Optional[Iterable[str]] = None) -> int:
+    """
+    Recompute the rows of [start, end] from the bills, orders and sessions
+    (commits). The range is deleted first, so settlements racing with the
+    rebuild wait for its locks and then add to the rebuilt rows.
+    Returns how many rows were written.
+    """
+    branch_ids = list(branch_ids) if branch_ids is not None else None
+
+    def scoped(query):
+        return query.filter(DiningTable.branch_id.in_(branch_ids)) if branch_ids is not None else query
+
+    delete = db.query(BranchDailyStats).filter(BranchDailyStats.business_date.between(start, end))
+    if branch_ids is not None:
+        delete = delete.filter(BranchDailyStats.branch_id.in_(branch_ids))
+    delete.delete(synchronize_session=False)
+
+    rows = {}
+
+    def row(branch_id, day):
+        day = day if isinstance(day, date) else date.fromisoformat(str(day))
+        key = (branch_id, day)
+        if key not in rows:
+            rows[key] = {"branch_id": branch_id, "business_date": day,
+                         "revenue": Decimal('0'), "bills": 0, "orders": 0, "covers": 0}
+        return rows[key]
+
+    settled_day = func.date(DBSession.end_time)
+    for branch_id, day, revenue, bills in scoped(db.query(
+        DiningTable.branch_id, settled_day, func.sum(Bill.total_amount), func.count(Bill.bill_id)
+    ).join(
+        DBSession, Bill.session_id == DBSession.session_id
+    ).join(
+        DiningTable, DBSession.table_id == DiningTable.table_id
+    ).filter(
+        Bill.status.in_(SETTLED_STATUSES),
+        _in_range(DBSession.end_time, start, end)
+    )).group_by(DiningTable.branch_id, settled_day):
+        entry = row(branch_id, day)
+        entry["revenue"] = Decimal(str(revenue or 0))
+        entry["bills"] = bills
+
+    ordered_day = func.date(Order.order_time)
+    for branch_id, day, orders in scoped(db.query(
+        DiningTable.branch_id, ordered_day, func.count(Order.order_id)
+    ).join(
+        DBSession, Order.session_id == DBSession.session_id
+    ).join(
+        DiningTable, DBSession.table_id == DiningTable.table_id
+    ).filter(
+        _in_range(Order.order_time, start, end)
+    )).group_by(DiningTable.branch_id, ordered_day):
+        row(branch_id, day)["orders"] = orders
+
+    # Closed tabs: not a table's open tab, with bills and none of them unpaid
+    open_tabs = select(DiningTable.open_tab_id).where(DiningTable.open_tab_id.isnot(None))
+    tabs = scoped(db.query(
+        DiningTable.branch_id.label("branch_id"),
+        func.max(DBSession.end_time).label("closed_at"),
+        func.count(func.distinct(DBSession.session_id)).label("covers")
+    ).join(
+        DiningTable, DBSession.table_id == DiningTable.table_id
+    ).outerjoin(
+        Bill, Bill.session_id == DBSession.session_id
+    ).filter(
+        DBSession.tab_id.isnot(None),
+        DBSession.tab_id.notin_(open_tabs)
+    )).group_by(DBSession.tab_id, DiningTable.branch_id).having(
+        func.count(Bill.bill_id) > 0
+    ).having(
+        func.sum(case((Bill.status.notin_(SETTLED_STATUSES), 1), else_=0)) == 0
+    ).subquery()
+    closed_day = func.date(tabs.c.closed_at)
+    for branch_id, day, covers in db.query(
+        tabs.c.branch_id, closed_day, func.sum(tabs.c.covers)
+    ).filter(
+        _in_range(tabs.c.closed_at, start, end)
+    ).group_by(tabs.c.branch_id, closed_day):
+        row(branch_id, day)["covers"] = int(covers)
+
+    if rows:
+        db.execute(insert(BranchDailyStats), list(rows.values()))
+    db.commit()
+    print(f"📊 Rebuilt {len(rows)} daily stats rows for {start} – {end}")
+    return len(rows)
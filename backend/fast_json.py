@@ -0,0 +1,41 @@
+"""
+Fast JSON serialization for the Scan&Order API
+
+FastAPI normally takes an endpoint's return value through
+response_model validation and jsonable_encoder before rendering it. For
+payloads we build ourselves from database rows (menus, order lists,
+session details) that work is redundant, so those endpoints return a
+TrustedJSONResponse: the payload goes straight to orjson.
+
+Only use TrustedJSONResponse for payloads assembled in this codebase
+from plain values (str, int, float, bool, None, datetime, Decimal, dict,
+list). Anything coming from user input should keep going through
+response_model.
+"""
+
+from decimal import Decimal
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(payload) -> bytes:
+    """Serialize a trusted payload to UTF-8 JSON bytes"""
+    return orjson.dumps(payload, default=_default, option=OPTIONS)
+
+
+class TrustedJSONResponse(ORJSONResponse):
+    """JSON response that skips response_model re-validation"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,149 @@
+"""
+Geo and province index for branch discovery
+
+Branches are bucketed into a fixed lat/lng grid (GRID_CELL_DEGREES per
+cell, ~11 km at the default 0.1). A "near" query only visits the cells
+overlapping the search radius, computes haversine distances for those
+candidates, and returns the closest ones. Provinces are indexed by their
+folded name, so "ha noi", "Hà Nội" and "HA NOI" all match.
+
+The index is rebuilt from the in-memory BranchDirectory whenever the
+directory's version changes (i.e. after a branch/tenant write). That
+only takes a few milliseconds even at thousands of branches, and it
+keeps queries off MySQL entirely.
+"""
+
+import math
+import re
+import threading
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+from text_folding import fold_text
+
+GRID_CELL_DEGREES = 0.1
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+# Coordinates inside Google Maps links, most specific first:
+#   .../data=!3d21.0285!4d105.8542   (place pin)
+#   ...?q=21.0285,105.8542 / query= / ll= / destination=
+#   .../@21.0285,105.8542,15z        (map viewport centre)
+_COORD = r"(-?\d{1,2}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)"
+_MAPS_PATTERNS = (
+    re.compile(r"!3d(-?\d{1,2}(?:\.\d+)?)!4d(-?\d{1,3}(?:\.\d+)?)"),
+    re.compile(r"[?&](?:q|query|ll|destination|center)=(?:loc:)?" + _COORD),
+    re.compile(r"@" + _COORD),
+)
+
+
+def parse_maps_link(link: Optional[str]) -> Optional[Tuple[float, float]]:
+    """Extract (latitude, longitude) from a Google Maps URL, if present"""
+    if not link:
+        return None
+    text = unquote(link)
+    for pattern in _MAPS_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            lat, lng = float(match.group(1)), float(match.group(2))
+            if valid_coordinates(lat, lng):
+                return lat, lng
+    return None
+
+
+def valid_coordinates(lat, lng) -> bool:
+    return lat is not None and lng is not None and -90 <= lat <= 90 and -180 <= lng <= 180
+
+
+def parse_point(value: str) -> Tuple[float, float]:
+    """Parse a "lat,lng" query value; raises ValueError if malformed"""
+    lat_text, _, lng_text = value.partition(",")
+    lat, lng = float(lat_text), float(lng_text)
+    if not valid_coordinates(lat, lng):
+        raise ValueError("coordinates out of range")
+    return lat, lng
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cell(lat: float, lng: float) -> Tuple[int, int]:
+    return int(math.floor(lat / GRID_CELL_DEGREES)), int(math.floor(lng / GRID_CELL_DEGREES))
+
+
+def _as_float(value):
+    if value is None:
+        return None
+    return float(value) if isinstance(value, (Decimal, int, float)) else None
+
+
+class GeoIndex:
+    def __init__(self):
+        self.version = None
+        self._grid: Dict[Tuple[int, int], List] = defaultdict(list)
+        self._points: List = []
+        self._provinces: Dict[str, List] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def sync(self, directory, db):
+        """Rebuild from the branch directory if it changed since the last build"""
+        directory.ensure_loaded(db)
+        if self.version == directory.version:
+            return
+        with self._lock:
+            if self.version == directory.version:
+                return
+            version = directory.version
+            grid, points, provinces = defaultdict(list), [], defaultdict(list)
+            for summary in directory.listed(db):
+                province_key = fold_text(summary.province)
+                provinces[province_key].append(summary)
+                lat, lng = _as_float(summary.latitude), _as_float(summary.longitude)
+                if valid_coordinates(lat, lng):
+                    entry = (lat, lng, province_key, summary)
+                    grid[_cell(lat, lng)].append(entry)
+                    points.append(entry)
+            self._grid, self._points, self._provinces = grid, points, provinces
+            self.version = version
+
+    def in_province(self, province: str) -> List:
+        return list(self._provinces.get(fold_text(province), []))
+
+    def nearest(self, lat: float, lng: float, radius_km: float, limit: Optional[int] = None,
+                province: Optional[str] = None) -> List[Tuple[object, float]]:
+        """Closest branches within radius_km, as (summary, distance_km) pairs (limit=None: all)"""
+        province_key = fold_text(province) if province else None
+
+        # Cells overlapping the bounding box of the search circle
+        dlat = radius_km / KM_PER_DEGREE_LAT
+        dlng = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        row_min, col_min = _cell(lat - dlat, lng - dlng)
+        row_max, col_max = _cell(lat + dlat, lng + dlng)
+
+        cell_count = (row_max - row_min + 1) * (col_max - col_min + 1)
+        if cell_count > len(self._grid):
+            # Huge radius: scanning every point is cheaper than walking empty cells
+            candidates = self._points
+        else:
+            candidates = []
+            for row in range(row_min, row_max + 1):
+                for col in range(col_min, col_max + 1):
+                    candidates.extend(self._grid.get((row, col), ()))
+
+        hits = []
+        for b_lat, b_lng, b_province, summary in candidates:
+            if province_key and b_province != province_key:
+                continue
+            distance = haversine_km(lat, lng, b_lat, b_lng)
+            if distance <= radius_km:
+                hits.append((summary, distance))
+
+        hits.sort(key=lambda hit: hit[1])
+        return hits if limit is None else hits[:limit]
@@ -0,0 +1,60 @@
+"""
+Keyset pagination for the admin listings
+
+A page is asked for with the cursor of the previous page's last row
+instead of an offset: the query seeks past that row's sort key in the
+index, so page 200 costs the same as page 1 and rows added or removed
+meanwhile do not shift or repeat entries across pages. Every sort ends
+with a unique column (tenant_id) so the key identifies exactly one row.
+
+Cursors are opaque to clients (url-safe base64 of the key values).
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, List, Sequence
+
+from sqlalchemy import and_, or_
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def encode(values: Sequence) -> str:
+    raw = json.dumps([_plain(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode(cursor: str, types: Sequence[Callable]) -> List:
+    """Key values of a cursor, converted with types; ValueError if it is not one of ours"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError("Invalid cursor")
+    try:
+        return [convert(value) for convert, value in zip(types, values)]
+    except (ValueError, TypeError, ArithmeticError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def after(keys: Sequence, values: Sequence, descending: bool):
+    """Rows strictly past (values) in the (keys) ordering: k1 > v1 OR (k1 = v1 AND k2 > v2) ..."""
+    clauses = []
+    for i, (key, value) in enumerate(zip(keys, values)):
+        past = key < value if descending else key > value
+        clauses.append(and_(*[k == v for k, v in zip(keys[:i], values[:i])], past))
+    return or_(*clauses)
+
+
+def order_by(keys: Sequence, descending: bool) -> List:
+    return [key.desc() if descending else key.asc() for key in keys]
@@ -0,0 +1,308 @@
+"""
+Loyalty points ledger
+
+Awarding
+    Payment endpoints do not touch Customer.points_balance. They queue a
+    LoyaltyAward row in their own transaction (enqueue_awards), so the award
+    commits or rolls back with the payment. The bill_id primary key makes
+    awarding idempotent: a bill confirmed twice, or by two requests at once,
+    queues one award.
+    LoyaltyWorker (a thread per API process) applies queued awards in
+    batches of LOYALTY_AWARD_BATCH: one executemany INSERT of point
+    transactions, one UPDATE per customer with the batch's total for that
+    customer, and the awards marked applied, all in one commit. Workers of
+    other processes skip rows that are already locked.
+
+Balance history
+    PointBalanceSnapshot rows hold a customer's ledger balance (sum of
+    transactions created before taken_at). take_snapshots() adds one for
+    every customer with new transactions; balance_at() reads the latest
+    snapshot before T and sums only the transactions after it. Snapshots
+    stop LOYALTY_SNAPSHOT_LAG seconds before the database's current time,
+    so transactions still being committed are not left out.
+
+Consistency
+    check_balances() compares points_balance with the ledger for customers
+    in keyset-ordered chunks (see scripts/check_points_ledger.py).
+"""
+
+import os
+import threading
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, func, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Customer, LoyaltyAward, PointBalanceSnapshot, PointTransaction
+
+LOYALTY_AWARD_INTERVAL = float(os.getenv("LOYALTY_AWARD_INTERVAL", "5"))
+LOYALTY_AWARD_BATCH = int(os.getenv("LOYALTY_AWARD_BATCH", "500"))
+LOYALTY_SNAPSHOT_INTERVAL = int(os.getenv("LOYALTY_SNAPSHOT_INTERVAL", str(6 * 3600)))
+LOYALTY_SNAPSHOT_LAG = int(os.getenv("LOYALTY_SNAPSHOT_LAG", "300"))
+CUSTOMER_CHUNK_SIZE = 500
+
+
+# ============== Awarding ==============
+
+def enqueue_awards(db: Session, awards: Iterable[Tuple[str, str, Decimal, str]]) -> int:
+    """
+    Queue (bill_id, customer_id, points, description) awards in the caller's
+    transaction; bills that already have an award are left alone.
+    Returns how many were queued.
+    """
+    rows = {
+        bill_id: {"bill_id": bill_id, "customer_id": customer_id, "points": points, "description": description}
+        for bill_id, customer_id, points, description in awards
+        if customer_id and points and points > 0
+    }
+    if not rows:
+        return 0
+    for (bill_id,) in db.query(LoyaltyAward.bill_id).filter(LoyaltyAward.bill_id.in_(list(rows))):
+        del rows[bill_id]
+    if not rows:
+        return 0
+
+    try:
+        with db.begin_nested():
+            db.execute(insert(LoyaltyAward), list(rows.values()))
+        return len(rows)
+    except IntegrityError:
+        pass
+
+    # A concurrent request queued some of them first: insert the rest one by one
+    queued = 0
+    for row in rows.values():
+        try:
+            with db.begin_nested():
+                db.execute(insert(LoyaltyAward), row)
+            queued += 1
+        except IntegrityError:
+            continue
+    return queued
+
+
+def apply_pending_awards(db: Session, limit: int = LOYALTY_AWARD_BATCH) -> int:
+    """Credit one batch of queued awards, batched per customer (commits). Returns how many."""
+    awards = db.query(
+        LoyaltyAward.bill_id, LoyaltyAward.customer_id, LoyaltyAward.points, LoyaltyAward.description
+    ).filter(
+        LoyaltyAward.applied_at.is_(None)
+    ).order_by(LoyaltyAward.created_at).limit(limit).with_for_update(skip_locked=True).all()
+    if not awards:
+        db.rollback()
+        return 0
+
+    db.execute(insert(PointTransaction), [
+        {
+            "transaction_id": str(uuid.uuid4()),
+            "customer_id": award.customer_id,
+            "bill_id": award.bill_id,
+            "transaction_type": "earn",
+            "points_amount": award.points,
+            "description": award.description
+        }
+        for award in awards
+    ])
+
+    totals = defaultdict(Decimal)
+    for award in awards:
+        totals[award.customer_id] += Decimal(str(award.points))
+    customers = Customer.__table__  # Core UPDATE: executemany with per-row parameters
+    db.execute(
+        update(customers).where(customers.c.customer_id == bindparam("customer")).values(
+            points_balance=func.coalesce(customers.c.points_balance, 0) + bindparam("points")
+        ),
+        [{"customer": customer_id, "points": points} for customer_id, points in totals.items()]
+    )
+
+    db.execute(
+        update(LoyaltyAward).where(
+            LoyaltyAward.bill_id.in_([award.bill_id for award in awards])
+        ).values(applied_at=func.current_timestamp()).execution_options(synchronize_session=False)
+    )
+    db.commit()
+    print(f"🎁 Awarded points for {len(awards)} bills to {len(totals)} customers")
+    return len(awards)
+
+
+# ============== Balance History ==============
+
+def _latest_snapshots(customer_ids: List[str]):
+    """Subquery: (customer_id, taken_at) of each customer's latest snapshot"""
+    return PointBalanceSnapshot.__table__.select().with_only_columns(
+        PointBalanceSnapshot.customer_id,
+        func.max(PointBalanceSnapshot.taken_at).label("taken_at")
+    ).where(
+        PointBalanceSnapshot.customer_id.in_(customer_ids)
+    ).group_by(PointBalanceSnapshot.customer_id).subquery()
+
+
+def take_snapshots(db: Session, chunk_size: int = CUSTOMER_CHUNK_SIZE) -> int:
+    """Snapshot every customer whose ledger moved since their last snapshot (commits per chunk)"""
+    taken_at = db.query(func.current_timestamp()).scalar() - timedelta(seconds=LOYALTY_SNAPSHOT_LAG)
+    taken = 0
+    last_id = ""
+
+    while True:
+        chunk = [row.customer_id for row in db.query(Customer.customer_id).filter(
+            Customer.customer_id > last_id
+        ).order_by(Customer.customer_id).limit(chunk_size)]
+        if not chunk:
+            break
+        last_id = chunk[-1]
+        latest = _latest_snapshots(chunk)
+
+        # Transactions since each customer's last snapshot, added to it
+        rows = db.query(
+            PointTransaction.customer_id,
+            func.coalesce(func.max(PointBalanceSnapshot.balance), 0),
+            func.sum(PointTransaction.points_amount)
+        ).outerjoin(
+            latest, latest.c.customer_id == PointTransaction.customer_id
+        ).outerjoin(
+            PointBalanceSnapshot, and_(
+                PointBalanceSnapshot.customer_id == latest.c.customer_id,
+                PointBalanceSnapshot.taken_at == latest.c.taken_at
+            )
+        ).filter(
+            PointTransaction.customer_id.in_(chunk),
+            PointTransaction.created_at < taken_at,
+            or_(latest.c.taken_at.is_(None), PointTransaction.created_at >= latest.c.taken_at)
+        ).group_by(PointTransaction.customer_id).all()
+
+        if rows:
+            db.execute(insert(PointBalanceSnapshot), [
+                {"customer_id": customer_id, "taken_at": taken_at, "balance": previous + tail}
+                for customer_id, previous, tail in rows
+            ])
+            taken += len(rows)
+        db.commit()
+
+    print(f"📸 Took {taken} point balance snapshots at {taken_at}")
+    return taken
+
+
+def balance_at(db: Session, customer_id: str, at: datetime) -> Decimal:
+    """Ledger balance of a customer at `at`: latest snapshot before it plus the tail of transactions"""
+    snapshot = db.query(PointBalanceSnapshot.taken_at, PointBalanceSnapshot.balance).filter(
+        PointBalanceSnapshot.customer_id == customer_id,
+        PointBalanceSnapshot.taken_at <= at
+    ).order_by(PointBalanceSnapshot.taken_at.desc()).first()
+
+    tail = db.query(func.coalesce(func.sum(PointTransaction.points_amount), 0)).filter(
+        PointTransaction.customer_id == customer_id,
+        PointTransaction.created_at <= at
+    )
+    if snapshot:
+        tail = tail.filter(PointTransaction.created_at >= snapshot.taken_at)
+    return Decimal(str(snapshot.balance if snapshot else 0)) + Decimal(str(tail.scalar()))
+
+
+# ============== Consistency ==============
+
+@dataclass
+class BalanceMismatch:
+    customer_id: str
+    points_balance: Decimal
+    ledger_balance: Decimal
+
+
+def check_balances(db: Session, chunk_size: int = CUSTOMER_CHUNK_SIZE,
+                   fix: bool = False) -> Iterator[BalanceMismatch]:
+    """
+    Yield customers whose points_balance differs from the sum of their
+    ledger, one chunk of customers (one grouped query) at a time. With
+    fix=True each chunk's balances are reset to the ledger and committed.
+    """
+    last_id = ""
+    while True:
+        ledger = func.coalesce(func.sum(PointTransaction.points_amount), 0)
+        rows = db.query(
+            Customer.customer_id,
+            func.coalesce(Customer.points_balance, 0),
+            ledger
+        ).outerjoin(
+            PointTransaction, PointTransaction.customer_id == Customer.customer_id
+        ).filter(
+            Customer.customer_id > last_id
+        ).group_by(Customer.customer_id, Customer.points_balance).order_by(
+            Customer.customer_id
+        ).limit(chunk_size).all()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+
+        mismatches: List[BalanceMismatch] = [
+            BalanceMismatch(customer_id, Decimal(str(balance)), Decimal(str(ledger_balance)))
+            for customer_id, balance, ledger_balance in rows
+            if Decimal(str(balance)) != Decimal(str(ledger_balance))
+        ]
+        if fix and mismatches:
+            customers = Customer.__table__
+            db.execute(
+                update(customers).where(customers.c.customer_id == bindparam("customer")).values(
+                    points_balance=bindparam("balance")
+                ),
+                [{"customer": m.customer_id, "balance": m.ledger_balance} for m in mismatches]
+            )
+            db.commit()
+        else:
+            db.rollback()  # End the chunk's read transaction
+        yield from mismatches
+
+
+# ============== Worker ==============
+
+class LoyaltyWorker:
+    """Applies queued awards every LOYALTY_AWARD_INTERVAL seconds (sooner after notify()) and takes snapshots"""
+
+    def __init__(self, session_factory):
+        self._session_factory = session_factory
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_snapshot = datetime.utcnow() + timedelta(seconds=LOYALTY_SNAPSHOT_INTERVAL)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="loyalty-worker", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def notify(self):
+        """A payment queued an award: apply it now instead of at the next tick"""
+        self._wake.set()
+
+    def run_once(self):
+        db = self._session_factory()
+        try:
+            while apply_pending_awards(db) == LOYALTY_AWARD_BATCH:
+                pass
+            if datetime.utcnow() >= self._next_snapshot:
+                self._next_snapshot = datetime.utcnow() + timedelta(seconds=LOYALTY_SNAPSHOT_INTERVAL)
+                take_snapshots(db)
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(LOYALTY_AWARD_INTERVAL)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.run_once()
+            except Exception as e:  # Queued awards stay queued for the next tick
+                print(f"⚠️ Loyalty worker: {e}")
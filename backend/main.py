@@ -1,22 +1,46 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Header
+from fastapi import FastAPI, Depends, HTTPException, status, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import case, exists, func, insert, update
+from sqlalchemy.exc import IntegrityError
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
 import uuid
+from collections import defaultdict
 from datetime import datetime, timedelta
 import bcrypt
 import jwt
 from jwt import InvalidTokenError
 import random
+import re
 from typing import List
 from decimal import Decimal
 
 from database import SessionLocal, engine
+from compression import CompressionMiddleware, PrecompressedCache
+from fast_json import TrustedJSONResponse
+from branch_directory import BranchDirectory
+from geo_index import GeoIndex, parse_maps_link, parse_point, valid_coordinates
+from menu_search import MenuSearchIndex
+from menu_resolver import branch_menu_query, effective_fields, priced_items, unit_price
+from qr_tokens import QRTokenSigner
+from table_directory import TableDirectory
+from payment_feed import PaymentFeed
+import qr_render
+import vietqr
+import menu_io
+import bank_statements
+import loyalty
+import daily_stats
+import keyset
+import receipts
+import tempfile
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from models import (
     Base, User, Tenant, Branch, DiningTable,
-    QRCode, Category, MenuItem, Staff, Customer, PointTransaction, Session, Order, OrderItem, Bill
+    QRCode, Category, MenuItem, Staff, Customer, PointTransaction, Session, Order, OrderItem, Bill,
+    MenuItemOverride, LoyaltyAward
 )
 from models import Session as DBSession, Order, OrderItem, Bill
 from models import (
@@ -27,7 +51,9 @@ from models import (
 # Create tables
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Scan&Order API", version="2.0.0")
+# orjson renders every response; hot endpoints return TrustedJSONResponse
+# to also skip response_model re-validation (see fast_json.py)
+app = FastAPI(title="Scan&Order API", version="2.0.0", default_response_class=ORJSONResponse)
 
 # ============== JWT Configuration ==============
 import os
@@ -40,6 +66,9 @@ ACCESS_TOKEN_EXPIRE_HOURS = int(os.getenv("ACCESS_TOKEN_EXPIRE_HOURS", "8"))
 # CORS Configuration
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 
+# Compression Configuration (bodies smaller than this are sent as-is)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
 # CORS middleware
 app.add_middleware(
       CORSMiddleware,
@@ -49,6 +78,62 @@ app.add_middleware(
       allow_headers=["*"],
   )
 
+# Compression middleware (gzip, plus brotli when installed)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+# Precompressed bodies for cacheable public payloads (menus, branch directory)
+response_cache = PrecompressedCache(minimum_size=COMPRESSION_MIN_SIZE)
+
+
+def invalidate_branch_caches(*branch_ids: str):
+    """Drop cached guest payloads after a branch or menu write"""
+    response_cache.bump("branches", *[f"menu:{branch_id}" for branch_id in branch_ids])
+
+
+# Branch summaries + menu item counts, kept current by the write paths below
+branch_directory = BranchDirectory()
+branch_directory.on_change = lambda: response_cache.bump("branches")
+
+# Grid + province index over the directory for "near me" branch discovery
+geo_index = GeoIndex()
+
+# Per-branch inverted index behind the guest menu search
+menu_search = MenuSearchIndex()
+
+
+def menu_branch_ids(db: Session, branch_id: Optional[str], tenant_id: str) -> List[str]:
+    """Branches whose menu includes an item (all of the tenant's for a master item)"""
+    if branch_id:
+        return [branch_id]
+    return [b.branch_id for b in branch_directory.for_tenant(db, tenant_id)]
+
+# Signed QR table tokens (see qr_tokens.py)
+QR_TOKEN_SECRET = os.getenv("QR_TOKEN_SECRET", SECRET_KEY)
+qr_signer = QRTokenSigner(QR_TOKEN_SECRET)
+
+# Table -> branch/tenant/status/QR version, used to resolve QR scans
+table_directory = TableDirectory(qr_signer.version_of)
+
+# Live cashier feed: new cash-pending / QR-paid bills pushed to staff screens
+payment_feed = PaymentFeed()
+
+# Credits queued loyalty awards in the background (see loyalty.py)
+loyalty_worker = loyalty.LoyaltyWorker(SessionLocal)
+
+
+@app.on_event("startup")
+def start_loyalty_worker():
+    loyalty_worker.start()
+
+
+@app.on_event("shutdown")
+def stop_loyalty_worker():
+    loyalty_worker.stop()
+
+# Guest landing page encoded into printed QR stickers (the sticker holds the
+# bare QR token when unset), e.g. https://example.com/guest/menu.html
+QR_GUEST_URL = os.getenv("QR_GUEST_URL", "")
+
 # ============== Database Dependency ==============
 def get_db():
     db = SessionLocal()
@@ -135,6 +220,9 @@ class BranchCreate(BaseModel):
     opening_hours: str  # Format: "HH:MM" (e.g., "08:00")
     closing_hours: str  # Format: "HH:MM" (e.g., "22:00")
     google_maps_link: str  # Google Maps URL
+    # ✅ NEW: Coordinates (parsed from google_maps_link when omitted)
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class BranchUpdate(BaseModel):
     branch_name: Optional[str] = None
@@ -153,19 +241,21 @@ class BranchUpdate(BaseModel):
     opening_hours: Optional[str] = None
     closing_hours: Optional[str] = None
     google_maps_link: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 # ✅ UPDATED: Added menu_item_count field
 class BranchResponse(BaseModel):
     branch_id: str
-    branch_name: str
-    address: str
+    branch_name: Optional[str] = None
+    address: Optional[str] = None
     province: Optional[str] = None
     phone: Optional[str] = None
     manager_name: Optional[str] = None
     cashback_percent: Optional[float] = 1.0
     image: Optional[str] = None
     status: str = "active"
-    created_at: datetime
+    created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     menu_item_count: int = 0  # ✅ NEW: Number of menu items in this branch
     # ✅ NEW: VietQR Bank Information
@@ -176,6 +266,8 @@ class BranchResponse(BaseModel):
     opening_hours: Optional[str] = None
     closing_hours: Optional[str] = None
     google_maps_link: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
     class Config:
         from_attributes = True
@@ -186,6 +278,15 @@ class TableCreate(BaseModel):
     capacity: int
     status: str = "available"
 
+# ✅ NEW: Bulk provisioning - either a numbering pattern or an explicit list
+class TableBulkCreate(BaseModel):
+    pattern: Optional[str] = None  # e.g. "T{n}" or "A-{n:02d}"
+    start: int = 1
+    count: Optional[int] = None
+    table_numbers: Optional[List[str]] = None
+    capacity: int = 4
+    status: str = "available"
+
 class TableUpdate(BaseModel):
     table_number: Optional[str] = None
     capacity: Optional[int] = None
@@ -226,7 +327,7 @@ class CategoryResponse(BaseModel):
 
 class MenuItemCreate(BaseModel):
     category_id: str
-    branch_id: str  # ✅ ADDED
+    branch_id: Optional[str] = None  # ✅ CHANGED: None = tenant master item shared by all branches
     item_name: str
     description: Optional[str] = None
     price: float
@@ -245,14 +346,35 @@ class MenuItemUpdate(BaseModel):
 
 class MenuItemResponse(BaseModel):
     menu_item_id: str
-    item_name: str
-    description: Optional[str]
-    price: float
+    item_name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
     discount_percent: Optional[float] = 0
-    status: str
-    category_id: str
-    branch_id: str  # ✅ ADDED
+    status: Optional[str] = None
+    category_id: Optional[str] = None
+    branch_id: Optional[str] = None  # ✅ ADDED
     image: Optional[str] = None
+    is_hidden: Optional[bool] = None  # Hidden at this branch by an override
+
+    class Config:
+        from_attributes = True
+
+
+# ✅ NEW: Per-branch override of a master menu item (None = inherit)
+class MenuItemOverrideUpdate(BaseModel):
+    price: Optional[float] = None
+    discount_percent: Optional[float] = None
+    status: Optional[str] = None
+    is_hidden: bool = False
+
+class MenuItemOverrideResponse(BaseModel):
+    override_id: str
+    menu_item_id: str
+    branch_id: str
+    price: Optional[float] = None
+    discount_percent: Optional[float] = None
+    status: Optional[str] = None
+    is_hidden: bool
 
     class Config:
         from_attributes = True
@@ -304,6 +426,123 @@ def get_user_role(user, db):
     # Default to owner if no specific role found
     return "owner"
 
+# ============== Sparse Fieldsets ==============
+# List endpoints accept `?fields=a,b,c` (or `fields=*` for everything).
+# Requested keys that are real columns are mapped to load_only(), so columns
+# nobody asked for are never SELECTed from MySQL nor serialized. Heavy
+# columns (base64 images, bank details) are left out of the default set.
+
+BRANCH_LIST_FIELDS = (
+    "branch_id", "branch_name", "address", "province", "phone", "manager_name",
+    "cashback_percent", "image", "status", "created_at", "updated_at", "menu_item_count",
+    "bank_code", "bank_account_number", "bank_account_name",
+    "opening_hours", "closing_hours", "google_maps_link", "latitude", "longitude"
+)
+GUEST_BRANCH_FIELDS = (
+    "branch_id", "branch_name", "address", "province", "phone", "image",
+    "cashback_percent", "menu_item_count", "tenant_name",
+    "opening_hours", "closing_hours", "google_maps_link", "manager_name",
+    "bank_code", "bank_account_number", "bank_account_name", "latitude", "longitude"
+)
+PUBLIC_BRANCH_FIELDS = (
+    "branch_id", "branch_name", "address", "province", "phone", "manager_name",
+    "opening_hours", "closing_hours", "google_maps_link", "cashback_percent",
+    "status", "image", "menu_item_count", "latitude", "longitude"
+)
+BRANCH_HEAVY_FIELDS = ("image", "bank_code", "bank_account_number", "bank_account_name")
+
+MENU_ITEM_LIST_FIELDS = (
+    "menu_item_id", "item_name", "description", "price", "discount_percent",
+    "status", "category_id", "branch_id", "image", "is_hidden"
+)
+GUEST_MENU_ITEM_FIELDS = (
+    "menu_item_id", "item_name", "description", "price", "discount_percent",
+    "status", "category_id", "category_name", "image"
+)
+MENU_ITEM_HEAVY_FIELDS = ("image",)
+
+# Column values that need converting before they go out as JSON
+FIELD_CASTS = {
+    "price": lambda v: float(v) if v is not None else None,
+    "discount_percent": lambda v: float(v) if v else 0,
+    "cashback_percent": lambda v: float(v) if v else 1.0,
+    "latitude": lambda v: float(v) if v is not None else None,
+    "longitude": lambda v: float(v) if v is not None else None,
+}
+
+
+def resolve_fields(fields: Optional[str], allowed: tuple, heavy: tuple = (), id_field: str = None) -> List[str]:
+    """Turn a `fields=` query value into the ordered list of keys to return"""
+    if not fields:
+        selected = [f for f in allowed if f not in heavy]
+    elif fields.strip() == "*":
+        selected = list(allowed)
+    else:
+        requested = {f.strip() for f in fields.split(",") if f.strip()}
+        unknown = requested - set(allowed)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(sorted(unknown))}. Allowed: {', '.join(allowed)}"
+            )
+        # The id is always returned so clients can act on the row
+        if id_field:
+            requested.add(id_field)
+        selected = [f for f in allowed if f in requested]
+    return selected
+
+
+def load_only_fields(model, selected: List[str]):
+    """Build a load_only() option for the selected keys that are columns of model"""
+    columns = model.__table__.columns.keys()
+    attrs = [getattr(model, f) for f in selected if f in columns]
+    if not attrs:
+        attrs = [getattr(model, model.__table__.primary_key.columns.keys()[0])]
+    return load_only(*attrs)
+
+
+def pick_fields(obj, selected: List[str], extra: dict = None) -> dict:
+    """Serialize only the selected keys (never touches deferred columns)"""
+    extra = extra or {}
+    row = {}
+    for field in selected:
+        value = extra[field] if field in extra else getattr(obj, field)
+        cast = FIELD_CASTS.get(field)
+        row[field] = cast(value) if cast else value
+    return row
+
+
+def resolve_coordinates(latitude: Optional[float], longitude: Optional[float], maps_link: Optional[str]):
+    """Explicit coordinates win; otherwise try to read them from the Google Maps link"""
+    if latitude is not None or longitude is not None:
+        if not valid_coordinates(latitude, longitude):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="latitude and longitude must be given together and be valid coordinates"
+            )
+        return latitude, longitude
+    return parse_maps_link(maps_link)
+
+
+def is_open_now(opening_hours: Optional[str], closing_hours: Optional[str], now: datetime = None) -> bool:
+    """Compare "HH:MM" opening hours against the current time (handles past-midnight closing)"""
+    if not opening_hours or not closing_hours:
+        return False
+    current = (now or datetime.now()).strftime("%H:%M")
+    if opening_hours <= closing_hours:
+        return opening_hours <= current <= closing_hours
+    return current >= opening_hours or current <= closing_hours
+
+
+def load_branch_images(db: Session, branch_ids: List[str]) -> dict:
+    """Fetch only the image column for the given branches"""
+    if not branch_ids:
+        return {}
+    return dict(
+        db.query(Branch.branch_id, Branch.image).filter(Branch.branch_id.in_(branch_ids)).all()
+    )
+
+
 # ============== Authentication Dependency ==============
 async def get_current_user(
     authorization: str = Header(None),
@@ -505,8 +744,8 @@ class OrderResponse(BaseModel):
     class Config:
         from_attributes = True
 
-def get_order_response(order: Order, db: Session) -> OrderResponse:
-    """Helper to format order response with all details"""
+def get_order_response(order: Order, db: Session) -> dict:
+    """Helper to format order response with all details (shape of OrderResponse)"""
 
     # Get session and table info
     session = db.query(DBSession).filter(DBSession.session_id == order.session_id).first()
@@ -519,31 +758,227 @@ def get_order_response(order: Order, db: Session) -> OrderResponse:
     items_response = []
     for item in order_items:
         menu_item = db.query(MenuItem).filter(MenuItem.menu_item_id == item.menu_item_id).first()
-        items_response.append(OrderItemResponse(
-            order_item_id=item.order_item_id,
-            menu_item_id=item.menu_item_id,
-            menu_item_name=menu_item.item_name if menu_item else "Unknown",
-            menu_item_image=menu_item.image if menu_item else None,
-            quantity=item.quantity,
-            price=float(item.price),
-            note=item.note if hasattr(item, 'note') else None
-        ))
+        items_response.append({
+            "order_item_id": item.order_item_id,
+            "menu_item_id": item.menu_item_id,
+            "menu_item_name": menu_item.item_name if menu_item else "Unknown",
+            "menu_item_image": menu_item.image if menu_item else None,
+            "quantity": item.quantity,
+            "price": float(item.price),
+            "note": item.note if hasattr(item, 'note') else None
+        })
 
     # Calculate wait time
     wait_minutes = int((datetime.now() - order.order_time).total_seconds() / 60)
 
-    return OrderResponse(
-        order_id=order.order_id,
-        session_id=order.session_id,
-        table_id=table.table_id,
-        table_number=table.table_number,
-        branch_id=branch.branch_id,
-        branch_name=branch.branch_name,
-        status=order.status,
-        order_time=order.order_time,
-        items=items_response,
-        wait_minutes=wait_minutes
+    return {
+        "order_id": order.order_id,
+        "session_id": order.session_id,
+        "table_id": table.table_id,
+        "table_number": table.table_number,
+        "branch_id": branch.branch_id,
+        "branch_name": branch.branch_name,
+        "status": order.status,
+        "order_time": order.order_time,
+        "items": items_response,
+        "wait_minutes": wait_minutes
+    }
+
+
+# ============== Bill Totals ==============
+
+VAT_RATE = Decimal('0.1')
+
+
+def add_to_bill(db: Session, session_id: str, subtotal_delta: Decimal, cashback_percent: Optional[Decimal] = None):
+    """
+    Add newly ordered lines worth subtotal_delta to the session's bill, in the
+    caller's transaction. Uses one relative UPDATE (subtotal = subtotal + :delta),
+    so concurrent orders on the same session never overwrite each other; the
+    bill is created with the first order. With cashback_percent, the points
+    earned grow with the bill total.
+    """
+    vat_delta = (subtotal_delta * VAT_RATE).quantize(Decimal('0.01'))
+    total_delta = subtotal_delta + vat_delta
+
+    values = {
+        "subtotal": Bill.subtotal + subtotal_delta,
+        "vat_amount": Bill.vat_amount + vat_delta,
+        "total_amount": Bill.total_amount + total_delta,
+    }
+    if cashback_percent is not None:
+        values["points_earned"] = func.coalesce(Bill.points_earned, 0) + total_delta * cashback_percent / 100
+
+    def apply_delta() -> bool:
+        result = db.execute(
+            update(Bill).where(Bill.session_id == session_id).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount > 0
+
+    if apply_delta():
+        return
+
+    try:
+        with db.begin_nested():
+            db.add(Bill(
+                bill_id=str(uuid.uuid4()),
+                session_id=session_id,
+                subtotal=subtotal_delta,
+                vat_amount=vat_delta,
+                total_amount=total_delta,
+                points_earned=total_delta * cashback_percent / 100 if cashback_percent is not None else 0,
+                points_redeemed=0,
+                status="pending",
+                payment_method=None
+            ))
+        print(f"✅ New bill created: {total_delta}đ")
+    except IntegrityError:
+        # Another request opened the bill first: add to it instead
+        apply_delta()
+
+
+# ============== Open Tabs ==============
+# A tab groups the sessions at a table that are paid together: every session
+# opened while the table has an open tab joins it, and the tab closes once its
+# bills are paid. Billing reads the current tab's sessions through the indexed
+# session.tab_id instead of scanning the table's sessions by date.
+# A tab nobody pays is voided when staff free the table, or by the next scan
+# once its first session is older than TAB_MAX_AGE_HOURS.
+
+TAB_MAX_AGE_HOURS = float(os.getenv("TAB_MAX_AGE_HOURS", "12"))
+
+
+def open_tab_for(db: Session, table_id: str) -> str:
+    """tab_id of the table's open tab, opening a new one if needed (caller's transaction)"""
+    tab_id = db.query(DiningTable.open_tab_id).filter(DiningTable.table_id == table_id).scalar()
+    if tab_id:
+        if not tab_expired(db, tab_id):
+            return tab_id
+        # Left open by a party that walked out: don't bill the next guests for it
+        void_tab(db, table_id, tab_id)
+
+    tab_id = str(uuid.uuid4())
+    opened = db.execute(
+        update(DiningTable).where(
+            DiningTable.table_id == table_id,
+            DiningTable.open_tab_id.is_(None)
+        ).values(open_tab_id=tab_id).execution_options(synchronize_session=False)
+    ).rowcount
+    if not opened:
+        # Another request opened one first: join it (locking read sees the latest value)
+        tab_id = db.query(DiningTable.open_tab_id).filter(
+            DiningTable.table_id == table_id
+        ).with_for_update().scalar()
+    return tab_id
+
+
+def tab_filter(session):
+    """Filter for the sessions on the same tab as session"""
+    if session.tab_id:
+        return DBSession.tab_id == session.tab_id
+    # Sessions opened before tabs existed are billed on their own
+    return DBSession.session_id == session.session_id
+
+
+def close_tab_if_settled(db: Session, table_id: str, tab_id: Optional[str]):
+    """Close the table's tab once none of its bills is left unpaid (caller's transaction)"""
+    if not tab_id:
+        return
+    db.flush()
+    unpaid = db.query(exists().where(
+        Bill.session_id == DBSession.session_id,
+        DBSession.tab_id == tab_id,
+        Bill.status.notin_(PAID_BILL_STATUSES)
+    )).scalar()
+    if not unpaid:
+        closed = db.execute(
+            update(DiningTable).where(
+                DiningTable.table_id == table_id,
+                DiningTable.open_tab_id == tab_id
+            ).values(open_tab_id=None).execution_options(synchronize_session=False)
+        ).rowcount
+        if closed:
+            print(f"🧾 Tab {tab_id} closed")
+        table = table_directory.get(db, table_id) if closed else None
+        if table:
+            # ✅ NEW: The tab's sessions are the day's covers (counted once, by whoever closes it)
+            covers = db.query(func.count(DBSession.session_id)).filter(DBSession.tab_id == tab_id).scalar()
+            daily_stats.record(db, table.branch_id, daily_stats.settlement_date(), covers=covers)
+
+
+def tab_expired(db: Session, tab_id: str) -> bool:
+    """Whether the tab's first session started more than TAB_MAX_AGE_HOURS ago"""
+    opened_at = db.query(func.min(DBSession.start_time)).filter(DBSession.tab_id == tab_id).scalar()
+    return opened_at is not None and opened_at < datetime.now() - timedelta(hours=TAB_MAX_AGE_HOURS)
+
+
+def void_tab(db: Session, table_id: str, tab_id: str) -> List[str]:
+    """
+    Close a tab that will not be paid (caller's transaction): its unpaid bills
+    become 'void' and its active session ends. Returns the voided bill ids.
+    """
+    db.execute(
+        update(DiningTable).where(
+            DiningTable.table_id == table_id,
+            DiningTable.open_tab_id == tab_id
+        ).values(open_tab_id=None).execution_options(synchronize_session=False)
     )
+    voided = [bill_id for (bill_id,) in db.query(Bill.bill_id).join(
+        DBSession, Bill.session_id == DBSession.session_id
+    ).filter(
+        DBSession.tab_id == tab_id,
+        Bill.status.notin_(PAID_BILL_STATUSES)
+    ).all()]
+    if voided:
+        db.execute(
+            update(Bill).where(
+                Bill.bill_id.in_(voided),
+                Bill.status.notin_(PAID_BILL_STATUSES)
+            ).values(status="void").execution_options(synchronize_session=False)
+        )
+    db.execute(
+        update(DBSession).where(
+            DBSession.tab_id == tab_id,
+            DBSession.status == "active"
+        ).values(status="void", end_time=datetime.utcnow()).execution_options(synchronize_session=False)
+    )
+    print(f"🧾 Tab {tab_id} voided ({len(voided)} unpaid bills)")
+    return voided
+
+
+def get_or_open_session(db: Session, table_id: str, customer_id: Optional[str] = None):
+    """
+    (active session of the table, created?) - opening one if there is none.
+    The unique session.active_table_id makes concurrent scans at one table
+    race safely: the losing insert fails and fetches the winner's session.
+    """
+    active = db.query(DBSession).filter(
+        DBSession.table_id == table_id,
+        DBSession.status == "active"
+    )
+    existing = active.first()
+    if existing and existing.tab_id and tab_expired(db, existing.tab_id):
+        void_tab(db, table_id, existing.tab_id)
+        existing = None
+    if existing:
+        return existing, False
+
+    new_session = DBSession(
+        session_id=str(uuid.uuid4()),
+        table_id=table_id,
+        customer_id=customer_id,  # None for guests, UUID for customers
+        start_time=datetime.now(),
+        status="active",
+        tab_id=open_tab_for(db, table_id)  # ✅ NEW: Joins the table's unpaid tab
+    )
+    try:
+        with db.begin_nested():
+            db.add(new_session)
+        return new_session, True
+    except IntegrityError:
+        # Locking read: sees the other request's committed session
+        return active.with_for_update().one(), False
 
 
 # ============== ORDER ENDPOINTS ==============
@@ -574,21 +1009,9 @@ async def create_order(
         )
 
     # Create or get active session for this table
-    active_session = db.query(DBSession).filter(
-        DBSession.table_id == order_data.table_id,
-        DBSession.status == 'active'
-    ).first()
-
-    if not active_session:
-        session_id = str(uuid.uuid4())
-        active_session = DBSession(
-            session_id=session_id,
-            table_id=order_data.table_id,
-            customer_id=order_data.customer_id,
-            status='active'
-        )
-        db.add(active_session)
+    active_session, created = get_or_open_session(db, order_data.table_id, order_data.customer_id)
 
+    if created:
         # Update table status to occupied
         table.status = 'occupied'
         db.flush()
@@ -603,12 +1026,17 @@ async def create_order(
     db.add(new_order)
     db.flush()
 
+    # Effective prices for this branch's menu (master items with overrides), one query
+    table_entry = table_directory.get(db, table.table_id)
+    menu_prices = priced_items(
+        db, table.branch_id, table_entry.tenant_id, [item.menu_item_id for item in order_data.items]
+    )
+
     # Add order items
+    items_total = Decimal('0')
     for item_data in order_data.items:
-        # Verify menu item exists
-        menu_item = db.query(MenuItem).filter(
-            MenuItem.menu_item_id == item_data.menu_item_id
-        ).first()
+        # Verify menu item is on this branch's menu
+        menu_item = menu_prices.get(item_data.menu_item_id)
 
         if not menu_item:
             db.rollback()
@@ -618,8 +1046,7 @@ async def create_order(
             )
 
         # Calculate price with discount
-        discount = Decimal(str(menu_item.discount_percent or 0))
-        final_price = menu_item.price * (Decimal('1') - discount / Decimal('100'))
+        final_price = unit_price(menu_item)
 
         order_item_id = str(uuid.uuid4())
         order_item = OrderItem(
@@ -631,10 +1058,16 @@ async def create_order(
             note=item_data.note
         )
         db.add(order_item)
+        items_total += final_price * item_data.quantity
+
+    # ✅ NEW: Keep the session's bill total in step with its items
+    add_to_bill(db, active_session.session_id, items_total)
+    daily_stats.record(db, table.branch_id, daily_stats.order_date(), orders=1)
 
     try:
         db.commit()
         db.refresh(new_order)
+        table_directory.set_status(table.table_id, table.status)
 
         # Return formatted response
         return get_order_response(new_order, db)
@@ -675,7 +1108,8 @@ async def get_all_orders(
     # Order by creation time
     orders = query.order_by(Order.order_time.desc()).all()
 
-    return [get_order_response(order, db) for order in orders]
+    # Built here from DB rows, so skip re-validating every order through OrderResponse
+    return TrustedJSONResponse([get_order_response(order, db) for order in orders])
 
 
 @app.get("/api/orders/{order_id}", response_model=OrderResponse)
@@ -813,9 +1247,8 @@ async def generate_random_order(
     table = random.choice(tables)
 
     # Get all menu items for this branch
-    menu_items = db.query(MenuItem).filter(
-        MenuItem.branch_id == branch_id,
-        MenuItem.status == 'available'
+    menu_items = branch_menu_query(
+        db, branch_id, branch.tenant_id, MenuItem.menu_item_id, statuses=("available",)
     ).all()
 
     if not menu_items:
@@ -856,6 +1289,63 @@ async def generate_random_order(
     # Call the create_order function
     return await create_order(order_data, db)
 
+# ============== CUSTOMER POINTS ENDPOINTS ==============
+
+@app.get("/api/customers/me/points")
+async def get_my_points(
+    at: Optional[datetime] = None,
+    limit: int = 20,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    The customer's points: current balance, points still being credited and
+    the latest transactions. With ?at=<datetime>, the ledger balance at that
+    time and the transactions before it (read from the nearest balance
+    snapshot plus the transactions after it, see loyalty.py).
+    """
+    customer = db.query(Customer).options(
+        load_only(Customer.customer_id, Customer.points_balance)
+    ).filter(Customer.user_id == current_user.user_id).first()
+    if not customer:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Customer profile not found"
+        )
+
+    pending = db.query(func.coalesce(func.sum(LoyaltyAward.points), 0)).filter(
+        LoyaltyAward.customer_id == customer.customer_id,
+        LoyaltyAward.applied_at.is_(None)
+    ).scalar()
+
+    transactions = db.query(
+        PointTransaction.transaction_id, PointTransaction.bill_id, PointTransaction.transaction_type,
+        PointTransaction.points_amount, PointTransaction.description, PointTransaction.created_at
+    ).filter(PointTransaction.customer_id == customer.customer_id)
+    if at is not None:
+        transactions = transactions.filter(PointTransaction.created_at <= at)
+    transactions = transactions.order_by(PointTransaction.created_at.desc()).limit(min(max(limit, 1), 100))
+
+    return {
+        "customer_id": customer.customer_id,
+        "points_balance": float(customer.points_balance or 0),
+        "pending_points": float(pending),
+        "at": at,
+        "balance_at": float(loyalty.balance_at(db, customer.customer_id, at)) if at is not None else None,
+        "transactions": [
+            {
+                "transaction_id": row.transaction_id,
+                "bill_id": row.bill_id,
+                "transaction_type": row.transaction_type,
+                "points_amount": float(row.points_amount),
+                "description": row.description,
+                "created_at": row.created_at
+            }
+            for row in transactions
+        ]
+    }
+
+
 # ============== CASHBACK SETTINGS ENDPOINTS ==============
 
 @app.get("/api/tenants/{tenant_id}/cashback-settings", response_model=CashbackSettingsResponse)
@@ -933,6 +1423,10 @@ async def create_branch(
 ):
     """Create a new branch"""
 
+    coordinates = resolve_coordinates(
+        branch_data.latitude, branch_data.longitude, branch_data.google_maps_link
+    ) or (None, None)
+
     branch_id = str(uuid.uuid4())
     new_branch = Branch(
         branch_id=branch_id,
@@ -952,7 +1446,9 @@ async def create_branch(
         # ✅ NEW: Opening hours and location info
         opening_hours=branch_data.opening_hours,
         closing_hours=branch_data.closing_hours,
-        google_maps_link=branch_data.google_maps_link
+        google_maps_link=branch_data.google_maps_link,
+        latitude=coordinates[0],
+        longitude=coordinates[1]
     )
 
     db.add(new_branch)
@@ -960,6 +1456,8 @@ async def create_branch(
     try:
         db.commit()
         db.refresh(new_branch)
+        branch_directory.upsert_branch(new_branch, current_user.tenant)
+        invalidate_branch_caches(branch_id)
 
         # ✅ Add menu_item_count to response
         response = BranchResponse.model_validate(new_branch)
@@ -974,13 +1472,19 @@ async def create_branch(
 
 
 # ✅ UPDATED: Modified to include menu item count
-@app.get("/api/branches", response_model=List[BranchResponse])
+@app.get("/api/branches", response_model=List[BranchResponse], response_model_exclude_unset=True)
 async def get_branches(
     tenant_id: str,
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all branches for a tenant with menu item counts"""
+    """
+    Get all branches for a tenant with menu item counts
+
+    `fields` is a comma-separated list of keys to return (`*` for all).
+    By default images and bank details are omitted.
+    """
 
     # Verify user has access to this tenant
     if current_user.tenant_id != tenant_id:
@@ -989,46 +1493,20 @@ async def get_branches(
             detail="You don't have access to this tenant"
         )
 
-    # Get branches with menu item counts
-    branches = db.query(
-        Branch,
-        func.count(MenuItem.menu_item_id).label('menu_item_count')
-    ).outerjoin(
-        MenuItem, Branch.branch_id == MenuItem.branch_id
-    ).filter(
-        Branch.tenant_id == tenant_id
-    ).group_by(
-        Branch.branch_id
-    ).all()
+    selected = resolve_fields(fields, BRANCH_LIST_FIELDS, BRANCH_HEAVY_FIELDS, id_field="branch_id")
 
-    # Convert to response format
-    result = []
-    for branch, count in branches:
-        branch_dict = {
-            "branch_id": branch.branch_id,
-            "branch_name": branch.branch_name,
-            "address": branch.address,
-            "province": branch.province,
-            "phone": branch.phone,
-            "manager_name": branch.manager_name,
-            "cashback_percent": float(branch.cashback_percent) if branch.cashback_percent else 1.0,
-            "image": branch.image,
-            "status": branch.status,
-            "created_at": branch.created_at,
-            "updated_at": None,
-            "menu_item_count": count,
-            # ✅ NEW: Include opening hours and location
-            "opening_hours": branch.opening_hours,
-            "closing_hours": branch.closing_hours,
-            "google_maps_link": branch.google_maps_link,
-            # ✅ NEW: Include VietQR Bank Information
-            "bank_code": branch.bank_code,
-            "bank_account_number": branch.bank_account_number,
-            "bank_account_name": branch.bank_account_name
-        }
-        result.append(BranchResponse(**branch_dict))
+    # Branch summaries and menu item counts come from the in-memory directory
+    branches = branch_directory.for_tenant(db, tenant_id)
+    images = load_branch_images(db, [b.branch_id for b in branches]) if "image" in selected else {}
 
-    return result
+    return [
+        pick_fields(branch, selected, {
+            "menu_item_count": branch.menu_item_count,
+            "updated_at": None,
+            "image": images.get(branch.branch_id)
+        })
+        for branch in branches
+    ]
 
 
 @app.get("/api/branches/{branch_id}", response_model=BranchResponse)
@@ -1053,14 +1531,9 @@ async def get_branch(
             detail="You don't have access to this branch"
         )
 
-    # ✅ Get menu item count for this branch
-    menu_item_count = db.query(func.count(MenuItem.menu_item_id)).filter(
-        MenuItem.branch_id == branch_id
-    ).scalar()
-
     # Convert to response with count
     response = BranchResponse.model_validate(branch)
-    response.menu_item_count = menu_item_count or 0
+    response.menu_item_count = branch_directory.menu_item_count(db, branch_id)
     return response
 
 
@@ -1116,19 +1589,26 @@ async def update_branch(
         branch.opening_hours = branch_data.opening_hours
     if branch_data.closing_hours is not None:
         branch.closing_hours = branch_data.closing_hours
+    link_changed = (branch_data.google_maps_link is not None
+                    and branch_data.google_maps_link != branch.google_maps_link)
     if branch_data.google_maps_link is not None:
         branch.google_maps_link = branch_data.google_maps_link
+    # ✅ NEW: Coordinates, explicit or re-read from a changed Google Maps link
+    if branch_data.latitude is not None or branch_data.longitude is not None or branch_data.google_maps_link is not None:
+        coordinates = resolve_coordinates(branch_data.latitude, branch_data.longitude, branch_data.google_maps_link)
+        if coordinates:
+            branch.latitude, branch.longitude = coordinates
+        elif link_changed:
+            # The new link has no coordinates (e.g. a short link): don't keep the old location
+            branch.latitude = branch.longitude = None
 
     db.commit()
     db.refresh(branch)
-
-    # ✅ Get menu item count
-    menu_item_count = db.query(func.count(MenuItem.menu_item_id)).filter(
-        MenuItem.branch_id == branch_id
-    ).scalar()
+    branch_directory.upsert_branch(branch)
+    invalidate_branch_caches(branch_id)
 
     response = BranchResponse.model_validate(branch)
-    response.menu_item_count = menu_item_count or 0
+    response.menu_item_count = branch_directory.menu_item_count(db, branch_id)
     return response
 
 
@@ -1156,6 +1636,10 @@ async def delete_branch(
 
     db.delete(branch)
     db.commit()
+    branch_directory.remove_branch(branch_id)
+    menu_search.drop_branch(branch_id)
+    table_directory.remove_branch(branch_id)
+    invalidate_branch_caches(branch_id)
     return None
 
 
@@ -1195,9 +1679,9 @@ async def create_table(
 
     db.add(new_table)
 
-    # Create QR code for the table
+    # Create QR code for the table (signed branch/table token, version 1)
     qr_id = str(uuid.uuid4())
-    qr_content = f"{branch_id}|{table_id}"
+    qr_content = qr_signer.sign(branch_id, table_id, 1)
 
     new_qr = QRCode(
         qr_id=qr_id,
@@ -1211,6 +1695,7 @@ async def create_table(
     try:
         db.commit()
         db.refresh(new_table)
+        table_directory.upsert_table(new_table, branch.tenant_id, 1)
         return new_table
     except Exception as e:
         db.rollback()
@@ -1220,6 +1705,138 @@ async def create_table(
         )
 
 
+MAX_BULK_TABLES = 500
+TABLE_PATTERN = re.compile(r"^[^{}]*\{n(?::0?\d{0,2}d)?\}[^{}]*$")
+
+
+def expand_table_numbers(data: TableBulkCreate) -> List[str]:
+    """Table numbers requested by a bulk create (pattern or explicit list)"""
+    if data.table_numbers is not None:
+        if data.pattern is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Give either pattern or table_numbers, not both"
+            )
+        numbers = [number.strip() for number in data.table_numbers]
+    else:
+        if not data.pattern or not data.count:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Give table_numbers, or a pattern with a count"
+            )
+        if not TABLE_PATTERN.match(data.pattern):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="pattern must contain exactly one {n} (optionally zero-padded, e.g. {n:02d})"
+            )
+        if data.count < 0 or data.count > MAX_BULK_TABLES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"count must be between 1 and {MAX_BULK_TABLES}"
+            )
+        numbers = [data.pattern.format(n=n) for n in range(data.start, data.start + data.count)]
+
+    if not numbers or len(numbers) > MAX_BULK_TABLES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Between 1 and {MAX_BULK_TABLES} tables can be created at once"
+        )
+    if any(not number or len(number) > 20 for number in numbers):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Table numbers must be 1-20 characters"
+        )
+    duplicates = sorted({number for number in numbers if numbers.count(number) > 1})
+    if duplicates:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Duplicate table numbers: {', '.join(duplicates)}"
+        )
+    return numbers
+
+
+@app.post("/api/branches/{branch_id}/tables:bulk", response_model=List[TableResponse], status_code=status.HTTP_201_CREATED)
+async def create_tables_bulk(
+    branch_id: str,
+    table_data: TableBulkCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Create many tables (with their QR codes) for a branch in one transaction
+
+    Example bodies:
+    - {"pattern": "T{n}", "start": 1, "count": 80, "capacity": 4}
+    - {"table_numbers": ["VIP-1", "VIP-2", "Terrace"], "capacity": 6}
+
+    Fails with 409 if any of the table numbers already exists in the branch.
+    """
+
+    branch = db.query(Branch).options(
+        load_only(Branch.branch_id, Branch.tenant_id)
+    ).filter(Branch.branch_id == branch_id).first()
+    if not branch:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Branch not found"
+        )
+
+    # Verify user has access to this tenant
+    if current_user.tenant_id != branch.tenant_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this branch"
+        )
+
+    numbers = expand_table_numbers(table_data)
+
+    existing = {
+        number for (number,) in db.query(DiningTable.table_number).filter(
+            DiningTable.branch_id == branch_id,
+            DiningTable.table_number.in_(numbers)
+        )
+    }
+    if existing:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Tables already exist: {', '.join(sorted(existing))}"
+        )
+
+    table_rows, qr_rows = [], []
+    for number in numbers:
+        table_id = str(uuid.uuid4())
+        table_rows.append({
+            "table_id": table_id,
+            "branch_id": branch_id,
+            "table_number": number,
+            "capacity": table_data.capacity,
+            "status": table_data.status
+        })
+        qr_rows.append({
+            "qr_id": str(uuid.uuid4()),
+            "table_id": table_id,
+            "qr_content": qr_signer.sign(branch_id, table_id, 1),
+            "is_active": True
+        })
+
+    try:
+        db.execute(insert(DiningTable), table_rows)
+        db.execute(insert(QRCode), qr_rows)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+    for row in table_rows:
+        table_directory.upsert_table(DiningTable(**row), branch.tenant_id, 1)
+
+    print(f"✅ Created {len(table_rows)} tables for branch {branch_id}")
+    return table_rows
+
+
 @app.get("/api/branches/{branch_id}/tables", response_model=List[TableResponse])
 async def get_tables(
     branch_id: str,
@@ -1304,8 +1921,16 @@ async def update_table(
     if table_data.status is not None:
         table.status = table_data.status
 
+    # ✅ NEW: Freeing a table closes the tab its last party left unpaid
+    voided = []
+    if table_data.status == "available" and table.open_tab_id:
+        voided = void_tab(db, table.table_id, table.open_tab_id)
+
     db.commit()
     db.refresh(table)
+    table_directory.upsert_table(table, branch.tenant_id)
+    for bill_id in voided:
+        payment_feed.publish(table.branch_id, "settled", {"bill_id": bill_id})
     return table
 
 
@@ -1334,6 +1959,7 @@ async def delete_table(
 
     db.delete(table)
     db.commit()
+    table_directory.remove_table(table_id)
     return None
 
 
@@ -1370,36 +1996,160 @@ async def get_qr_code(
     return qr_code
 
 
-# ============== CATEGORY ENDPOINTS ==============
-
-@app.post("/api/categories", response_model=CategoryResponse, status_code=status.HTTP_201_CREATED)
-async def create_category(
-    category_data: CategoryCreate,
+@app.post("/api/tables/{table_id}/qr-code/regenerate", response_model=QRCodeResponse)
+async def regenerate_qr_code(
+    table_id: str,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Create a new category"""
-
-    category_id = str(uuid.uuid4())
-    new_category = Category(
-        category_id=category_id,
-        tenant_id=current_user.tenant_id,
-        category_name=category_data.category_name,
-        description=category_data.description,
-        status=category_data.status
-    )
+    """
+    Issue a new QR token for a table
 
-    db.add(new_category)
+    Bumps the table's QR version, so previously printed QR codes for this
+    table stop resolving. Also upgrades tables still on the old plain
+    "branch_id|table_id" content.
+    """
 
-    try:
-        db.commit()
-        db.refresh(new_category)
-        return new_category
-    except Exception as e:
-        db.rollback()
+    table = db.query(DiningTable).filter(DiningTable.table_id == table_id).first()
+    if not table:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=str(e)
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Table not found"
+        )
+
+    branch = db.query(Branch).filter(Branch.branch_id == table.branch_id).first()
+    if current_user.tenant_id != branch.tenant_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this table"
+        )
+
+    qr_code = db.query(QRCode).filter(QRCode.table_id == table_id).first()
+    if not qr_code:
+        qr_code = QRCode(qr_id=str(uuid.uuid4()), table_id=table_id, is_active=True)
+        db.add(qr_code)
+
+    version = qr_signer.version_of(qr_code.qr_content) + 1
+    qr_code.qr_content = qr_signer.sign(table.branch_id, table_id, version)
+    qr_code.is_active = True
+
+    db.commit()
+    db.refresh(qr_code)
+    table_directory.upsert_table(table, branch.tenant_id, version)
+
+    print(f"🔐 QR code for table {table.table_number} regenerated (version {version})")
+    return qr_code
+
+
+def qr_sticker_data(branch_id: str, table_id: str, qr_content: str) -> str:
+    """What a printed QR sticker encodes for a table"""
+    if not QR_GUEST_URL:
+        return qr_content
+    return f"{QR_GUEST_URL}?branch_id={branch_id}&table_id={table_id}&qr={qr_content}"
+
+
+@app.get("/api/branches/{branch_id}/qr-codes.zip")
+async def download_branch_qr_codes(
+    branch_id: str,
+    format: str = "png",
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Download printable QR images (PNG or SVG) for every table of a branch as a ZIP
+
+    Images are rendered in a process pool and cached on disk until the
+    table's QR code is regenerated; the archive is streamed entry by entry.
+    """
+
+    if format not in qr_render.QR_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of: {', '.join(qr_render.QR_FORMATS)}"
+        )
+
+    if not qr_render.available():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="QR rendering is not installed on this server (missing 'qrcode' package)"
+        )
+
+    branch = db.query(Branch).options(
+        load_only(Branch.branch_id, Branch.tenant_id)
+    ).filter(Branch.branch_id == branch_id).first()
+    if not branch:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Branch not found"
+        )
+
+    # Verify user has access to this tenant
+    if current_user.tenant_id != branch.tenant_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this branch"
+        )
+
+    rows = db.query(DiningTable.table_id, DiningTable.table_number, QRCode.qr_content).join(
+        QRCode, QRCode.table_id == DiningTable.table_id
+    ).filter(
+        DiningTable.branch_id == branch_id,
+        QRCode.is_active == True
+    ).order_by(DiningTable.table_number).all()
+
+    if not rows:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No tables with QR codes found in this branch"
+        )
+
+    items, used_names = [], set()
+    for table_id, table_number, qr_content in rows:
+        name = re.sub(r"[^A-Za-z0-9_-]+", "_", table_number).strip("_") or table_id
+        if name in used_names:
+            name = f"{name}-{table_id[:8]}"
+        used_names.add(name)
+        items.append((f"table-{name}.{format}", qr_sticker_data(branch_id, table_id, qr_content)))
+
+    files = await run_in_threadpool(qr_render.render_qr_images, items, format)
+
+    return StreamingResponse(
+        qr_render.stream_zip(files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="qr-codes-{branch_id}.zip"'}
+    )
+
+
+# ============== CATEGORY ENDPOINTS ==============
+
+@app.post("/api/categories", response_model=CategoryResponse, status_code=status.HTTP_201_CREATED)
+async def create_category(
+    category_data: CategoryCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Create a new category"""
+
+    category_id = str(uuid.uuid4())
+    new_category = Category(
+        category_id=category_id,
+        tenant_id=current_user.tenant_id,
+        category_name=category_data.category_name,
+        description=category_data.description,
+        status=category_data.status
+    )
+
+    db.add(new_category)
+
+    try:
+        db.commit()
+        db.refresh(new_category)
+        return new_category
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
         )
 
 
@@ -1440,19 +2190,20 @@ async def create_menu_item(
             detail="Category not found"
         )
 
-    # ✅ ADDED: Verify branch exists and belongs to user's tenant
-    branch = db.query(Branch).filter(Branch.branch_id == item_data.branch_id).first()
-    if not branch:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Branch not found"
-        )
+    # ✅ ADDED: Verify branch exists and belongs to user's tenant (no branch = master menu item)
+    if item_data.branch_id is not None:
+        branch = db.query(Branch).filter(Branch.branch_id == item_data.branch_id).first()
+        if not branch:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Branch not found"
+            )
 
-    if branch.tenant_id != current_user.tenant_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You don't have access to this branch"
-        )
+        if branch.tenant_id != current_user.tenant_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You don't have access to this branch"
+            )
 
     # Verify user has access to this tenant
     if current_user.tenant_id != category.tenant_id:
@@ -1484,6 +2235,13 @@ async def create_menu_item(
     try:
         db.commit()
         db.refresh(new_item)
+        branch_directory.item_added(new_item.branch_id, new_item.status, tenant_id=category.tenant_id)
+        branch_ids = menu_branch_ids(db, new_item.branch_id, category.tenant_id)
+        if new_item.branch_id:
+            menu_search.item_changed(new_item, category.category_name)
+        else:
+            menu_search.drop_branch(*branch_ids)
+        invalidate_branch_caches(*branch_ids)
         return new_item
     except Exception as e:
         db.rollback()
@@ -1493,14 +2251,19 @@ async def create_menu_item(
         )
 
 
-@app.get("/api/categories/{category_id}/menu-items", response_model=List[MenuItemResponse])
+@app.get("/api/categories/{category_id}/menu-items", response_model=List[MenuItemResponse], response_model_exclude_unset=True)
 async def get_menu_items_by_category(
     category_id: str,
-    branch_id: str,  # ✅ ADDED query parameter
+    branch_id: Optional[str] = None,  # ✅ CHANGED: omit to list the tenant's master items
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all menu items in a category for a specific branch"""
+    """
+    Get all menu items in a category for a specific branch
+    (the branch's own items plus master items with its overrides applied),
+    or the tenant's master items when no branch_id is given
+    """
 
     category = db.query(Category).filter(Category.category_id == category_id).first()
     if not category:
@@ -1516,22 +2279,38 @@ async def get_menu_items_by_category(
             detail="You don't have access to this category"
         )
 
+    selected = resolve_fields(fields, MENU_ITEM_LIST_FIELDS, MENU_ITEM_HEAVY_FIELDS, id_field="menu_item_id")
+
+    if branch_id is None:
+        items = db.query(MenuItem).options(
+            load_only_fields(MenuItem, selected)
+        ).filter(
+            MenuItem.category_id == category_id,
+            MenuItem.branch_id.is_(None)
+        ).all()
+        return [pick_fields(item, selected, {"is_hidden": False}) for item in items]
+
     # ✅ CHANGED: Filter by both category_id AND branch_id
-    items = db.query(MenuItem).filter(
-        MenuItem.category_id == category_id,
-        MenuItem.branch_id == branch_id
-    ).all()
-    return items
+    rows = branch_menu_query(
+        db, branch_id, category.tenant_id, MenuItem, include_hidden=True
+    ).options(
+        load_only_fields(MenuItem, selected)
+    ).filter(MenuItem.category_id == category_id).all()
+    return [
+        pick_fields(row[0], selected, {**effective_fields(row), "is_hidden": bool(row.is_hidden)})
+        for row in rows
+    ]
 
 
 # ✅ NEW ENDPOINT: Get all menu items by branch
-@app.get("/api/branches/{branch_id}/menu-items", response_model=List[MenuItemResponse])
+@app.get("/api/branches/{branch_id}/menu-items", response_model=List[MenuItemResponse], response_model_exclude_unset=True)
 async def get_menu_items_by_branch(
     branch_id: str,
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all menu items for a specific branch"""
+    """Get all menu items for a specific branch (own items + master items with overrides)"""
 
     branch = db.query(Branch).filter(Branch.branch_id == branch_id).first()
     if not branch:
@@ -1547,8 +2326,15 @@ async def get_menu_items_by_branch(
             detail="You don't have access to this branch"
         )
 
-    items = db.query(MenuItem).filter(MenuItem.branch_id == branch_id).all()
-    return items
+    selected = resolve_fields(fields, MENU_ITEM_LIST_FIELDS, MENU_ITEM_HEAVY_FIELDS, id_field="menu_item_id")
+
+    rows = branch_menu_query(
+        db, branch_id, branch.tenant_id, MenuItem, include_hidden=True
+    ).options(load_only_fields(MenuItem, selected)).all()
+    return [
+        pick_fields(row[0], selected, {**effective_fields(row), "is_hidden": bool(row.is_hidden)})
+        for row in rows
+    ]
 
 
 @app.get("/api/menu-items/{menu_item_id}", response_model=MenuItemResponse)
@@ -1602,6 +2388,7 @@ async def update_menu_item(
         )
 
     # ✅ NEW: Validate new category if being changed
+    new_category = None
     if item_data.category_id is not None and item_data.category_id != item.category_id:
         new_category = db.query(Category).filter(Category.category_id == item_data.category_id).first()
         if not new_category:
@@ -1622,6 +2409,8 @@ async def update_menu_item(
                 detail="Discount percent must be between 0 and 100"
             )
 
+    old_status = item.status
+
     if item_data.item_name is not None:
         item.item_name = item_data.item_name
     if item_data.description is not None:
@@ -1639,6 +2428,13 @@ async def update_menu_item(
 
     db.commit()
     db.refresh(item)
+    branch_directory.item_status_changed(item.branch_id, old_status, item.status, tenant_id=category.tenant_id)
+    branch_ids = menu_branch_ids(db, item.branch_id, category.tenant_id)
+    if item.branch_id:
+        menu_search.item_changed(item, (new_category or category).category_name)
+    else:
+        menu_search.drop_branch(*branch_ids)
+    invalidate_branch_caches(*branch_ids)
     return item
 
 
@@ -1665,11 +2461,317 @@ async def delete_menu_item(
             detail="You don't have access to this menu item"
         )
 
+    branch_id, item_status = item.branch_id, item.status
     db.delete(item)
     db.commit()
+    branch_directory.item_removed(branch_id, item_status, tenant_id=category.tenant_id)
+    branch_ids = menu_branch_ids(db, branch_id, category.tenant_id)
+    if branch_id:
+        menu_search.item_removed(branch_id, menu_item_id)
+    else:
+        menu_search.drop_branch(*branch_ids)
+    invalidate_branch_caches(*branch_ids)
+    return None
+
+
+# ============== MENU OVERRIDE ENDPOINTS ==============
+
+def get_override_target(db: Session, branch_id: str, menu_item_id: str, current_user: User):
+    """Load and authorize the (branch, master item) pair of an override"""
+    branch = db.query(Branch).options(
+        load_only(Branch.branch_id, Branch.tenant_id)
+    ).filter(Branch.branch_id == branch_id).first()
+    if not branch:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Branch not found"
+        )
+
+    if current_user.tenant_id != branch.tenant_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this branch"
+        )
+
+    item = db.query(MenuItem).options(
+        load_only(MenuItem.menu_item_id, MenuItem.branch_id, MenuItem.category_id)
+    ).join(Category).filter(
+        MenuItem.menu_item_id == menu_item_id,
+        Category.tenant_id == branch.tenant_id
+    ).first()
+    if not item:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Menu item not found"
+        )
+
+    if item.branch_id is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only shared master menu items can be overridden; edit branch items directly"
+        )
+
+    return branch, item
+
+
+@app.get("/api/branches/{branch_id}/menu-overrides", response_model=List[MenuItemOverrideResponse])
+async def get_menu_overrides(
+    branch_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get this branch's overrides of the tenant master menu"""
+
+    branch = db.query(Branch).options(
+        load_only(Branch.branch_id, Branch.tenant_id)
+    ).filter(Branch.branch_id == branch_id).first()
+    if not branch:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Branch not found"
+        )
+
+    if current_user.tenant_id != branch.tenant_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this branch"
+        )
+
+    return db.query(MenuItemOverride).filter(MenuItemOverride.branch_id == branch_id).all()
+
+
+@app.put("/api/branches/{branch_id}/menu-items/{menu_item_id}/override", response_model=MenuItemOverrideResponse)
+async def set_menu_override(
+    branch_id: str,
+    menu_item_id: str,
+    override_data: MenuItemOverrideUpdate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Set how a master menu item appears at this branch
+
+    Replaces the whole override: price / discount_percent / status left
+    as null inherit the master item's value; is_hidden removes the item
+    from this branch's menu.
+    """
+
+    get_override_target(db, branch_id, menu_item_id, current_user)
+
+    if override_data.discount_percent is not None and not (0 <= override_data.discount_percent <= 100):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Discount percent must be between 0 and 100"
+        )
+
+    if override_data.price is not None and override_data.price < 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Price must not be negative"
+        )
+
+    if override_data.status is not None and override_data.status not in menu_io.MENU_ITEM_STATUSES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Status must be one of: {', '.join(menu_io.MENU_ITEM_STATUSES)}"
+        )
+
+    override = db.query(MenuItemOverride).filter(
+        MenuItemOverride.branch_id == branch_id,
+        MenuItemOverride.menu_item_id == menu_item_id
+    ).first()
+    if not override:
+        override = MenuItemOverride(
+            override_id=str(uuid.uuid4()),
+            branch_id=branch_id,
+            menu_item_id=menu_item_id
+        )
+        db.add(override)
+
+    override.price = override_data.price
+    override.discount_percent = override_data.discount_percent
+    override.status = override_data.status
+    override.is_hidden = override_data.is_hidden
+
+    db.commit()
+    db.refresh(override)
+    menu_search.drop_branch(branch_id)
+    invalidate_branch_caches(branch_id)
+    return override
+
+
+@app.delete("/api/branches/{branch_id}/menu-items/{menu_item_id}/override", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_menu_override(
+    branch_id: str,
+    menu_item_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Drop a branch override so the master item applies unchanged"""
+
+    get_override_target(db, branch_id, menu_item_id, current_user)
+
+    db.query(MenuItemOverride).filter(
+        MenuItemOverride.branch_id == branch_id,
+        MenuItemOverride.menu_item_id == menu_item_id
+    ).delete(synchronize_session=False)
+    db.commit()
+    menu_search.drop_branch(branch_id)
+    invalidate_branch_caches(branch_id)
     return None
 
 
+# ✅ NEW: Bulk menu import / export (see menu_io.py)
+MAX_MENU_IMPORT_BYTES = int(os.getenv("MAX_MENU_IMPORT_BYTES", str(50 * 1024 * 1024)))
+MENU_IMPORT_SPOOL_BYTES = 1024 * 1024  # Larger uploads are spooled to disk
+
+
+@app.post("/api/branches/{branch_id}/menu-items/import")
+async def import_menu_items(
+    branch_id: str,
+    request: Request,
+    format: Optional[str] = None,
+    create_categories: bool = True,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Import menu items from a CSV or JSON request body
+
+    The body is the raw file (Content-Type: text/csv, application/json or
+    application/x-ndjson; or pass ?format=csv|json). Items are upserted by
+    item name within the branch; unknown categories are created unless
+    create_categories=false. Rows are committed in chunks, and rows that
+    fail validation are skipped and reported with their row number.
+    """
+
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "json")
+    if fmt not in menu_io.IMPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of: {', '.join(menu_io.IMPORT_FORMATS)}"
+        )
+
+    branch = db.query(Branch).options(
+        load_only(Branch.branch_id, Branch.tenant_id)
+    ).filter(Branch.branch_id == branch_id).first()
+    if not branch:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Branch not found"
+        )
+
+    # Verify user has access to this tenant
+    if current_user.tenant_id != branch.tenant_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this branch"
+        )
+
+    upload = tempfile.SpooledTemporaryFile(max_size=MENU_IMPORT_SPOOL_BYTES)
+    try:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > MAX_MENU_IMPORT_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Import file is larger than {MAX_MENU_IMPORT_BYTES // (1024 * 1024)} MB"
+                )
+            upload.write(chunk)
+        upload.seek(0)
+
+        result = await run_in_threadpool(
+            menu_io.import_menu_rows, db, branch_id, branch.tenant_id,
+            menu_io.read_rows(upload, fmt), create_categories
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        # Earlier chunks may be committed: rebuild the in-memory indexes from the database
+        db.rollback()
+        branch_directory.reload(db)
+        menu_search.drop_branch(branch_id)
+        invalidate_branch_caches(branch_id)
+        if isinstance(e, (ValueError, UnicodeDecodeError)):
+            # Unreadable file (bad encoding, malformed JSON array)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Could not read import file: {e}"
+            )
+        print(f"❌ Menu import for branch {branch_id} failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Menu import failed; rows before the failure may have been imported"
+        )
+    finally:
+        upload.close()
+
+    for item_status, count in result.inserted_statuses.items():
+        branch_directory.item_added(branch_id, item_status, count)
+    for old_status, new_status in result.status_changes:
+        branch_directory.item_status_changed(branch_id, old_status, new_status)
+    menu_search.drop_branch(branch_id)
+    invalidate_branch_caches(branch_id)
+
+    print(f"📝 Menu import for branch {branch_id}: {result.inserted} inserted, "
+          f"{result.updated} updated, {result.failed} failed")
+    return result.summary()
+
+
+@app.get("/api/branches/{branch_id}/menu-items/export")
+async def export_menu_items(
+    branch_id: str,
+    format: str = "csv",
+    include_images: bool = False,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Export a branch's menu as CSV or NDJSON (same columns the import accepts)
+
+    Streamed from a server-side cursor; images are left out unless
+    include_images=true.
+    """
+
+    if format not in menu_io.EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of: {', '.join(menu_io.EXPORT_FORMATS)}"
+        )
+
+    branch = db.query(Branch).options(
+        load_only(Branch.branch_id, Branch.tenant_id)
+    ).filter(Branch.branch_id == branch_id).first()
+    if not branch:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Branch not found"
+        )
+
+    # Verify user has access to this tenant
+    if current_user.tenant_id != branch.tenant_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this branch"
+        )
+
+    def stream():
+        # Own session: the stream outlives the request's dependency scope
+        export_db = SessionLocal()
+        try:
+            yield from menu_io.export_menu_rows(export_db, branch_id, format, include_images)
+        finally:
+            export_db.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="menu-{branch_id}.{format}"'}
+    )
+
+
 # ============== STATS ENDPOINT ==============
 
 @app.get("/api/stats/{tenant_id}")
@@ -1697,54 +2799,24 @@ async def get_dashboard_stats(
         Branch.status == "active"
     ).count()
 
-    # ── Revenue base: Bill → Session → Table → Branch, scoped to tenant + paid bills ──
-    bill_base = (
-        db.query(Bill)
-        .join(DBSession, Bill.session_id == DBSession.session_id)
-        .join(DiningTable, DBSession.table_id == DiningTable.table_id)
-        .join(Branch, DiningTable.branch_id == Branch.branch_id)
-        .filter(
-            Branch.tenant_id == tenant_id,
-            Bill.status.in_(["paid", "verified"])
-        )
-    )
-
-    # Today's revenue: sum of paid bills where session ended today
-    today_revenue = (
-        bill_base
-        .filter(func.date(DBSession.end_time) == today)
-        .with_entities(func.coalesce(func.sum(Bill.total_amount), 0))
-        .scalar()
-    )
-
-    # Monthly revenue: sum of paid bills where session ended from 1st of current month onward
-    monthly_revenue = (
-        bill_base
-        .filter(func.date(DBSession.end_time) >= first_of_month)
-        .with_entities(func.coalesce(func.sum(Bill.total_amount), 0))
-        .scalar()
-    )
-
-    # Today's orders: count of orders placed today (all statuses — reflects activity)
-    today_orders = (
-        db.query(func.count(Order.order_id))
-        .join(DBSession, Order.session_id == DBSession.session_id)
-        .join(DiningTable, DBSession.table_id == DiningTable.table_id)
-        .join(Branch, DiningTable.branch_id == Branch.branch_id)
-        .filter(
-            Branch.tenant_id == tenant_id,
-            func.date(Order.order_time) == today
-        )
-        .scalar()
+    # ✅ CHANGED: Revenue and orders come from the daily rollup (see daily_stats.py)
+    # instead of summing bills over the session/table/branch joins
+    today_revenue, today_bills, today_orders, today_covers = daily_stats.totals(
+        db, tenant_id=tenant_id, start=today, end=today
     )
+    monthly_revenue, monthly_bills, _, _ = daily_stats.totals(db, tenant_id=tenant_id, start=first_of_month)
 
     return {
         "total_branches": total_branches,
         "total_tables": total_tables,
         "active_branches": active_branches,
         "today_revenue": float(today_revenue),
-        "today_orders": today_orders,
-        "monthly_revenue": float(monthly_revenue)
+        "today_orders": int(today_orders),
+        "today_bills": int(today_bills),
+        "today_covers": int(today_covers),
+        "today_average_ticket": daily_stats.average_ticket(today_revenue, today_bills),
+        "monthly_revenue": float(monthly_revenue),
+        "monthly_average_ticket": daily_stats.average_ticket(monthly_revenue, monthly_bills)
     }
 
 # ============== ADMIN ENDPOINTS (No Authentication Required) ==============
@@ -1794,159 +2866,219 @@ async def get_admin_stats(db: Session = Depends(get_db)):
     }
 
 
+ADMIN_PAGE_LIMIT = 100
+
+
+def keyset_page(query, keys, types, cursor: Optional[str], page: int, limit: int, descending: bool):
+    """
+    (rows, next_cursor) of one page of query ordered by keys (the last one
+    unique): past the cursor's row when given (see keyset.py), else at
+    offset (page - 1) * limit for jumping straight to a page number.
+    """
+    query = query.order_by(*keyset.order_by(keys, descending))
+    if cursor:
+        try:
+            values = keyset.decode(cursor, types)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        query = query.filter(keyset.after(keys, values, descending))
+    else:
+        query = query.offset((max(page, 1) - 1) * limit)
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, keyset.encode([getattr(last, key.name) for key in keys])
+
+
+RESTAURANT_SORTS = ("name", "owner_name", "owner_email", "branch_count", "revenue", "status", "created_at")
+
+
 @app.get("/api/admin/restaurants")
 async def get_all_restaurants(
     page: int = 1,
     limit: int = 5,
     search: str = None,
+    sort: str = "name",
+    order: str = "asc",
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    '''Get all restaurants with pagination - NO AUTH REQUIRED'''
+    '''Get all restaurants with pagination - NO AUTH REQUIRED
 
-    query = db.query(Tenant)
+    ✅ CHANGED: One query for the page (owner, branch count and revenue
+    joined in per tenant) and one for the total, instead of three queries
+    per restaurant. Sorted by any column (sort, order=asc|desc); pass the
+    previous page's next_cursor to continue after it, or page to jump.
+    '''
+
+    if sort not in RESTAURANT_SORTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"sort must be one of: {', '.join(RESTAURANT_SORTS)}"
+        )
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="order must be asc or desc")
+    limit = min(max(limit, 1), ADMIN_PAGE_LIMIT)
+
+    # Owner: the tenant's first user that is not staff
+    owner_id = db.query(User.user_id).filter(
+        User.tenant_id == Tenant.tenant_id,
+        ~exists().where(Staff.user_id == User.user_id)
+    ).order_by(User.created_at, User.user_id).limit(1).correlate(Tenant).scalar_subquery()
+    branches = db.query(
+        Branch.tenant_id, func.count(Branch.branch_id).label("branch_count")
+    ).group_by(Branch.tenant_id).subquery()
+    stats = daily_stats.tenant_totals(db)
+
+    columns = {
+        "tenant_id": Tenant.tenant_id.label("tenant_id"),
+        "name": Tenant.tenant_name.label("name"),
+        "owner_name": func.coalesce(User.full_name, "").label("owner_name"),
+        "owner_email": func.coalesce(User.email, "").label("owner_email"),
+        "branch_count": func.coalesce(branches.c.branch_count, 0).label("branch_count"),
+        "revenue": func.coalesce(stats.c.revenue, 0).label("revenue"),
+        "status": Tenant.status.label("status"),
+        "created_at": Tenant.created_at.label("created_at"),
+    }
+    query = db.query(Tenant).outerjoin(
+        User, User.user_id == owner_id
+    ).outerjoin(
+        branches, branches.c.tenant_id == Tenant.tenant_id
+    ).outerjoin(
+        stats, stats.c.tenant_id == Tenant.tenant_id
+    )
 
     # Search filter
     if search:
-        query = query.filter(Tenant.tenant_name.contains(search))
+        query = query.filter(
+            Tenant.tenant_name.contains(search) |
+            User.full_name.contains(search) |
+            User.email.contains(search)
+        )
 
     # Get total count
-    total = query.count()
-
-    # Pagination
-    offset = (page - 1) * limit
-    restaurants = query.offset(offset).limit(limit).all()
+    total = query.with_entities(func.count(Tenant.tenant_id)).scalar()
+
+    sort_type = {
+        "branch_count": int, "revenue": Decimal, "created_at": datetime.fromisoformat
+    }.get(sort, str)
+    restaurants, next_cursor = keyset_page(
+        query.with_entities(*columns.values()),
+        [columns[sort], columns["tenant_id"]], [sort_type, str], cursor, page, limit, order == "desc"
+    )
 
     # Format response
-    results = []
-    for restaurant in restaurants:
-        # Get branch count and total revenue
-        branch_count = db.query(Branch).filter(Branch.tenant_id == restaurant.tenant_id).count()
-
-        # Calculate total revenue from all branches of this tenant
-        total_revenue = db.query(func.sum(Bill.total_amount)).join(
-            DBSession, Bill.session_id == DBSession.session_id
-        ).join(
-            DiningTable, DBSession.table_id == DiningTable.table_id
-        ).join(
-            Branch, DiningTable.branch_id == Branch.branch_id
-        ).filter(
-            Branch.tenant_id == restaurant.tenant_id,
-            Bill.status == "paid"
-        ).scalar() or 0
-
-        # Get owner info (first user of tenant)
-        owner = db.query(User).filter(User.tenant_id == restaurant.tenant_id).first()
-
-        results.append({
-            "tenant_id": restaurant.tenant_id,
-            "name": restaurant.tenant_name,
-            "owner_name": owner.full_name if owner else "N/A",
-            "owner_email": owner.email if owner else "N/A",
-            "branch_count": branch_count,
-            "revenue": float(total_revenue),
-            "status": restaurant.status,
-            "created_at": restaurant.created_at.strftime("%d/%m/%Y") if restaurant.created_at else ""
-        })
+    results = [{
+        "tenant_id": restaurant.tenant_id,
+        "name": restaurant.name,
+        "owner_name": restaurant.owner_name or "N/A",
+        "owner_email": restaurant.owner_email or "N/A",
+        "branch_count": int(restaurant.branch_count),
+        "revenue": float(restaurant.revenue),
+        "status": restaurant.status,
+        "created_at": restaurant.created_at.strftime("%d/%m/%Y") if restaurant.created_at else ""
+    } for restaurant in restaurants]
 
     return {
         "data": results,
         "total": total,
         "page": page,
         "limit": limit,
-        "total_pages": (total + limit - 1) // limit
+        "total_pages": (total + limit - 1) // limit,
+        "sort": sort,
+        "order": order,
+        "next_cursor": next_cursor
     }
 
 
+REVENUE_SORTS = ("revenue", "orders", "name")
+
+
 @app.get("/api/admin/revenue")
 async def get_all_revenue(
     page: int = 1,
     limit: int = 5,
     period: str = "today",  # ✅ NEW: "today" (default), "month", or "all"
+    sort: str = "revenue",
+    order: str = "desc",
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     '''Get revenue statistics for all restaurants - NO AUTH REQUIRED
     
     Args:
-        page: Page number for pagination
+        page: Page number for pagination (ignored when cursor is given)
         limit: Items per page
         period: Time period - "today" (default), "month", or "all"
-    '''
-
-    today = datetime.now().date()
-    first_of_month = today.replace(day=1)
-
-    # Get all tenants
-    query = db.query(Tenant).filter(Tenant.status == "active")
-    total = query.count()
-
-    # Pagination
-    offset = (page - 1) * limit
-    restaurants = query.offset(offset).limit(limit).all()
-
-    # Format response
-    results = []
-    total_orders_count = 0
-
-    for restaurant in restaurants:
-        # Build order query base
-        order_query = db.query(Order).join(
-            DBSession, Order.session_id == DBSession.session_id
-        ).join(
-            DiningTable, DBSession.table_id == DiningTable.table_id
-        ).join(
-            Branch, DiningTable.branch_id == Branch.branch_id
-        ).filter(
-            Branch.tenant_id == restaurant.tenant_id
-        )
-        
-        # ✅ FIXED: Apply date filter based on period to match owner dashboard
-        if period == "today":
-            order_query = order_query.filter(func.date(Order.order_time) == today)
-        elif period == "month":
-            order_query = order_query.filter(func.date(Order.order_time) >= first_of_month)
-        # "all" - no date filter
-        
-        order_count = order_query.count()
-
-        # Build revenue query base
-        revenue_query = db.query(func.sum(Bill.total_amount)).join(
-            DBSession, Bill.session_id == DBSession.session_id
-        ).join(
-            DiningTable, DBSession.table_id == DiningTable.table_id
-        ).join(
-            Branch, DiningTable.branch_id == Branch.branch_id
-        ).filter(
-            Branch.tenant_id == restaurant.tenant_id,
-            Bill.status.in_(["paid", "verified"])
+        sort: "revenue" (default), "orders" or "name"
+        order: "desc" (default) or "asc"
+        cursor: next_cursor of the previous page, to continue after it
+
+    ✅ CHANGED: One grouped query over the daily rollup for the page, and
+    one for the totals, instead of two 4-way joins per tenant.
+    '''
+
+    if sort not in REVENUE_SORTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"sort must be one of: {', '.join(REVENUE_SORTS)}"
         )
-        
-        # ✅ FIXED: Apply date filter based on period to match owner dashboard
-        if period == "today":
-            revenue_query = revenue_query.filter(func.date(Bill.created_at) == today)
-        elif period == "month":
-            revenue_query = revenue_query.filter(func.date(Bill.created_at) >= first_of_month)
-        # "all" - no date filter
-        
-        revenue = revenue_query.scalar() or 0
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="order must be asc or desc")
+    limit = min(max(limit, 1), ADMIN_PAGE_LIMIT)
 
-        total_orders_count += order_count
+    today = datetime.now().date()
+    if period == "today":
+        start = today
+    elif period == "month":
+        start = today.replace(day=1)
+    else:  # "all" - no date filter
+        start = None
+
+    stats = daily_stats.tenant_totals(db, start)
+    revenue = func.coalesce(stats.c.revenue, 0).label("revenue")
+    orders = func.coalesce(stats.c.orders, 0).label("orders")
+    name = Tenant.tenant_name.label("name")
+    tenant_id = Tenant.tenant_id.label("tenant_id")
+
+    active = db.query(Tenant).outerjoin(
+        stats, stats.c.tenant_id == Tenant.tenant_id
+    ).filter(Tenant.status == "active")
+
+    # Totals cover every active tenant, whatever the page
+    total, total_orders, total_revenue = active.with_entities(
+        func.count(Tenant.tenant_id), func.coalesce(func.sum(orders), 0), func.coalesce(func.sum(revenue), 0)
+    ).one()
+
+    sort_key, sort_type = {"revenue": (revenue, Decimal), "orders": (orders, int), "name": (name, str)}[sort]
+    rows, next_cursor = keyset_page(
+        active.with_entities(tenant_id, name, Tenant.status, orders, revenue),
+        [sort_key, tenant_id], [sort_type, str], cursor, page, limit, order == "desc"
+    )
 
-        results.append({
-            "tenant_id": restaurant.tenant_id,
-            "name": restaurant.tenant_name,
-            "orders": order_count,
-            "revenue": float(revenue),
-            "status": restaurant.status
-        })
+    results = [{
+        "tenant_id": row.tenant_id,
+        "name": row.name,
+        "orders": int(row.orders),
+        "revenue": float(row.revenue),
+        "status": row.status
+    } for row in rows]
 
     return {
         "data": results,
         "total": total,
-        "total_orders": total_orders_count,
+        "total_orders": int(total_orders),
+        "total_revenue": float(total_revenue),
         "page": page,
         "limit": limit,
         "total_pages": (total + limit - 1) // limit,
-        "period": period  # ✅ NEW: Return which period was used
+        "period": period,  # ✅ NEW: Return which period was used
+        "sort": sort,
+        "order": order,
+        "next_cursor": next_cursor
     }
 
 
@@ -2065,6 +3197,8 @@ async def update_restaurant_status_admin(
 
     restaurant.status = status_data.get("status", "active")
     db.commit()
+    branch_directory.update_tenant(restaurant)
+    invalidate_branch_caches()
 
     return {
         "message": "Restaurant status updated successfully",
@@ -2112,6 +3246,8 @@ async def update_restaurant_admin(
                 owner.email = update_data.owner_email
 
     db.commit()
+    branch_directory.update_tenant(restaurant)
+    invalidate_branch_caches()
 
     return {
         "message": "Restaurant updated successfully",
@@ -2134,9 +3270,15 @@ async def delete_restaurant_admin(
             detail="Restaurant not found"
         )
 
+    branch_ids = [b.branch_id for b in db.query(Branch.branch_id).filter(Branch.tenant_id == tenant_id)]
+
     # Delete restaurant (cascade will handle related data)
     db.delete(restaurant)
     db.commit()
+    branch_directory.remove_tenant(tenant_id)
+    menu_search.drop_branch(*branch_ids)
+    table_directory.remove_tenant(tenant_id)
+    invalidate_branch_caches(*branch_ids)
 
     return {
         "message": "Restaurant deleted successfully",
@@ -2253,14 +3395,14 @@ async def delete_user_admin(
 class GuestBranchResponse(BaseModel):
     """Public branch information for guest selection"""
     branch_id: str
-    branch_name: str
-    address: str
-    province: Optional[str]
-    phone: Optional[str]
-    image: Optional[str]
-    cashback_percent: float
-    menu_item_count: int
-    tenant_name: str
+    branch_name: Optional[str] = None
+    address: Optional[str] = None
+    province: Optional[str] = None
+    phone: Optional[str] = None
+    image: Optional[str] = None
+    cashback_percent: Optional[float] = None
+    menu_item_count: Optional[int] = None
+    tenant_name: Optional[str] = None
     # ✅ NEW: Additional fields for AI chatbot and restaurant view
     opening_hours: Optional[str] = None
     closing_hours: Optional[str] = None
@@ -2269,6 +3411,9 @@ class GuestBranchResponse(BaseModel):
     bank_code: Optional[str] = None
     bank_account_number: Optional[str] = None
     bank_account_name: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    distance_km: Optional[float] = None  # Only with ?near=
 
     class Config:
         from_attributes = True
@@ -2281,7 +3426,8 @@ class GuestSessionCreate(BaseModel):
     - If provided: Session is linked to customer (can earn points)
     - If None: Session is for a guest (anonymous)
     """
-    table_id: str
+    table_id: Optional[str] = None
+    qr_token: Optional[str] = None  # ✅ NEW: Signed token from the table's QR code (instead of table_id)
     customer_id: Optional[str] = None  # None for guests, UUID for customers
 
 class GuestSessionResponse(BaseModel):
@@ -2297,7 +3443,7 @@ class GuestSessionResponse(BaseModel):
 class GuestOrderItemCreate(BaseModel):
     menu_item_id: str
     quantity: int
-    price: float
+    price: Optional[float] = None  # ✅ CHANGED: Ignored - priced server-side from the branch menu
     note: Optional[str] = None
 
 class GuestOrderCreate(BaseModel):
@@ -2318,14 +3464,14 @@ class GuestOrderResponse(BaseModel):
 
 class GuestMenuItemResponse(BaseModel):
     menu_item_id: str
-    item_name: str
-    description: Optional[str]
-    price: float
-    discount_percent: float
-    status: str
-    category_id: str
-    category_name: str
-    image: Optional[str]
+    item_name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    discount_percent: Optional[float] = None
+    status: Optional[str] = None
+    category_id: Optional[str] = None
+    category_name: Optional[str] = None
+    image: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -2352,57 +3498,107 @@ def get_db():
 # GUEST ORDERING ENDPOINTS
 # ============================================
 
-@app.get("/api/guest/branches", response_model=List[GuestBranchResponse])
-async def get_guest_branches(db: Session = Depends(get_db)):
+@app.get("/api/guest/branches", response_model=List[GuestBranchResponse], response_model_exclude_unset=True)
+async def get_guest_branches(
+    request: Request,
+    fields: Optional[str] = None,
+    near: Optional[str] = None,
+    radius: float = 10.0,
+    province: Optional[str] = None,
+    open_now: Optional[bool] = None,
+    limit: int = 20,
+    db: Session = Depends(get_db)
+):
     """
     Get all active branches for guest selection
     PUBLIC ENDPOINT - No authentication required
 
     This is used by guests to select which restaurant branch to order from.
     Returns branch info including menu item count.
+    `fields` selects the keys to return (`*` for all); images and bank
+    details are omitted unless requested.
+
+    Discovery filters (answered from the in-memory geo/province index):
+    - near=lat,lng: nearest branches within `radius` km, closest first,
+      with `distance_km` (at most `limit` results)
+    - province: exact province match, diacritics/case-insensitive
+    - open_now=true: only branches currently inside their opening hours;
+      on by default with near= ("near me" is asked to go eat now), pass
+      open_now=false to include closed branches
     """
 
-    # Get all active branches with menu counts
-    branches = db.query(
-        Branch,
-        func.count(MenuItem.menu_item_id).label('menu_item_count'),
-        Tenant.tenant_name
-    ).outerjoin(
-        MenuItem, Branch.branch_id == MenuItem.branch_id
-    ).join(
-        Tenant, Branch.tenant_id == Tenant.tenant_id
-    ).filter(
-        Branch.status == 'active',
-        Tenant.status == 'active'
-    ).group_by(
-        Branch.branch_id,
-        Tenant.tenant_name
-    ).all()
+    selected = resolve_fields(fields, GUEST_BRANCH_FIELDS, BRANCH_HEAVY_FIELDS, id_field="branch_id")
+    if open_now is None:
+        open_now = bool(near)
 
-    result = []
-    for branch, count, tenant_name in branches:
-        result.append({
-            "branch_id": branch.branch_id,
-            "branch_name": branch.branch_name,
-            "address": branch.address,
-            "province": branch.province,
-            "phone": branch.phone,
-            "image": branch.image,
-            "cashback_percent": float(branch.cashback_percent) if branch.cashback_percent else 1.0,
-            "menu_item_count": count,
-            "tenant_name": tenant_name,
-            # ✅ NEW: Additional fields for AI chatbot
-            "opening_hours": branch.opening_hours,
-            "closing_hours": branch.closing_hours,
-            "google_maps_link": branch.google_maps_link,
-            "manager_name": branch.manager_name,
-            "bank_code": branch.bank_code,
-            "bank_account_number": branch.bank_account_number,
-            "bank_account_name": branch.bank_account_name
-        })
+    if near or province or open_now:
+        return find_guest_branches(db, selected, near, radius, province, open_now, limit)
 
-    print(f"📋 Retrieved {len(result)} active branches for guest selection")
-    return result
+    # Load (or TTL-refresh) the directory before the cache picks its version
+    branch_directory.ensure_loaded(db)
+
+    def build():
+        # Active branches of active tenants, with counts, straight from memory
+        branches = branch_directory.listed(db)
+        images = load_branch_images(db, [b.branch_id for b in branches]) if "image" in selected else {}
+
+        result = [
+            pick_fields(branch, selected, {
+                "menu_item_count": branch.menu_item_count,
+                "image": images.get(branch.branch_id)
+            })
+            for branch in branches
+        ]
+
+        print(f"📋 Retrieved {len(result)} active branches for guest selection")
+        return result
+
+    # Served precompressed from memory until a branch/menu write bumps the version
+    return response_cache.respond(request, f"guest-branches:{','.join(selected)}", "branches", build)
+
+
+def find_guest_branches(db: Session, selected: List[str], near: Optional[str], radius: float,
+                        province: Optional[str], open_now: bool, limit: int):
+    """Filtered branch discovery for get_guest_branches (not response-cached)"""
+    if radius <= 0 or limit <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="radius and limit must be positive"
+        )
+
+    geo_index.sync(branch_directory, db)
+
+    if near:
+        try:
+            lat, lng = parse_point(near)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="near must be 'latitude,longitude'"
+            )
+        # Over-fetch when filtering by opening hours so `limit` still fills up
+        hits = geo_index.nearest(lat, lng, radius, None if open_now else limit, province)
+        selected = selected + ["distance_km"]
+    elif province:
+        hits = [(summary, None) for summary in geo_index.in_province(province)]
+    else:
+        hits = [(summary, None) for summary in branch_directory.listed(db)]
+
+    if open_now:
+        now = datetime.now()
+        hits = [hit for hit in hits if is_open_now(hit[0].opening_hours, hit[0].closing_hours, now)]
+    hits = hits[:limit] if near else hits
+
+    images = load_branch_images(db, [summary.branch_id for summary, _ in hits]) if "image" in selected else {}
+
+    return TrustedJSONResponse([
+        pick_fields(summary, selected, {
+            "menu_item_count": summary.menu_item_count,
+            "image": images.get(summary.branch_id),
+            "distance_km": round(distance, 3) if distance is not None else None
+        })
+        for summary, distance in hits
+    ])
 
 
 @app.post("/api/guest/sessions", response_model=GuestSessionResponse)
@@ -2423,10 +3619,16 @@ async def create_guest_session(
     NOTE: This is the CRITICAL point where we distinguish guests from customers!
     """
 
-    # Verify table exists
-    table = db.query(DiningTable).filter(
-        DiningTable.table_id == session_data.table_id
-    ).first()
+    # Verify table exists (from the table directory, or straight from a signed QR token)
+    if session_data.qr_token:
+        table = resolve_qr_token(session_data.qr_token, db)
+    elif session_data.table_id:
+        table = table_directory.get(db, session_data.table_id)
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="table_id or qr_token is required"
+        )
 
     if not table:
         raise HTTPException(
@@ -2450,40 +3652,30 @@ async def create_guest_session(
     else:
         print(f"👤 Creating session for GUEST (anonymous)")
 
-    # Check if there's already an active session for this table
-    existing_session = db.query(DBSession).filter(
-        DBSession.table_id == session_data.table_id,
-        DBSession.status == "active"
-    ).first()
+    # ✅ CHANGED: Insert-or-fetch, so simultaneous scans share one active session
+    session, created = get_or_open_session(db, table.table_id, session_data.customer_id)
 
-    if existing_session:
+    if not created:
         # ✅ FIXED: Return existing session to allow multiple orders
-        print(f"♻️ Reusing existing active session: {existing_session.session_id}")
+        db.commit()
+        print(f"♻️ Reusing existing active session: {session.session_id}")
         print(f"   → This allows accumulating multiple orders in one dining session")
-        return existing_session
-
-    # Create new session
-    new_session = DBSession(
-        session_id=str(uuid.uuid4()),
-        table_id=session_data.table_id,
-        customer_id=session_data.customer_id,  # None for guests, UUID for customers
-        start_time=datetime.now(),
-        status="active"
-    )
-
-    db.add(new_session)
+        return session
 
     # Update table status
-    table.status = "occupied"
+    db.query(DiningTable).filter(DiningTable.table_id == table.table_id).update(
+        {"status": "occupied"}, synchronize_session=False
+    )
 
     db.commit()
-    db.refresh(new_session)
+    db.refresh(session)
+    table_directory.set_status(table.table_id, "occupied")
 
-    print(f"✅ Session created: {new_session.session_id}")
+    print(f"✅ Session created: {session.session_id}")
     print(f"   - Table: {table.table_number}")
-    print(f"   - Customer ID: {new_session.customer_id or 'GUEST'}")
+    print(f"   - Customer ID: {session.customer_id or 'GUEST'}")
 
-    return new_session
+    return session
 
 
 @app.post("/api/guest/orders", response_model=GuestOrderResponse)
@@ -2532,6 +3724,7 @@ async def create_guest_order(
         Order.session_id == order_data.session_id
     ).first()
 
+    created = order is None
     if order:
         # ✅ FIXED: Accumulate items in existing order
         print(f"♻️ Adding items to existing order: {order.order_id}")
@@ -2550,11 +3743,15 @@ async def create_guest_order(
     # ✅ FIXED: Add new order items (accumulative)
     new_items_total = Decimal('0')
 
+    # ✅ CHANGED: Prices come from the branch menu (master items + overrides), not the client
+    table_entry = table_directory.get(db, session.table_id)
+    menu_prices = priced_items(
+        db, table_entry.branch_id, table_entry.tenant_id, [item.menu_item_id for item in order_data.items]
+    )
+
     for item_data in order_data.items:
-        # Verify menu item exists
-        menu_item = db.query(MenuItem).filter(
-            MenuItem.menu_item_id == item_data.menu_item_id
-        ).first()
+        # Verify menu item is on this branch's menu
+        menu_item = menu_prices.get(item_data.menu_item_id)
 
         if not menu_item:
             raise HTTPException(
@@ -2562,6 +3759,14 @@ async def create_guest_order(
                 detail=f"Menu item {item_data.menu_item_id} not found"
             )
 
+        if menu_item.effective_status != "available":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{menu_item.item_name} is not available right now"
+            )
+
+        price = unit_price(menu_item)
+
         # ✅ FIXED: Create new order item (don't check for duplicates)
         # If guest orders the same dish twice, create two separate order items
         order_item = OrderItem(
@@ -2569,73 +3774,47 @@ async def create_guest_order(
             order_id=order.order_id,
             menu_item_id=item_data.menu_item_id,
             quantity=item_data.quantity,
-            price=Decimal(str(item_data.price)),
+            price=price,
             note=item_data.note
         )
 
         db.add(order_item)
-        new_items_total += Decimal(str(item_data.price)) * item_data.quantity
+        new_items_total += price * item_data.quantity
 
     print(f"💰 New items total: {new_items_total}đ")
 
-    # ✅ FIXED: Create or update bill (ACCUMULATIVE)
-    bill = db.query(Bill).filter(
-        Bill.session_id == order_data.session_id
-    ).first()
-
-    if bill:
-        # ✅ FIXED: Add to existing total (accumulative)
-        old_total = bill.total_amount
-        bill.total_amount += new_items_total
-        print(f"♻️ Updated bill: {old_total}đ → {bill.total_amount}đ (+{new_items_total}đ)")
-    else:
-        # Create new bill (first order)
-        bill = Bill(
-            bill_id=str(uuid.uuid4()),
-            session_id=order_data.session_id,
-            total_amount=new_items_total,
-            status="pending",
-            payment_method=None
-        )
-        db.add(bill)
-        print(f"✅ New bill created: {new_items_total}đ")
-
-    # ✅ FIXED: Calculate points on CUMULATIVE total
+    # ✅ CHANGED: Add to the bill atomically (UPDATE ... SET subtotal = subtotal + :delta);
+    # for customers, points are earned on the full bill total
+    cashback_percent = None
     if session.customer_id:
-        # Get branch's cashback percentage
-        table = db.query(DiningTable).filter(
-            DiningTable.table_id == session.table_id
-        ).first()
-
-        branch = db.query(Branch).filter(
-            Branch.branch_id == table.branch_id
-        ).first()
-
-        cashback_percent = branch.cashback_percent if branch else Decimal('1.0')
-
-        # ✅ FIXED: Calculate points on FULL bill total (not just new items)
-        points_earned = (bill.total_amount * cashback_percent) / Decimal('100')
-        bill.points_earned = points_earned
-
-        print(f"💰 Customer will earn {points_earned} points")
-        print(f"   - Bill total: {bill.total_amount}đ")
-        print(f"   - Cashback: {cashback_percent}%")
+        branch = branch_directory.get(db, table_entry.branch_id)
+        cashback_percent = Decimal(str(branch.cashback_percent)) if branch and branch.cashback_percent is not None else Decimal('1.0')
+        print(f"💰 Customer earns {cashback_percent}% cashback on the bill total")
     else:
         print(f"👤 Guest order - no points earned")
 
+    add_to_bill(db, order_data.session_id, new_items_total, cashback_percent)
+    if created:
+        daily_stats.record(db, table_entry.branch_id, daily_stats.order_date(), orders=1)
+
     db.commit()
     db.refresh(order)
 
     # ✅ FIXED: Return cumulative totals
-    all_items = db.query(OrderItem).filter(OrderItem.order_id == order.order_id).all()
+    total_items = db.query(func.count(OrderItem.order_item_id)).filter(
+        OrderItem.order_id == order.order_id
+    ).scalar()
+    bill_total = db.query(Bill.total_amount).filter(
+        Bill.session_id == order_data.session_id
+    ).scalar()
 
     return {
         "order_id": order.order_id,
         "session_id": order.session_id,
         "order_time": order.order_time,
         "status": order.status,
-        "total_items": len(all_items),  # ✅ Count ALL items
-        "total_amount": float(bill.total_amount)  # ✅ Return cumulative total
+        "total_items": total_items,  # ✅ Count ALL items
+        "total_amount": float(bill_total)  # ✅ Return cumulative total
     }
 
 
@@ -2698,9 +3877,11 @@ async def get_guest_order_status(
     }
 
 
-@app.get("/api/guest/menu-items", response_model=List[GuestMenuItemResponse])
+@app.get("/api/guest/menu-items", response_model=List[GuestMenuItemResponse], response_model_exclude_unset=True)
 async def get_guest_menu_items(
     branch_id: str,
+    request: Request,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
@@ -2708,43 +3889,82 @@ async def get_guest_menu_items(
     PUBLIC ENDPOINT - No authentication required
 
     Used by guests to browse menu before ordering.
-    Includes category information.
+    Includes category information. Images are only returned when
+    requested through `fields` (e.g. `fields=*`).
     """
 
-    # Verify branch exists
-    branch = db.query(Branch).filter(
-        Branch.branch_id == branch_id,
-        Branch.status == 'active'
-    ).first()
+    selected = resolve_fields(fields, GUEST_MENU_ITEM_FIELDS, MENU_ITEM_HEAVY_FIELDS, id_field="menu_item_id")
 
-    if not branch:
+    def build():
+        # Verify branch exists
+        branch = db.query(Branch).options(
+            load_only(Branch.branch_id, Branch.branch_name, Branch.tenant_id)
+        ).filter(
+            Branch.branch_id == branch_id,
+            Branch.status == 'active'
+        ).first()
+
+        if not branch:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Branch not found or inactive"
+            )
+
+        # Branch items + master items with this branch's overrides
+        # (category name comes from the join, not a lazy load)
+        menu_rows = branch_menu_query(
+            db, branch_id, branch.tenant_id, MenuItem, Category.category_name, statuses=("available",)
+        ).options(load_only_fields(MenuItem, selected)).all()
+
+        result = [
+            pick_fields(row[0], selected, {**effective_fields(row), "category_name": row.category_name})
+            for row in menu_rows
+        ]
+
+        print(f"📋 Retrieved {len(result)} menu items for branch {branch.branch_name}")
+        return result
+
+    # Menu snapshot is serialized and compressed once per menu version
+    return response_cache.respond(
+        request, f"guest-menu:{branch_id}:{','.join(selected)}", f"menu:{branch_id}", build
+    )
+
+@app.get("/api/guest/menu-items/search", response_model=List[GuestMenuItemResponse], response_model_exclude_unset=True)
+async def search_guest_menu_items(
+    branch_id: str,
+    q: str,
+    limit: int = 20,
+    db: Session = Depends(get_db)
+):
+    """
+    Search a branch's available menu items by name, category or description
+    PUBLIC ENDPOINT - No authentication required
+
+    Accent-insensitive ("pho" finds "Phở"), matches word prefixes and
+    tolerates one typo per word. Served from the in-memory search index;
+    images are not included (fetch them from /api/guest/menu-items).
+    """
+
+    if not q.strip():
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Branch not found or inactive"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Search query is required"
         )
 
-    # Get menu items for this branch
-    menu_items = db.query(MenuItem).join(Category).filter(
-        MenuItem.branch_id == branch_id,
-        MenuItem.status == "available"
-    ).all()
+    if limit <= 0 or limit > 100:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="limit must be between 1 and 100"
+        )
 
-    result = []
-    for item in menu_items:
-        result.append({
-            "menu_item_id": item.menu_item_id,
-            "item_name": item.item_name,
-            "description": item.description,
-            "price": float(item.price),
-            "discount_percent": float(item.discount_percent) if item.discount_percent else 0,
-            "status": item.status,
-            "category_id": item.category_id,
-            "category_name": item.category.category_name,
-            "image": item.image
-        })
+    branch = branch_directory.get(db, branch_id)
+    if not branch or branch.status != "active":
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Branch not found or inactive"
+        )
 
-    print(f"📋 Retrieved {len(result)} menu items for branch {branch.branch_name}")
-    return result
+    return TrustedJSONResponse(menu_search.search(db, branch_id, branch.tenant_id, q, limit))
 
 @app.get("/api/guest/tables/{table_id}")
 async def get_guest_table_info(
@@ -2756,9 +3976,7 @@ async def get_guest_table_info(
     PUBLIC ENDPOINT - No authentication required
     """
 
-    table = db.query(DiningTable).filter(
-        DiningTable.table_id == table_id
-    ).first()
+    table = table_directory.get(db, table_id)
 
     if not table:
         raise HTTPException(
@@ -2766,13 +3984,48 @@ async def get_guest_table_info(
             detail="Table not found"
         )
 
-    return {
-        "table_id": table.table_id,
-        "table_number": table.table_number,
-        "capacity": table.capacity,
-        "status": table.status,
-        "branch_id": table.branch_id
-    }
+    return table.as_dict()
+
+
+def resolve_qr_token(token: str, db: Session):
+    """Verify a signed QR token and return its (current) table directory entry"""
+    try:
+        claims = qr_signer.verify(token)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid QR code"
+        )
+
+    table = table_directory.get(db, claims.table_id)
+    if not table or table.branch_id != claims.branch_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Table not found"
+        )
+
+    if table.qr_version != claims.version:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="This QR code has been replaced, please scan the new one"
+        )
+
+    return table
+
+
+@app.get("/api/guest/qr/{token}")
+async def resolve_guest_qr(
+    token: str,
+    db: Session = Depends(get_db)
+):
+    """
+    Resolve a scanned QR token to its table and branch
+    PUBLIC ENDPOINT - No authentication required
+
+    Verified by signature and answered from the table directory.
+    """
+
+    return resolve_qr_token(token, db).as_dict()
 
 # Schema for order details with items
 class GuestOrderItemDetail(BaseModel):
@@ -2800,6 +4053,23 @@ class GuestOrderDetail(BaseModel):
     class Config:
         from_attributes = True
 
+# Bills in these states close their session: later guests start a new tab
+PAID_BILL_STATUSES = ("paid", "verified", "completed")
+
+
+def payment_qr_payload(branch, amount, bill_id: Optional[str]) -> Optional[str]:
+    """VietQR string for paying amount to the branch's account, or None if it can't be built"""
+    if not branch or not bill_id or not amount:
+        return None
+    try:
+        return vietqr.build_payload(
+            branch.bank_code, branch.bank_account_number, amount, vietqr.bill_reference(bill_id)
+        )
+    except ValueError as e:
+        print(f"⚠️ No payment QR for branch {branch.branch_id}: {e}")
+        return None
+
+
 class GuestBillDetail(BaseModel):
     bill_id: str
     session_id: str
@@ -2824,14 +4094,17 @@ async def get_guest_session_details(
     ✅ FIXED: Get complete session details including ALL unpaid orders at this table
 
     Key Changes:
-    1. Aggregates all UNPAID sessions at the same table from today
+    1. Aggregates all UNPAID sessions on the table's open tab
     2. Excludes sessions that are already paid (prevents mixing customers)
     3. Calculates cumulative total for all unpaid orders
+    4. ✅ CHANGED: One query for the orders, one joined query for the items and
+       one for the bills, whatever the number of sessions. Totals are the
+       bills' stored running totals (see add_to_bill); this GET never writes.
     """
-    from datetime import datetime, time
-
     # Get current session
-    session = db.query(DBSession).filter(
+    session = db.query(DBSession).options(
+        load_only(DBSession.session_id, DBSession.table_id, DBSession.tab_id)
+    ).filter(
         DBSession.session_id == session_id
     ).first()
 
@@ -2841,222 +4114,190 @@ async def get_guest_session_details(
             detail="Session not found"
         )
 
-    # Get table and branch for bank info
-    table = db.query(DiningTable).filter(
-        DiningTable.table_id == session.table_id
-    ).first()
-
-    branch = db.query(Branch).filter(
-        Branch.branch_id == table.branch_id
-    ).first() if table else None
-
-    # ✅ FIXED: Get ALL UNPAID sessions for this table from today
-    # Key difference: We exclude sessions with paid bills to prevent mixing customers
-    today_start = datetime.combine(datetime.now().date(), time.min)
+    # Table and branch bank info come from the in-memory directories
+    table = table_directory.get(db, session.table_id)
+    branch = branch_directory.get(db, table.branch_id) if table else None
 
-    # First, get all sessions at this table from today
-    all_table_sessions = db.query(DBSession).filter(
-        DBSession.table_id == session.table_id,
-        DBSession.start_time >= today_start
-    ).all()
-
-    # ✅ NEW: Filter out sessions that have already been paid
-    unpaid_sessions = []
-    for tbl_session in all_table_sessions:
-        # Check if this session has a paid bill
-        bill = db.query(Bill).filter(
-            Bill.session_id == tbl_session.session_id
-        ).first()
+    # ✅ FIXED: ALL UNPAID sessions on this session's tab
+    # Sessions with a paid bill are excluded to prevent mixing customers
+    paid_bill = exists().where(
+        Bill.session_id == DBSession.session_id,
+        Bill.status.in_(PAID_BILL_STATUSES)
+    )
 
-        # Include session if:
-        # 1. No bill exists yet (pending), OR
-        # 2. Bill exists but not paid (status = 'pending', 'cash_pending', etc.)
-        if not bill or bill.status not in ['paid', 'verified', 'completed']:
-            unpaid_sessions.append(tbl_session)
-        else:
-            print(f"⏭️  Skipping session {tbl_session.session_id} - already paid (bill status: {bill.status})")
+    # One row per (unpaid session, order); sessions without an order come
+    # back with order_id NULL
+    order_rows = db.query(
+        DBSession.session_id,
+        Order.order_id,
+        Order.order_time,
+        Order.status
+    ).outerjoin(
+        Order, Order.session_id == DBSession.session_id
+    ).filter(
+        tab_filter(session),
+        ~paid_bill
+    ).order_by(Order.order_time).all()
+
+    unpaid_session_ids = list(dict.fromkeys(row.session_id for row in order_rows))
+    all_orders_data = [
+        {
+            "order_id": row.order_id,
+            "session_id": row.session_id,
+            "order_time": row.order_time,
+            "status": row.status
+        }
+        for row in order_rows if row.order_id is not None
+    ]
 
-    print(f"🔍 Found {len(unpaid_sessions)} UNPAID sessions for table {table.table_number if table else 'N/A'}")
-    print(f"   (Total sessions today: {len(all_table_sessions)}, Paid: {len(all_table_sessions) - len(unpaid_sessions)})")
+    print(f"🔍 Found {len(unpaid_session_ids)} UNPAID sessions for table {table.table_number if table else 'N/A'}")
 
-    # ✅ FIXED: Aggregate ALL order items from ALL UNPAID sessions
+    # ✅ FIXED: ALL order items from ALL UNPAID sessions, in one joined query
     all_items = []
-    all_orders_data = []
-    cumulative_subtotal = Decimal('0')
-
-    for tbl_session in unpaid_sessions:
-        order = db.query(Order).filter(
-            Order.session_id == tbl_session.session_id
-        ).first()
-
-        if not order:
-            continue
-
-        all_orders_data.append({
-            "order_id": order.order_id,
-            "session_id": tbl_session.session_id,
-            "order_time": order.order_time,
-            "status": order.status
-        })
-
-        order_items = db.query(OrderItem, MenuItem).join(
+    order_ids = [order["order_id"] for order in all_orders_data]
+    if order_ids:
+        item_rows = db.query(
+            OrderItem.order_item_id,
+            OrderItem.menu_item_id,
+            OrderItem.quantity,
+            OrderItem.price,
+            OrderItem.note,
+            OrderItem.order_id,
+            Order.session_id,
+            MenuItem.item_name
+        ).join(
+            Order, OrderItem.order_id == Order.order_id
+        ).join(
             MenuItem, OrderItem.menu_item_id == MenuItem.menu_item_id
         ).filter(
-            OrderItem.order_id == order.order_id
-        ).all()
-
-        for order_item, menu_item in order_items:
-            item_subtotal = Decimal(str(order_item.price)) * order_item.quantity
-            cumulative_subtotal += item_subtotal
+            OrderItem.order_id.in_(order_ids)
+        ).order_by(Order.order_time).all()
 
+        for row in item_rows:
+            item_subtotal = Decimal(str(row.price)) * row.quantity
             all_items.append({
-                "order_item_id": order_item.order_item_id,
-                "menu_item_id": order_item.menu_item_id,
-                "menu_item_name": menu_item.item_name,
-                "quantity": order_item.quantity,
-                "price": float(order_item.price),
-                "note": order_item.note,
+                "order_item_id": row.order_item_id,
+                "menu_item_id": row.menu_item_id,
+                "menu_item_name": row.item_name,
+                "quantity": row.quantity,
+                "price": float(row.price),
+                "note": row.note,
                 "subtotal": float(item_subtotal),
-                "from_order_id": order.order_id,
-                "from_session_id": tbl_session.session_id
+                "from_order_id": row.order_id,
+                "from_session_id": row.session_id
             })
 
-    print(f"💰 Cumulative subtotal from {len(all_items)} items across {len(unpaid_sessions)} sessions: {cumulative_subtotal}đ")
-
-    # Calculate VAT and total
-    vat = cumulative_subtotal * Decimal('0.1')
-    total = cumulative_subtotal + vat
-
-    # Get or update bill
-    bill = db.query(Bill).filter(
-        Bill.session_id == session_id
-    ).first()
-
-    # If no bill for current session, check other unpaid sessions
-    if not bill and len(unpaid_sessions) > 1:
-        for tbl_session in unpaid_sessions:
-            existing_bill = db.query(Bill).filter(
-                Bill.session_id == tbl_session.session_id
-            ).first()
-            if existing_bill and existing_bill.status not in ['paid', 'verified', 'completed']:
-                bill = existing_bill
-                print(f"♻️ Using existing unpaid bill from session {tbl_session.session_id}")
-                break
-
-    # Update bill total to match cumulative total
-    if bill:
-        if bill.total_amount != total:
-            old_total = bill.total_amount
-            bill.total_amount = total
-            print(f"📝 Updated bill total: {old_total}đ → {total}đ")
-            db.commit()
-
-    return {
-        "session_id": session.session_id,
-        "table_id": session.table_id,
-        "table_number": table.table_number if table else "N/A",
-        "order": {
-            "order_id": all_orders_data[-1]["order_id"] if all_orders_data else None,
-            "session_id": session.session_id,
-            "order_time": all_orders_data[-1]["order_time"] if all_orders_data else None,
-            "status": all_orders_data[-1]["status"] if all_orders_data else None,
-            "items": all_items,
-            "subtotal": float(cumulative_subtotal),
-            "vat": float(vat),
-            "total": float(total),
-            "all_orders": all_orders_data,
-            "unpaid_sessions_count": len(unpaid_sessions)  # ✅ NEW: For debugging
-        },
-        "bill": {
-            "bill_id": bill.bill_id if bill else None,
-            "session_id": session_id,
-            "total_amount": float(total),
-            "payment_method": bill.payment_method if bill else None,
-            "status": bill.status if bill else "pending",
-            "bank_code": branch.bank_code if branch else None,
-            "bank_account_number": branch.bank_account_number if branch else None,
-            "bank_account_name": branch.bank_account_name if branch else None
-        } if bill else {
-            "bill_id": None,
-            "session_id": session_id,
-            "total_amount": float(total),
-            "payment_method": None,
-            "status": "pending",
-            "bank_code": branch.bank_code if branch else None,
-            "bank_account_number": branch.bank_account_number if branch else None,
-            "bank_account_name": branch.bank_account_name if branch else None
-        }
-    }
+    # ✅ CHANGED: Totals are the stored running totals of the unpaid bills
+    bills = db.query(Bill).filter(
+        Bill.session_id.in_(set(unpaid_session_ids) | {session_id})
+    ).all()
+    unpaid_bills = [b for b in bills if b.session_id in unpaid_session_ids]
+    cumulative_subtotal = sum((b.subtotal for b in unpaid_bills), Decimal('0'))
+    vat = sum((b.vat_amount for b in unpaid_bills), Decimal('0'))
+    total = sum((b.total_amount for b in unpaid_bills), Decimal('0'))
+    redeemed = sum((b.points_redeemed or 0 for b in unpaid_bills), Decimal('0'))
 
-    # Calculate VAT and total on CUMULATIVE amount
-    vat = cumulative_subtotal * Decimal('0.1')
-    total = cumulative_subtotal + vat
+    print(f"💰 Cumulative subtotal from {len(all_items)} items across {len(unpaid_session_ids)} sessions: {cumulative_subtotal}đ")
 
-    # ✅ FIXED: Get or create cumulative bill
-    # Check if there's an existing bill for the current session
-    bill = db.query(Bill).filter(
-        Bill.session_id == session_id
-    ).first()
+    # Bill of the current session, else any unpaid bill at the table
+    bill = next((b for b in bills if b.session_id == session_id), None)
+    if not bill:
+        bill = next((b for b in bills if b.status not in PAID_BILL_STATUSES), None)
 
-    # If no bill exists for current session, check if there's a bill
-    # from a previous session at this table
-    if not bill and len(all_table_sessions) > 1:
-        for tbl_session in all_table_sessions:
-            existing_bill = db.query(Bill).filter(
-                Bill.session_id == tbl_session.session_id
-            ).first()
-            if existing_bill:
-                bill = existing_bill
-                print(f"♻️ Using existing bill from session {tbl_session.session_id}")
-                break
-
-    # Update bill total to match cumulative total
-    if bill:
-        if bill.total_amount != total:
-            old_total = bill.total_amount
-            bill.total_amount = total
-            print(f"📝 Updated bill total: {old_total}đ → {total}đ")
-            db.commit()
-
-    # Return response with CUMULATIVE data
-    return {
+    # Payload is assembled from DB rows above, so render it directly with orjson
+    return TrustedJSONResponse({
         "session_id": session.session_id,
         "table_id": session.table_id,
         "table_number": table.table_number if table else "N/A",
         "order": {
-            "order_id": all_orders_data[-1]["order_id"] if all_orders_data else None,  # Most recent order
+            "order_id": all_orders_data[-1]["order_id"] if all_orders_data else None,
             "session_id": session.session_id,
             "order_time": all_orders_data[-1]["order_time"] if all_orders_data else None,
             "status": all_orders_data[-1]["status"] if all_orders_data else None,
-            "items": all_items,  # ✅ ALL items from ALL orders
-            "subtotal": float(cumulative_subtotal),  # ✅ Cumulative subtotal
-            "vat": float(vat),  # ✅ VAT on cumulative amount
-            "total": float(total),  # ✅ Cumulative total
-            "all_orders": all_orders_data  # ✅ List of all orders contributing to this bill
+            "items": all_items,
+            "subtotal": float(cumulative_subtotal),
+            "vat": float(vat),
+            "points_redeemed": float(redeemed),  # ✅ NEW: Already taken off the total
+            "total": float(total),
+            "all_orders": all_orders_data,
+            "unpaid_sessions_count": len(unpaid_session_ids)  # ✅ NEW: For debugging
         },
         "bill": {
             "bill_id": bill.bill_id if bill else None,
             "session_id": session_id,
-            "total_amount": float(total),  # ✅ Always use cumulative total
+            "total_amount": float(total),
             "payment_method": bill.payment_method if bill else None,
             "status": bill.status if bill else "pending",
-            # Bank information from branch
-            "bank_code": branch.bank_code if branch else None,
-            "bank_account_number": branch.bank_account_number if branch else None,
-            "bank_account_name": branch.bank_account_name if branch else None
-        } if bill else {
-            "bill_id": None,
-            "session_id": session_id,
-            "total_amount": float(total),
-            "payment_method": None,
-            "status": "pending",
             "bank_code": branch.bank_code if branch else None,
             "bank_account_number": branch.bank_account_number if branch else None,
-            "bank_account_name": branch.bank_account_name if branch else None
+            "bank_account_name": branch.bank_account_name if branch else None,
+            # ✅ NEW: VietQR payload for the amount due, referencing this bill
+            "bill_reference": vietqr.bill_reference(bill.bill_id) if bill else None,
+            "vietqr": payment_qr_payload(branch, total, bill.bill_id if bill else None)
         }
-    }
+    })
+
+
+@app.get("/api/guest/sessions/{session_id}/payment-qr")
+async def get_guest_payment_qr(
+    session_id: str,
+    format: str = "png",
+    db: Session = Depends(get_db)
+):
+    """
+    QR image of the tab's VietQR payload (amount due + bill reference), for
+    banking apps to scan. Images are cached on disk by payload.
+    """
+    if format not in qr_render.QR_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of: {', '.join(qr_render.QR_FORMATS)}"
+        )
+
+    if not qr_render.available():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="QR rendering is not installed on this server (missing 'qrcode' package)"
+        )
+
+    session = db.query(DBSession).options(
+        load_only(DBSession.session_id, DBSession.table_id, DBSession.tab_id)
+    ).filter(DBSession.session_id == session_id).first()
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
+        )
 
+    # Amount due on the tab and the bill it is paid against (this session's, else any)
+    total, bill_id = db.query(
+        func.coalesce(func.sum(Bill.total_amount), 0),
+        func.coalesce(
+            func.max(case((Bill.session_id == session_id, Bill.bill_id))),
+            func.min(Bill.bill_id)
+        )
+    ).join(
+        DBSession, Bill.session_id == DBSession.session_id
+    ).filter(
+        tab_filter(session),
+        Bill.status.notin_(PAID_BILL_STATUSES)
+    ).one()
+
+    table = table_directory.get(db, session.table_id)
+    branch = branch_directory.get(db, table.branch_id) if table else None
+    payload = payment_qr_payload(branch, total, bill_id)
+    if not payload:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Nothing to pay by bank transfer for this session"
+        )
 
+    path = await run_in_threadpool(qr_render.render_qr_image, payload, format)
+    return FileResponse(
+        path,
+        media_type="image/svg+xml" if format == "svg" else "image/png",
+        headers={"Cache-Control": "no-cache"}
+    )
 
 # Schema for updating bill status
 class BillStatusUpdate(BaseModel):
@@ -3073,14 +4314,18 @@ async def update_bill_status(
     ✅ FIXED: Update bill status for ALL sessions at this table
 
     When a guest pays, we need to:
-    1. Mark ALL unpaid sessions at this table as paid
-    2. Update/create bills for all those sessions
+    1. Mark ALL unpaid sessions on the table's tab as paid
+    2. Update the bills of all those sessions (totals are already stored)
     3. This ensures next customer at same table starts fresh
-    """
-    from datetime import datetime, time
 
+    ✅ CHANGED: Settled with a few set-based statements (bulk UPDATEs with
+    WHERE session_id IN (...)) in one short transaction, instead of one
+    query and one UPDATE per session.
+    """
     # Get the current session
-    session = db.query(DBSession).filter(
+    session = db.query(DBSession).options(
+        load_only(DBSession.session_id, DBSession.table_id, DBSession.tab_id)
+    ).filter(
         DBSession.session_id == session_id
     ).first()
 
@@ -3090,118 +4335,131 @@ async def update_bill_status(
             detail="Session not found"
         )
 
-    # Get table
-    table = db.query(DiningTable).filter(
-        DiningTable.table_id == session.table_id
-    ).first()
-
-    # ✅ NEW: Find ALL unpaid sessions at this table from today
-    today_start = datetime.combine(datetime.now().date(), time.min)
-
-    all_table_sessions = db.query(DBSession).filter(
-        DBSession.table_id == session.table_id,
-        DBSession.start_time >= today_start
-    ).all()
-
-    # Filter for unpaid sessions
-    unpaid_sessions = []
-    for tbl_session in all_table_sessions:
-        bill = db.query(Bill).filter(
-            Bill.session_id == tbl_session.session_id
-        ).first()
-
-        if not bill or bill.status not in ['paid', 'verified', 'completed']:
-            unpaid_sessions.append(tbl_session)
-
-    print(f"💳 Marking {len(unpaid_sessions)} unpaid sessions as {bill_update.status}")
+    table = table_directory.get(db, session.table_id)
 
-    # ✅ NEW: Calculate total from ALL unpaid sessions
-    cumulative_total = Decimal('0')
+    # ✅ NEW: Find ALL unpaid sessions on this session's tab
+    paid_bill = exists().where(
+        Bill.session_id == DBSession.session_id,
+        Bill.status.in_(PAID_BILL_STATUSES)
+    )
+    unpaid_ids = [row.session_id for row in db.query(DBSession.session_id).filter(
+        tab_filter(session),
+        ~paid_bill
+    )]
 
-    for tbl_session in unpaid_sessions:
-        order = db.query(Order).filter(
-            Order.session_id == tbl_session.session_id
-        ).first()
+    print(f"💳 Marking {len(unpaid_ids)} unpaid sessions as {bill_update.status}")
 
-        if order:
-            order_items = db.query(OrderItem).filter(
-                OrderItem.order_id == order.order_id
-            ).all()
+    main_bill_id = None
+    total_with_vat = Decimal('0')
 
-            subtotal = sum(
-                Decimal(str(item.price)) * item.quantity
-                for item in order_items
+    try:
+        if unpaid_ids:
+            # Bills this request moves to the new status, locked: the same payment
+            # submitted twice at once waits here, then finds them already settled
+            changing = db.query(Bill.bill_id, Bill.total_amount).filter(
+                Bill.session_id.in_(unpaid_ids),
+                Bill.status.notin_(PAID_BILL_STATUSES)
+            ).with_for_update().all()
+
+            # Sessions that ordered before bills kept running totals have no
+            # bill yet: open them all with one insert
+            missing = db.query(
+                Order.session_id,
+                func.sum(OrderItem.price * OrderItem.quantity).label("subtotal")
+            ).join(
+                OrderItem, OrderItem.order_id == Order.order_id
+            ).outerjoin(
+                Bill, Bill.session_id == Order.session_id
+            ).filter(
+                Order.session_id.in_(unpaid_ids),
+                Bill.bill_id.is_(None)
+            ).group_by(Order.session_id).all()
+
+            new_bills = []
+            if missing:
+                for row in missing:
+                    subtotal = Decimal(str(row.subtotal))
+                    vat = (subtotal * VAT_RATE).quantize(Decimal('0.01'))
+                    new_bills.append({
+                        "bill_id": str(uuid.uuid4()),
+                        "session_id": row.session_id,
+                        "subtotal": subtotal,
+                        "vat_amount": vat,
+                        "total_amount": subtotal + vat,
+                        "points_earned": 0,
+                        "points_redeemed": 0,
+                        "status": bill_update.status,
+                        "payment_method": bill_update.payment_method
+                    })
+                db.execute(insert(Bill), new_bills)
+                print(f"  ✅ Created {len(new_bills)} missing bills")
+
+            if changing:
+                changed = db.execute(
+                    update(Bill).where(
+                        Bill.bill_id.in_([bill_id for bill_id, _ in changing]),
+                        Bill.status.notin_(PAID_BILL_STATUSES)
+                    ).values(
+                        status=bill_update.status,
+                        payment_method=bill_update.payment_method
+                    ).execution_options(synchronize_session=False)
+                ).rowcount
+                if changed != len(changing):
+                    # Settled under us (a database without row locks): count none rather than twice
+                    changing = []
+            # New bills were inserted with the new status already
+            changing += [(bill["bill_id"], bill["total_amount"]) for bill in new_bills]
+
+            db.execute(
+                update(DBSession).where(DBSession.session_id.in_(unpaid_ids)).values(
+                    status="completed",
+                    end_time=datetime.utcnow()
+                ).execution_options(synchronize_session=False)
             )
-            cumulative_total += subtotal
-
-    # Add VAT
-    vat = cumulative_total * Decimal('0.1')
-    total_with_vat = cumulative_total + vat
-
-    print(f"💰 Total amount for all unpaid sessions: {total_with_vat}đ")
-
-    # ✅ NEW: Update/create bills for ALL unpaid sessions
-    main_bill = None
-
-    for tbl_session in unpaid_sessions:
-        bill = db.query(Bill).filter(
-            Bill.session_id == tbl_session.session_id
-        ).first()
 
-        if not bill:
-            # Create bill for this session
-            order = db.query(Order).filter(
-                Order.session_id == tbl_session.session_id
-            ).first()
-
-            if order:
-                bill = Bill(
-                    bill_id=str(uuid.uuid4()),
-                    session_id=tbl_session.session_id,
-                    total_amount=float(total_with_vat),  # Use cumulative total
-                    status=bill_update.status,
-                    payment_method=bill_update.payment_method,
-                    points_earned=0,
-                    points_redeemed=0
+            # Amount due and the bill to return (this session's, else any), in one aggregate
+            total_with_vat, main_bill_id = db.query(
+                func.coalesce(func.sum(Bill.total_amount), 0),
+                func.coalesce(
+                    func.max(case((Bill.session_id == session_id, Bill.bill_id))),
+                    func.min(Bill.bill_id)
                 )
-                db.add(bill)
-                print(f"  ✅ Created bill for session {tbl_session.session_id}")
-        else:
-            # Update existing bill
-            bill.status = bill_update.status
-            bill.payment_method = bill_update.payment_method
-            bill.total_amount = float(total_with_vat)  # Update to cumulative total
-            print(f"  ✅ Updated bill for session {tbl_session.session_id}")
-
-        # Mark session as completed
-        tbl_session.status = "completed"
-        tbl_session.end_time = datetime.utcnow()
-
-        # Keep reference to any bill (we'll return this)
-        if not main_bill:
-            main_bill = bill
-
-    # ✅ NEW: Mark table as available when payment is made
-    # This ensures the table is ready for the next customer
-    if table and bill_update.status in ['paid', 'cash_pending']:
-        # Don't mark as available immediately for cash_pending
-        # Staff will clear it after verifying payment
-        if bill_update.status == 'paid':
-            print(f"  ℹ️  Table {table.table_number} will be cleared after staff verification")
-        else:
-            print(f"  ℹ️  Table {table.table_number} waiting for cash payment confirmation")
-
-    try:
+            ).filter(Bill.session_id.in_(unpaid_ids)).one()
+
+            # ✅ NEW: Bills reaching a paid status count toward the day's revenue,
+            # only those this request actually moved there
+            if table and changing and bill_update.status in PAID_BILL_STATUSES:
+                daily_stats.record(db, table.branch_id, daily_stats.settlement_date(),
+                                   revenue=sum((Decimal(str(total)) for _, total in changing), Decimal('0')),
+                                   bills=len(changing))
+
+        print(f"💰 Total amount for all unpaid sessions: {total_with_vat}đ")
+
+        # Table is cleared by staff after verifying payment (cash or QR)
+        if table and bill_update.status in ['paid', 'cash_pending']:
+            if bill_update.status == 'paid':
+                print(f"  ℹ️  Table {table.table_number} will be cleared after staff verification")
+            else:
+                print(f"  ℹ️  Table {table.table_number} waiting for cash payment confirmation")
+
+        # ✅ NEW: Paid tabs close, so the next guests at the table start a new one
+        close_tab_if_settled(db, session.table_id, session.tab_id)
         db.commit()
-        if main_bill:
-            db.refresh(main_bill)
+
+        if table and unpaid_ids:
+            try:
+                publish_payment_events(db, table.branch_id, [
+                    row.bill_id for row in db.query(Bill.bill_id).filter(Bill.session_id.in_(unpaid_ids))
+                ])
+            except Exception as e:  # Already committed: the screens catch up on their next resync
+                print(f"⚠️ Payment feed publish failed: {e}")
 
         return {
             "success": True,
-            "message": f"Bill status updated for {len(unpaid_sessions)} sessions",
-            "bill_id": main_bill.bill_id if main_bill else None,
+            "message": f"Bill status updated for {len(unpaid_ids)} sessions",
+            "bill_id": main_bill_id,
             "session_id": session_id,
-            "sessions_updated": len(unpaid_sessions),
+            "sessions_updated": len(unpaid_ids),
             "status": bill_update.status,
             "payment_method": bill_update.payment_method,
             "total_amount": float(total_with_vat)
@@ -3213,6 +4471,181 @@ async def update_bill_status(
             detail=f"Failed to update bill status: {str(e)}"
         )
 
+class PointsRedeemRequest(BaseModel):
+    points: Decimal  # 1 point = 1đ off the bill
+
+
+@app.post("/api/guest/sessions/{session_id}/bill/redeem-points")
+async def redeem_points(
+    session_id: str,
+    redeem: PointsRedeemRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Spend the signed-in customer's points on their session's bill
+
+    Two conditional UPDATEs in one short transaction, no read-modify-write:
+      bill      total_amount -= points   WHERE unpaid AND total_amount >= points
+                (and for customer bills, the points earned on those points)
+      customer  points_balance -= points WHERE points_balance >= points
+    If either matches no row, nothing is changed, so concurrent checkouts
+    can never spend the same points twice or push a balance below zero.
+    A 'redeem' PointTransaction (negative amount) records the spend.
+    """
+    points = redeem.points.quantize(Decimal('0.01'))
+    if points <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Points to redeem must be positive"
+        )
+
+    customer_id = db.query(Customer.customer_id).filter(
+        Customer.user_id == current_user.user_id
+    ).scalar()
+    if not customer_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only customers can redeem points"
+        )
+
+    row = db.query(DBSession.customer_id, DBSession.table_id, Bill.bill_id).outerjoin(
+        Bill, Bill.session_id == DBSession.session_id
+    ).filter(DBSession.session_id == session_id).first()
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
+        )
+    if row.customer_id != customer_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="This session does not belong to you"
+        )
+    if not row.bill_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Nothing has been ordered in this session yet"
+        )
+
+    # Points are earned on the bill total (add_to_bill), so paying with points earns none on them
+    table = table_directory.get(db, row.table_id)
+    branch = branch_directory.get(db, table.branch_id) if table else None
+    cashback_percent = Decimal(str(branch.cashback_percent)) if branch and branch.cashback_percent is not None else Decimal('1.0')
+    earned = func.coalesce(Bill.points_earned, 0)
+    unearned = points * cashback_percent / 100
+
+    discounted = db.execute(
+        update(Bill).where(
+            Bill.bill_id == row.bill_id,
+            Bill.status.notin_(PAID_BILL_STATUSES + ("cash_pending",)),
+            Bill.total_amount >= points
+        ).values(
+            total_amount=Bill.total_amount - points,
+            points_redeemed=func.coalesce(Bill.points_redeemed, 0) + points,
+            points_earned=case((earned > unearned, earned - unearned), else_=0)
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    if not discounted:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The bill is already being paid or its total is less than the points"
+        )
+
+    spent = db.execute(
+        update(Customer).where(
+            Customer.customer_id == customer_id,
+            Customer.points_balance >= points
+        ).values(
+            points_balance=Customer.points_balance - points
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    if not spent:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Not enough points"
+        )
+
+    db.add(PointTransaction(
+        transaction_id=str(uuid.uuid4()),
+        customer_id=customer_id,
+        bill_id=row.bill_id,
+        transaction_type="redeem",
+        points_amount=-points,
+        description=f"Redeemed on bill {row.bill_id}"
+    ))
+    db.commit()
+
+    balance = db.query(Customer.points_balance).filter(Customer.customer_id == customer_id).scalar()
+    total_amount, points_redeemed = db.query(Bill.total_amount, Bill.points_redeemed).filter(
+        Bill.bill_id == row.bill_id
+    ).one()
+    print(f"🎟️ Customer {customer_id} redeemed {points} points on bill {row.bill_id}")
+
+    return {
+        "success": True,
+        "bill_id": row.bill_id,
+        "points_redeemed": float(points),
+        "bill_points_redeemed": float(points_redeemed),
+        "total_amount": float(total_amount),
+        "points_balance": float(balance)
+    }
+
+
+@app.get("/api/receipts/{bill_id}")
+async def get_receipt(
+    bill_id: str,
+    format: str = "html",
+    db: Session = Depends(get_db)
+):
+    """
+    Printable receipt of the tab a bill is on (HTML or PDF), for guest downloads
+    and staff reprints. Paid tabs are rendered once and then served from the receipt
+    cache without touching the database (see receipts.py).
+    """
+    if format not in receipts.RECEIPT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of: {', '.join(receipts.RECEIPT_FORMATS)}"
+        )
+
+    if format == "pdf" and not receipts.pdf_available():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="PDF receipts are not installed on this server (missing 'reportlab' package)"
+        )
+
+    filename = f"receipt-{bill_id[:8]}.{format}"
+    immutable = {
+        "Cache-Control": "private, max-age=31536000, immutable",  # Guest data: no shared caches
+        "Content-Disposition": f'inline; filename="{filename}"'
+    }
+
+    path = receipts.cached_receipt(bill_id, format)
+    if not path:
+        receipt = receipts.load_receipt(db, bill_id)
+        if not receipt:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Bill not found"
+            )
+        db.close()  # Rendering needs no database connection
+
+        rendered = await receipts.render_receipt(receipt, format)
+        if not receipt["final"]:
+            # Unpaid: totals may still change, so nothing is cached
+            return Response(
+                rendered,
+                media_type=receipts.MEDIA_TYPES[format],
+                headers={"Cache-Control": "no-store", "Content-Disposition": f'inline; filename="{filename}"'}
+            )
+        path = rendered
+
+    return FileResponse(path, media_type=receipts.MEDIA_TYPES[format], headers=immutable)
+
+
 @app.get("/api/guest/orders/{order_id}/details")
 async def get_guest_order_details(
     order_id: str,
@@ -3253,11 +4686,9 @@ async def get_guest_order_details(
     ).all()
 
     items = []
-    subtotal = Decimal('0')
 
     for order_item, menu_item in order_items:
         item_subtotal = Decimal(str(order_item.price)) * order_item.quantity
-        subtotal += item_subtotal
 
         items.append({
             "order_item_id": order_item.order_item_id,
@@ -3269,14 +4700,15 @@ async def get_guest_order_details(
             "subtotal": float(item_subtotal)
         })
 
-    vat = subtotal * Decimal('0.1')
-    total = subtotal + vat
-
-    # Get bill
+    # ✅ CHANGED: Totals come from the session's bill (running totals)
     bill = db.query(Bill).filter(
         Bill.session_id == order.session_id
     ).first()
 
+    subtotal = bill.subtotal if bill else Decimal('0')
+    vat = bill.vat_amount if bill else Decimal('0')
+    total = bill.total_amount if bill else Decimal('0')
+
     return {
         "order_id": order.order_id,
         "session_id": order.session_id,
@@ -3294,6 +4726,126 @@ async def get_guest_order_details(
         }
     }
 
+# ============== Staff Payment Lists ==============
+
+QR_PAID_CRITERIA = (Bill.status == "paid", Bill.payment_method == "bank_transfer")
+
+
+def load_payment_bills(db: Session, branch_id: str, *criteria, bill_ids: Optional[List[str]] = None,
+                       include_images: bool = True):
+    """
+    (bill, table_number, orders, items) for the branch's bills matching
+    criteria, oldest first, in three queries: the bills with their table, the
+    sessions' orders, and all their items with the menu item names. Bills
+    without any order are skipped.
+    """
+    query = db.query(Bill, DiningTable.table_number).join(
+        DBSession, Bill.session_id == DBSession.session_id
+    ).join(
+        DiningTable, DBSession.table_id == DiningTable.table_id
+    ).filter(DiningTable.branch_id == branch_id, *criteria)
+    if bill_ids is not None:
+        query = query.filter(Bill.bill_id.in_(bill_ids))
+    rows = query.order_by(Bill.created_at.asc()).all()   # oldest first – cashier works FIFO
+    if not rows:
+        return []
+
+    session_ids = [bill.session_id for bill, _ in rows]
+    orders_by_session = defaultdict(list)
+    for order in db.query(Order.order_id, Order.session_id, Order.order_time).filter(
+        Order.session_id.in_(session_ids)
+    ).order_by(Order.order_time):
+        orders_by_session[order.session_id].append(order)
+
+    item_columns = [OrderItem.order_item_id, OrderItem.menu_item_id, OrderItem.quantity,
+                    OrderItem.price, OrderItem.note, Order.session_id, MenuItem.item_name]
+    if include_images:
+        item_columns.append(MenuItem.image)
+    items_by_session = defaultdict(list)
+    for item in db.query(*item_columns).join(
+        Order, OrderItem.order_id == Order.order_id
+    ).outerjoin(
+        MenuItem, OrderItem.menu_item_id == MenuItem.menu_item_id
+    ).filter(Order.session_id.in_(session_ids)).order_by(Order.order_time):
+        items_by_session[item.session_id].append(item)
+
+    return [
+        (bill, table_number, orders_by_session[bill.session_id], items_by_session[bill.session_id])
+        for bill, table_number in rows if orders_by_session[bill.session_id]
+    ]
+
+
+def cash_bill_entry(branch, bill: Bill, table_number: str, orders, items) -> dict:
+    """StaffCashBillResponse payload"""
+    return {
+        "bill_id": bill.bill_id,
+        "session_id": bill.session_id,
+        "order_id": orders[0].order_id,
+        "table_number": table_number,
+        "branch_name": branch.branch_name,
+        "order_time": min(order.order_time for order in orders),
+        "items": [
+            {
+                "order_item_id": item.order_item_id,
+                "menu_item_id": item.menu_item_id,
+                "menu_item_name": item.item_name or "Unknown",
+                "menu_item_image": item.image,
+                "quantity": item.quantity,
+                "price": float(item.price),
+                "note": item.note
+            }
+            for item in items
+        ],
+        "subtotal": float(bill.subtotal),
+        "vat": float(bill.vat_amount),
+        "total_amount": float(bill.total_amount),
+        "payment_method": bill.payment_method or "cash",
+        "status": bill.status
+    }
+
+
+def qr_bill_entry(branch, bill: Bill, table_number: str, orders, items) -> dict:
+    """Payload of one bill in the QR-paid list"""
+    return {
+        "bill_id": bill.bill_id,
+        "order_id": orders[0].order_id,
+        "session_id": bill.session_id,
+        "table_number": table_number,
+        "branch_name": branch.branch_name,
+        "order_time": min(order.order_time for order in orders).isoformat(),
+        "total_amount": float(bill.total_amount),
+        "subtotal": float(bill.subtotal),
+        "vat": float(bill.vat_amount),
+        "payment_method": bill.payment_method,
+        "status": bill.status,
+        "created_at": bill.created_at.isoformat() if bill.created_at else None,
+        "items": [
+            {
+                "menu_item_name": item.item_name or "Unknown",
+                "quantity": item.quantity,
+                "price": float(item.price),
+                "note": item.note
+            }
+            for item in items
+        ],
+        # Bank info for verification
+        "bank_code": branch.bank_code,
+        "bank_account_number": branch.bank_account_number,
+        "bank_account_name": branch.bank_account_name
+    }
+
+
+def publish_payment_events(db: Session, branch_id: str, bill_ids: List[str]):
+    """Push newly cash-pending / QR-paid bills to the branch's cashier screens (after commit)"""
+    if not bill_ids or not payment_feed.has_subscribers(branch_id):
+        return
+    branch = branch_directory.get(db, branch_id)
+    for row in load_payment_bills(db, branch_id, Bill.status == "cash_pending", bill_ids=bill_ids):
+        payment_feed.publish(branch_id, "cash_pending", cash_bill_entry(branch, *row))
+    for row in load_payment_bills(db, branch_id, *QR_PAID_CRITERIA, bill_ids=bill_ids, include_images=False):
+        payment_feed.publish(branch_id, "qr_paid", qr_bill_entry(branch, *row))
+
+
 # ============== STAFF CASH-PAYMENT ENDPOINTS ==============
 
 class StaffCashBillResponse(BaseModel):
@@ -3335,74 +4887,11 @@ async def get_cash_pending_bills(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="You don't have access to this branch")
 
-    # ── query: bills → session → table (must be in this branch) ──
-    pending_bills = (
-        db.query(Bill)
-        .join(DBSession, Bill.session_id == DBSession.session_id)
-        .join(DiningTable, DBSession.table_id == DiningTable.table_id)
-        .filter(
-            DiningTable.branch_id == branch_id,
-            Bill.status == "cash_pending"
-        )
-        .order_by(Bill.created_at.asc())   # oldest first – cashier works FIFO
-        .all()
-    )
-
-    result = []
-    for bill in pending_bills:
-        session   = db.query(DBSession).filter(DBSession.session_id == bill.session_id).first()
-        table     = db.query(DiningTable).filter(DiningTable.table_id == session.table_id).first()
-
-        # ✅ FIXED: fetch ALL orders in this session, not just .first()
-        all_orders = db.query(Order).filter(Order.session_id == bill.session_id).all()
-
-        if not all_orders:
-            continue          # safety: skip orphaned bills
-
-        # ── build merged item list from every order in the session ──
-        items_response = []
-        subtotal = Decimal('0')
-        earliest_order_time = None
-        first_order_id = all_orders[0].order_id
-
-        for order in all_orders:
-            if earliest_order_time is None or order.order_time < earliest_order_time:
-                earliest_order_time = order.order_time
-
-            order_items = db.query(OrderItem).filter(OrderItem.order_id == order.order_id).all()
-            for oi in order_items:
-                menu_item = db.query(MenuItem).filter(MenuItem.menu_item_id == oi.menu_item_id).first()
-                item_subtotal = Decimal(str(oi.price)) * oi.quantity
-                subtotal += item_subtotal
-                items_response.append(OrderItemResponse(
-                    order_item_id=oi.order_item_id,
-                    menu_item_id=oi.menu_item_id,
-                    menu_item_name=menu_item.item_name if menu_item else "Unknown",
-                    menu_item_image=menu_item.image if menu_item else None,
-                    quantity=oi.quantity,
-                    price=float(oi.price),
-                    note=oi.note
-                ))
-
-        vat   = subtotal * Decimal('0.1')
-        total = subtotal + vat
-
-        result.append(StaffCashBillResponse(
-            bill_id=bill.bill_id,
-            session_id=bill.session_id,
-            order_id=first_order_id,
-            table_number=table.table_number,
-            branch_name=branch.branch_name,
-            order_time=earliest_order_time,
-            items=items_response,
-            subtotal=float(subtotal),
-            vat=float(vat),
-            total_amount=float(total),
-            payment_method=bill.payment_method or "cash",
-            status=bill.status
-        ))
-
-    return result
+    # ✅ CHANGED: three batched queries for the whole list (see load_payment_bills)
+    return TrustedJSONResponse([
+        cash_bill_entry(branch, *row)
+        for row in load_payment_bills(db, branch_id, Bill.status == "cash_pending")
+    ])
 
 
 @app.put("/api/staff/cash-pending/{bill_id}/confirm")
@@ -3439,7 +4928,18 @@ async def confirm_cash_payment(
                             detail="You don't have access to this bill")
 
     # ── apply state changes ──
-    bill.status = "paid"
+    # Conditional UPDATE: of two confirmations of the same bill, only one matches
+    confirmed = db.execute(
+        update(Bill).where(Bill.bill_id == bill_id, Bill.status == "cash_pending").values(
+            status="paid"
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    if not confirmed:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Bill was already confirmed. Only 'cash_pending' bills can be confirmed."
+        )
     # payment_method stays "cash" (already set by the guest endpoint)
 
     session.status   = "completed"
@@ -3447,23 +4947,22 @@ async def confirm_cash_payment(
 
     table.status = "available"
 
-    # ── points: if the session belonged to a customer, award points now ──
-    if session.customer_id:
-        customer = db.query(Customer).filter(Customer.customer_id == session.customer_id).first()
-        if customer and bill.points_earned and bill.points_earned > 0:
-            customer.points_balance += bill.points_earned
-            # record a PointTransaction for the ledger
-            pt = PointTransaction(
-                transaction_id=str(uuid.uuid4()),
-                customer_id=session.customer_id,
-                bill_id=bill.bill_id,
-                transaction_type="earn",
-                points_amount=bill.points_earned,
-                description=f"Earned from cash payment – bill {bill.bill_id}"
-            )
-            db.add(pt)
+    daily_stats.record(db, table.branch_id, daily_stats.settlement_date(),
+                       revenue=bill.total_amount, bills=1)
+
+    # ── points: if the session belonged to a customer, queue the award ──
+    # ✅ CHANGED: credited by the loyalty worker, at most once per bill
+    queued = loyalty.enqueue_awards(db, [(
+        bill.bill_id, session.customer_id, bill.points_earned,
+        f"Earned from cash payment – bill {bill.bill_id}"
+    )])
 
+    close_tab_if_settled(db, table.table_id, session.tab_id)
     db.commit()
+    table_directory.set_status(table.table_id, table.status)
+    if queued:
+        loyalty_worker.notify()
+    payment_feed.publish(table.branch_id, "settled", {"bill_id": bill_id})
 
     return {
         "success": True,
@@ -3500,76 +4999,41 @@ async def get_qr_paid_bills(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                           detail="You don't have access to this branch")
 
-    # Get all QR-paid bills for this branch
-    bills = (
-        db.query(Bill)
-        .join(DBSession, Bill.session_id == DBSession.session_id)
-        .join(DiningTable, DBSession.table_id == DiningTable.table_id)
-        .filter(
-            DiningTable.branch_id == branch_id,
-            Bill.status == "paid",
-            Bill.payment_method == "bank_transfer"
-        )
-        .all()
-    )
-
-    result = []
-    for bill in bills:
-        session = db.query(DBSession).filter(DBSession.session_id == bill.session_id).first()
-        table = db.query(DiningTable).filter(DiningTable.table_id == session.table_id).first()
+    # ✅ CHANGED: three batched queries for the whole list (see load_payment_bills)
+    return TrustedJSONResponse([
+        qr_bill_entry(branch, *row)
+        for row in load_payment_bills(db, branch_id, *QR_PAID_CRITERIA, include_images=False)
+    ])
 
-        # ✅ FIXED: fetch ALL orders in this session, not just .first()
-        all_orders = db.query(Order).filter(Order.session_id == session.session_id).all()
 
-        if not all_orders:
-            continue
+@app.get("/api/staff/payment-feed")
+async def stream_payment_feed(
+    branch_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Server-sent events for the cashier screen: cash_pending / qr_paid bills
+    (same payloads as the two lists) and settled bill ids, pushed as they
+    happen instead of polling the lists (see payment_feed.py).
+    """
+    branch = branch_directory.get(db, branch_id)
+    if not branch:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Branch not found")
+    if branch.tenant_id != current_user.tenant_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="You don't have access to this branch")
 
-        # ── build merged item list from every order in the session ──
-        items_data = []
-        subtotal = Decimal('0')
-        earliest_order_time = None
-        first_order_id = all_orders[0].order_id
-
-        for order in all_orders:
-            if earliest_order_time is None or order.order_time < earliest_order_time:
-                earliest_order_time = order.order_time
-
-            order_items = db.query(OrderItem).filter(OrderItem.order_id == order.order_id).all()
-            for oi in order_items:
-                menu_item = db.query(MenuItem).filter(MenuItem.menu_item_id == oi.menu_item_id).first()
-                item_subtotal = Decimal(str(oi.price)) * oi.quantity
-                subtotal += item_subtotal
-                items_data.append({
-                    "menu_item_name": menu_item.item_name if menu_item else "Unknown",
-                    "quantity": oi.quantity,
-                    "price": float(oi.price),
-                    "note": oi.note
-                })
-
-        vat = subtotal * Decimal('0.1')
-        total = subtotal + vat
-
-        result.append({
-            "bill_id": bill.bill_id,
-            "order_id": first_order_id,
-            "session_id": session.session_id,
-            "table_number": table.table_number,
-            "branch_name": branch.branch_name,
-            "order_time": earliest_order_time.isoformat(),
-            "total_amount": float(total),
-            "subtotal": float(subtotal),
-            "vat": float(vat),
-            "payment_method": bill.payment_method,
-            "status": bill.status,
-            "created_at": bill.created_at.isoformat() if bill.created_at else None,
-            "items": items_data,
-            # Bank info for verification
-            "bank_code": branch.bank_code,
-            "bank_account_number": branch.bank_account_number,
-            "bank_account_name": branch.bank_account_name
-        })
+    # The stream never touches the database: give the connection back now
+    # instead of holding it for as long as the screen stays open
+    db.close()
 
-    return result
+    return StreamingResponse(
+        payment_feed.stream(branch_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.put("/api/staff/qr-paid/{bill_id}/verify")
@@ -3613,23 +5077,18 @@ async def verify_qr_payment(
 
     table.status = "available"
 
-    # Award points if this was a customer session
-    if session.customer_id:
-        customer = db.query(Customer).filter(Customer.customer_id == session.customer_id).first()
-        if customer and bill.points_earned and bill.points_earned > 0:
-            customer.points_balance += bill.points_earned
-            # Record point transaction
-            pt = PointTransaction(
-                transaction_id=str(uuid.uuid4()),
-                customer_id=session.customer_id,
-                bill_id=bill.bill_id,
-                transaction_type="earn",
-                points_amount=bill.points_earned,
-                description=f"Earned from QR payment – bill {bill.bill_id}"
-            )
-            db.add(pt)
+    # Queue the points award if this was a customer session
+    queued = loyalty.enqueue_awards(db, [(
+        bill.bill_id, session.customer_id, bill.points_earned,
+        f"Earned from QR payment – bill {bill.bill_id}"
+    )])
 
+    close_tab_if_settled(db, table.table_id, session.tab_id)
     db.commit()
+    table_directory.set_status(table.table_id, table.status)
+    if queued:
+        loyalty_worker.notify()
+    payment_feed.publish(table.branch_id, "settled", {"bill_id": bill_id})
 
     return {
         "success": True,
@@ -3641,42 +5100,172 @@ async def verify_qr_payment(
     }
 
 
+MAX_STATEMENT_BYTES = int(os.getenv("MAX_STATEMENT_BYTES", str(20 * 1024 * 1024)))
+STATEMENT_SPOOL_BYTES = 1024 * 1024  # Larger uploads are spooled to disk
+
+
+def verify_qr_bills(db: Session, bill_ids: List[str]) -> List[tuple]:
+    """
+    verify_qr_payment for many bills at once, with set-based statements
+    (caller commits). Bills no longer 'paid' by bank transfer are left
+    alone. Returns the (bill_id, table_id) pairs that were verified.
+    """
+    rows = db.query(
+        Bill.bill_id, Bill.points_earned, DBSession.session_id,
+        DBSession.customer_id, DBSession.table_id, DBSession.tab_id
+    ).join(
+        DBSession, Bill.session_id == DBSession.session_id
+    ).filter(
+        Bill.bill_id.in_(bill_ids), *QR_PAID_CRITERIA
+    ).with_for_update().all()
+    if not rows:
+        return []
+
+    db.execute(
+        update(Bill).where(Bill.bill_id.in_([row.bill_id for row in rows])).values(
+            status="verified"
+        ).execution_options(synchronize_session=False)
+    )
+    db.execute(
+        update(DBSession).where(DBSession.session_id.in_([row.session_id for row in rows])).values(
+            status="completed",
+            end_time=datetime.utcnow()
+        ).execution_options(synchronize_session=False)
+    )
+    table_ids = {row.table_id for row in rows}
+    db.execute(
+        update(DiningTable).where(DiningTable.table_id.in_(table_ids)).values(
+            status="available"
+        ).execution_options(synchronize_session=False)
+    )
+
+    # Points of customer sessions are queued for the loyalty worker
+    loyalty.enqueue_awards(db, [
+        (row.bill_id, row.customer_id, row.points_earned, f"Earned from QR payment – bill {row.bill_id}")
+        for row in rows
+    ])
+
+    for table_id, tab_id in {(row.table_id, row.tab_id) for row in rows}:
+        close_tab_if_settled(db, table_id, tab_id)
+    return [(row.bill_id, row.table_id) for row in rows]
+
+
+def reconcile_statement(db: Session, branch_id: str, upload, fmt: str, dry_run: bool) -> dict:
+    """Match a statement against the branch's QR-paid bills and verify the matches (one transaction)"""
+    index = bank_statements.paid_transfer_index(db, branch_id)
+    result = bank_statements.reconcile(index, bank_statements.read_transactions(upload, fmt))
+
+    verified = []
+    if result.bill_ids and not dry_run:
+        verified = verify_qr_bills(db, result.bill_ids)
+        db.commit()
+
+    summary = result.summary()
+    summary["dry_run"] = dry_run
+    summary["bills_verified"] = len(verified)
+    summary["verified"] = verified
+    return summary
+
+
+@app.post("/api/staff/qr-paid/reconcile")
+async def reconcile_bank_statement(
+    branch_id: str,
+    request: Request,
+    format: Optional[str] = None,
+    dry_run: bool = False,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Verify QR payments from a bank statement instead of one by one
+
+    The body is the branch account's statement export (Content-Type: text/csv
+    or application/x-ofx; or pass ?format=csv|ofx). Credits whose description
+    carries a bill reference and the exact amount of QR-paid bills are
+    verified together (as PUT /api/staff/qr-paid/{bill_id}/verify would);
+    the rest is returned in unmatched_rows for staff to check by hand.
+    dry_run=true only reports the matches. See bank_statements.py.
+    """
+
+    fmt = format or ("ofx" if "ofx" in request.headers.get("content-type", "") else "csv")
+    if fmt not in bank_statements.STATEMENT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of: {', '.join(bank_statements.STATEMENT_FORMATS)}"
+        )
+
+    branch = branch_directory.get(db, branch_id)
+    if not branch:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Branch not found")
+    if branch.tenant_id != current_user.tenant_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="You don't have access to this branch")
+
+    upload = tempfile.SpooledTemporaryFile(max_size=STATEMENT_SPOOL_BYTES)
+    try:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > MAX_STATEMENT_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Statement file is larger than {MAX_STATEMENT_BYTES // (1024 * 1024)} MB"
+                )
+            upload.write(chunk)
+        upload.seek(0)
+
+        result = await run_in_threadpool(reconcile_statement, db, branch_id, upload, fmt, dry_run)
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Could not read statement file: {e}"
+        )
+    finally:
+        upload.close()
+
+    verified = result.pop("verified")
+    if verified:
+        loyalty_worker.notify()
+    for table_id in {table_id for _, table_id in verified}:
+        table_directory.set_status(table_id, "available")
+    for bill_id, _ in verified:
+        payment_feed.publish(branch_id, "settled", {"bill_id": bill_id})
+
+    print(f"🏦 Statement for branch {branch_id}: {result['transactions']} transactions, "
+          f"{result['matched']} matched, {result['bills_verified']} bills verified, "
+          f"{result['unmatched']} unmatched")
+    return result
+
+
 
 # ============== PUBLIC ENDPOINTS FOR FRONTEND ==============
 
 @app.get("/api/branches")
-async def get_all_branches(db: Session = Depends(get_db)):
+async def get_all_branches(request: Request, fields: Optional[str] = None, db: Session = Depends(get_db)):
     """
     Get all active branches for restaurant view (public endpoint)
     Used by restaurant_view.html to display branch list
+    `fields` selects the keys to return (`*` for all); images are omitted by default.
     """
-    branches = db.query(Branch).filter(Branch.status == "active").all()
-    
-    result = []
-    for branch in branches:
-        # Count menu items for this branch
-        menu_count = db.query(MenuItem).filter(
-            MenuItem.branch_id == branch.branch_id,
-            MenuItem.status == "active"
-        ).count()
-        
-        result.append({
-            "branch_id": branch.branch_id,
-            "branch_name": branch.branch_name,
-            "address": branch.address,
-            "province": branch.province,
-            "phone": branch.phone,
-            "manager_name": branch.manager_name,
-            "opening_hours": branch.opening_hours,
-            "closing_hours": branch.closing_hours,
-            "google_maps_link": branch.google_maps_link,
-            "cashback_percent": float(branch.cashback_percent) if branch.cashback_percent else 1.0,
-            "status": branch.status,
-            "image": branch.image,
-            "menu_item_count": menu_count
-        })
-    
-    return result
+    selected = resolve_fields(fields, PUBLIC_BRANCH_FIELDS, BRANCH_HEAVY_FIELDS, id_field="branch_id")
+
+    branch_directory.ensure_loaded(db)
+
+    def build():
+        branches = branch_directory.listed(db)
+        images = load_branch_images(db, [b.branch_id for b in branches]) if "image" in selected else {}
+
+        # menu_item_count here only counts items currently on the menu
+        return [
+            pick_fields(branch, selected, {
+                "menu_item_count": branch.active_item_count,
+                "image": images.get(branch.branch_id)
+            })
+            for branch in branches
+        ]
+
+    return response_cache.respond(request, f"public-branches:{','.join(selected)}", "branches", build)
 
 # ============== HEALTH CHECK ==============
 
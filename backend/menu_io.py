@@ -0,0 +1,335 @@
+"""
+Bulk menu import / export
+
+Import reads CSV or JSON rows one at a time from an uploaded file (spooled
+to disk by the endpoint, so the upload is never held in memory) and writes
+them in chunks of IMPORT_CHUNK_SIZE rows: one executemany INSERT for new
+items, one executemany UPDATE for existing ones, then a commit. Items are
+upserted by (branch, item_name); categories are matched by name within the
+tenant and created when missing. Bad rows are reported and skipped, they
+never abort the import.
+
+Export streams CSV or NDJSON from a server-side cursor (yield_per), so a
+large menu is written out without loading every item at once.
+
+Columns (CSV header / JSON keys):
+    item_name, category, price, description, discount_percent, status, image
+`category` may be replaced by `category_id`. Only item_name, price and a
+category are required. Optional columns that are missing or blank keep the
+item's current value on update, and get the defaults on insert
+(no description, no discount, status "available").
+"""
+
+import csv
+import io
+import json
+import uuid
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session, load_only
+
+from models import Category, MenuItem
+
+IMPORT_CHUNK_SIZE = 500
+EXPORT_BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+
+IMPORT_FORMATS = ("csv", "json")
+EXPORT_FORMATS = ("csv", "ndjson")
+EXPORT_COLUMNS = ("item_name", "category", "price", "description", "discount_percent", "status")
+
+MAX_TEXT_LENGTH = 255
+MENU_ITEM_STATUSES = ("available", "unavailable", "out_of_stock")  # As set by the owner menu screens
+INSERT_DEFAULTS = {"description": None, "discount_percent": Decimal("0.00"), "status": "available", "image": None}
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class ImportResult:
+    inserted: int = 0
+    updated: int = 0
+    failed: int = 0
+    categories_created: int = 0
+    errors: List[dict] = field(default_factory=list)
+    # For keeping the in-memory indexes current after the import
+    inserted_statuses: Counter = field(default_factory=Counter)
+    status_changes: List[Tuple[str, str]] = field(default_factory=list)
+
+    def add_error(self, row_number: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "error": message})
+
+    def summary(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "failed": self.failed,
+            "categories_created": self.categories_created,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+# ============== Reading ==============
+
+def read_rows(upload, fmt: str) -> Iterator[Tuple[int, object]]:
+    """
+    Yield (row_number, row) from a binary file object.
+    CSV rows are numbered like spreadsheet lines (header = 1). JSON may be
+    NDJSON (one object per line, streamed) or a single array (parsed whole).
+    """
+    text = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(text)
+            for row_number, row in enumerate(reader, start=2):
+                yield row_number, row
+            return
+
+        first = text.read(1)
+        while first and first.isspace():
+            first = text.read(1)
+        if first == "[":
+            rows = json.loads(first + text.read())
+            for row_number, row in enumerate(rows, start=1):
+                yield row_number, row
+            return
+
+        pending = first
+        for row_number, line in enumerate(text, start=1):
+            line, pending = pending + line, ""
+            if not line.strip():
+                continue
+            try:
+                yield row_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, RowError(f"Invalid JSON: {e.msg}")
+    finally:
+        text.detach()
+
+
+def _text(row: dict, key: str) -> Optional[str]:
+    value = row.get(key)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _decimal(row: dict, key: str, default=None) -> Optional[Decimal]:
+    value = _text(row, key)
+    if value is None:
+        return default
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise RowError(f"{key} is not a number: {value!r}")
+    if not number.is_finite():
+        raise RowError(f"{key} is not a number: {value!r}")
+    return number
+
+
+def parse_row(row) -> dict:
+    """
+    Validate one import row into MenuItem column values (+ category keys).
+    Optional columns are only included when the row has a value for them.
+    """
+    if isinstance(row, RowError):
+        raise row
+    if not isinstance(row, dict):
+        raise RowError("Row must be an object")
+
+    item_name = _text(row, "item_name")
+    if not item_name:
+        raise RowError("item_name is required")
+    if len(item_name) > MAX_TEXT_LENGTH:
+        raise RowError(f"item_name is longer than {MAX_TEXT_LENGTH} characters")
+
+    description = _text(row, "description")
+    if description and len(description) > MAX_TEXT_LENGTH:
+        raise RowError(f"description is longer than {MAX_TEXT_LENGTH} characters")
+
+    price = _decimal(row, "price")
+    if price is None:
+        raise RowError("price is required")
+    if price < 0 or price >= Decimal("100000000"):
+        raise RowError("price is out of range")
+
+    discount = _decimal(row, "discount_percent")
+    if discount is not None and (discount < 0 or discount > 100):
+        raise RowError("Discount percent must be between 0 and 100")
+
+    item_status = _text(row, "status")
+    if item_status is not None and item_status not in MENU_ITEM_STATUSES:
+        raise RowError(f"status must be one of: {', '.join(MENU_ITEM_STATUSES)}")
+
+    category_id = _text(row, "category_id")
+    category_name = _text(row, "category")
+    if not category_id and not category_name:
+        raise RowError("category or category_id is required")
+
+    values = {
+        "item_name": item_name,
+        "price": price.quantize(Decimal("0.01")),
+        "category_id": category_id,
+        "category_name": category_name,
+    }
+    if description is not None:
+        values["description"] = description
+    if discount is not None:
+        values["discount_percent"] = discount.quantize(Decimal("0.01"))
+    if item_status is not None:
+        values["status"] = item_status
+    image = _text(row, "image")
+    if image:
+        values["image"] = image
+    return values
+
+
+# ============== Import ==============
+
+class _CategoryResolver:
+    def __init__(self, db: Session, tenant_id: str, create_missing: bool, result: ImportResult):
+        self.db = db
+        self.tenant_id = tenant_id
+        self.create_missing = create_missing
+        self.result = result
+        self.by_id: Dict[str, str] = {}
+        self.by_name: Dict[str, str] = {}
+        for category_id, name in db.query(Category.category_id, Category.category_name).filter(
+            Category.tenant_id == tenant_id
+        ):
+            self.by_id[category_id] = name
+            self.by_name.setdefault(name.strip().lower(), category_id)
+
+    def resolve(self, category_id: Optional[str], name: Optional[str]) -> str:
+        if category_id:
+            if category_id not in self.by_id:
+                raise RowError(f"Unknown category_id: {category_id}")
+            return category_id
+
+        key = name.lower()
+        if key in self.by_name:
+            return self.by_name[key]
+        if not self.create_missing:
+            raise RowError(f"Unknown category: {name}")
+
+        new_id = str(uuid.uuid4())
+        self.db.add(Category(category_id=new_id, tenant_id=self.tenant_id, category_name=name, status="active"))
+        self.by_id[new_id] = name
+        self.by_name[key] = new_id
+        self.result.categories_created += 1
+        return new_id
+
+
+def import_menu_rows(db: Session, branch_id: str, tenant_id: str, rows: Iterable[Tuple[int, object]],
+                     create_categories: bool = True) -> ImportResult:
+    result = ImportResult()
+    categories = _CategoryResolver(db, tenant_id, create_categories, result)
+
+    # (branch, item_name) -> (menu_item_id, status), for the upsert
+    existing: Dict[str, Tuple[str, str]] = {
+        name: (item_id, item_status)
+        for item_id, name, item_status in db.query(
+            MenuItem.menu_item_id, MenuItem.item_name, MenuItem.status
+        ).filter(MenuItem.branch_id == branch_id)
+    }
+
+    inserts: List[dict] = []
+    # Updates only write the columns their row has: one executemany per set of columns
+    updates: Dict[frozenset, List[dict]] = defaultdict(list)
+    pending_rows = 0
+
+    def flush():
+        nonlocal inserts, updates, pending_rows
+        db.flush()  # New categories first
+        if inserts:
+            db.execute(insert(MenuItem), inserts)
+        for batch in updates.values():
+            db.execute(update(MenuItem), batch)
+        db.commit()
+        inserts, updates, pending_rows = [], defaultdict(list), 0
+
+    for row_number, row in rows:
+        try:
+            values = parse_row(row)
+            values["category_id"] = categories.resolve(values["category_id"], values.pop("category_name"))
+        except RowError as e:
+            result.add_error(row_number, str(e))
+            continue
+
+        name = values["item_name"]
+        if name in existing:
+            item_id, old_status = existing[name]
+            updates[frozenset(values)].append({"menu_item_id": item_id, **values})
+            new_status = values.get("status", old_status)
+            existing[name] = (item_id, new_status)
+            result.updated += 1
+            if new_status != old_status:
+                result.status_changes.append((old_status, new_status))
+        else:
+            item_id = str(uuid.uuid4())
+            values = {**INSERT_DEFAULTS, **values}
+            inserts.append({"menu_item_id": item_id, "branch_id": branch_id, **values})
+            existing[name] = (item_id, values["status"])
+            result.inserted += 1
+            result.inserted_statuses[values["status"]] += 1
+
+        pending_rows += 1
+        if pending_rows >= IMPORT_CHUNK_SIZE:
+            flush()
+
+    flush()
+    return result
+
+
+# ============== Export ==============
+
+def export_menu_rows(db: Session, branch_id: str, fmt: str, include_images: bool = False) -> Iterator[bytes]:
+    columns = EXPORT_COLUMNS + (("image",) if include_images else ())
+    loaded = [MenuItem.menu_item_id, MenuItem.item_name, MenuItem.price, MenuItem.description,
+              MenuItem.discount_percent, MenuItem.status]
+    if include_images:
+        loaded.append(MenuItem.image)
+
+    query = db.query(MenuItem, Category.category_name).options(load_only(*loaded)).join(Category).filter(
+        MenuItem.branch_id == branch_id
+    ).order_by(Category.category_name, MenuItem.item_name).yield_per(EXPORT_BATCH_SIZE)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        buffer.write("\ufeff")  # BOM so Excel opens the Vietnamese text as UTF-8
+        writer.writerow(columns)
+
+    for count, (item, category_name) in enumerate(query, start=1):
+        record = {
+            "item_name": item.item_name,
+            "category": category_name,
+            "price": item.price,
+            "description": item.description,
+            "discount_percent": item.discount_percent,
+            "status": item.status,
+        }
+        if include_images:
+            record["image"] = item.image
+
+        if writer:
+            writer.writerow(["" if record[c] is None else record[c] for c in columns])
+        else:
+            buffer.write(json.dumps(record, ensure_ascii=False, default=float) + "\n")
+
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode("utf-8")
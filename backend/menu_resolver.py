@@ -0,0 +1,86 @@
+"""
+Effective branch menus
+
+A branch's menu is made of
+  - its own items (MenuItem.branch_id == branch), and
+  - the tenant's master items (MenuItem.branch_id IS NULL), shared by every
+    branch of the tenant, with that branch's MenuItemOverride applied:
+    price / discount_percent / status replace the master value when set,
+    and is_hidden takes the item off the branch's menu.
+
+Overrides are resolved in SQL (LEFT JOIN + COALESCE), so every consumer
+(guest menu, search index, chatbot context, order pricing) gets the
+effective values from a single query.
+"""
+
+from decimal import Decimal
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import and_, false, func, or_
+from sqlalchemy.orm import Session
+
+from models import Category, MenuItem, MenuItemOverride
+
+# Fields a branch may override on a master item
+OVERRIDE_FIELDS = ("price", "discount_percent", "status", "is_hidden")
+
+
+def branch_menu_query(db: Session, branch_id: str, tenant_id: str, *columns,
+                      statuses: Optional[Iterable[str]] = None, include_hidden: bool = False):
+    """
+    Query `columns` for every item on a branch's menu, plus the labelled
+    effective_price, effective_discount, effective_status and is_hidden.
+    `statuses` filters on the effective status.
+    """
+    effective_status = func.coalesce(MenuItemOverride.status, MenuItem.status)
+    is_hidden = func.coalesce(MenuItemOverride.is_hidden, false())
+
+    query = db.query(
+        *columns,
+        func.coalesce(MenuItemOverride.price, MenuItem.price).label("effective_price"),
+        func.coalesce(MenuItemOverride.discount_percent, MenuItem.discount_percent).label("effective_discount"),
+        effective_status.label("effective_status"),
+        is_hidden.label("is_hidden"),
+    ).select_from(MenuItem).join(
+        Category, MenuItem.category_id == Category.category_id
+    ).outerjoin(
+        MenuItemOverride, and_(
+            MenuItemOverride.menu_item_id == MenuItem.menu_item_id,
+            MenuItemOverride.branch_id == branch_id
+        )
+    ).filter(
+        or_(
+            MenuItem.branch_id == branch_id,
+            and_(MenuItem.branch_id.is_(None), Category.tenant_id == tenant_id)
+        )
+    )
+
+    if statuses is not None:
+        query = query.filter(effective_status.in_(list(statuses)))
+    if not include_hidden:
+        query = query.filter(is_hidden == false())
+    return query
+
+
+def effective_fields(row) -> dict:
+    """Effective values of a branch_menu_query row, keyed like MenuItem columns"""
+    return {
+        "price": row.effective_price,
+        "discount_percent": row.effective_discount,
+        "status": row.effective_status,
+    }
+
+
+def unit_price(row) -> Decimal:
+    """Price charged for one unit after the (effective) discount"""
+    discount = Decimal(str(row.effective_discount or 0))
+    price = Decimal(str(row.effective_price)) * (Decimal("1") - discount / Decimal("100"))
+    return price.quantize(Decimal("0.01"))
+
+
+def priced_items(db: Session, branch_id: str, tenant_id: str, menu_item_ids: Iterable[str]) -> Dict[str, object]:
+    """menu_item_id -> row (menu_item_id, item_name + effective values) for items on the branch's menu"""
+    rows = branch_menu_query(
+        db, branch_id, tenant_id, MenuItem.menu_item_id, MenuItem.item_name
+    ).filter(MenuItem.menu_item_id.in_(set(menu_item_ids))).all()
+    return {row.menu_item_id: row for row in rows}
@@ -0,0 +1,220 @@
+"""
+In-memory menu search for the Scan&Order API
+
+One inverted index per branch over the available menu items: item names,
+category names and descriptions are folded (see text_folding) and split
+into tokens, so "pho bo" finds "Phở bò". Each query term matches a token
+exactly, as a prefix ("ca" -> "cafe") or within one typo ("bbun" -> "bun",
+terms of MIN_FUZZY_LENGTH+ characters). Every term must match for an item
+to be returned; items are ranked by where the terms matched (name over
+category over description) and how closely.
+
+A branch is indexed on its first search (one query over its effective
+menu, see menu_resolver; images excluded) and then kept current by the
+menu write paths in main.py, so searches never touch the database.
+Changes to shared master items or overrides drop the affected branches'
+indexes instead, and they are rebuilt on their next search. Like the
+branch directory, each worker process holds its own copy and re-reads a
+branch every MENU_SEARCH_TTL seconds to pick up writes made by other
+workers.
+"""
+
+import bisect
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session, load_only
+
+from menu_resolver import branch_menu_query, effective_fields
+from models import Category, MenuItem
+from text_folding import fold_text
+
+MENU_SEARCH_TTL = int(os.getenv("MENU_SEARCH_TTL", "300"))
+
+# Only these items are shown to guests (same filter as get_guest_menu_items)
+SEARCHABLE_STATUS = "available"
+
+# Field weights and match-quality multipliers used for ranking
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "description": 1.0}
+EXACT, PREFIX, FUZZY = 1.0, 0.6, 0.4
+
+# Shorter terms are too ambiguous for typo matching
+MIN_FUZZY_LENGTH = 4
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+TEXT_COLUMNS = ("menu_item_id", "item_name", "description", "category_id")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN.findall(fold_text(text))
+
+
+def _deletes(token: str) -> Set[str]:
+    """Every variant of token with one character removed (plus itself)"""
+    return {token} | {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def _as_float(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+
+class BranchMenuIndex:
+    def __init__(self):
+        self.docs: Dict[str, dict] = {}
+        # token -> {menu_item_id: best field weight}
+        self.postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self.doc_tokens: Dict[str, Set[str]] = {}
+        self.loaded_at = time.monotonic()
+        self._vocab: Optional[List[str]] = None
+        self._delete_map: Optional[Dict[str, Set[str]]] = None
+
+    # ---------- writes ----------
+
+    def add(self, doc: dict):
+        item_id = doc["menu_item_id"]
+        self.remove(item_id)
+
+        weights: Dict[str, float] = {}
+        for field, text in (("name", doc.get("item_name")),
+                            ("category", doc.get("category_name")),
+                            ("description", doc.get("description"))):
+            for token in tokenize(text):
+                weights[token] = max(weights.get(token, 0.0), FIELD_WEIGHTS[field])
+
+        for token, weight in weights.items():
+            self.postings[token][item_id] = weight
+        self.docs[item_id] = doc
+        self.doc_tokens[item_id] = set(weights)
+        self._vocab = self._delete_map = None
+
+    def remove(self, item_id: str):
+        tokens = self.doc_tokens.pop(item_id, None)
+        if tokens is None:
+            return
+        self.docs.pop(item_id, None)
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.pop(item_id, None)
+                if not posting:
+                    del self.postings[token]
+        self._vocab = self._delete_map = None
+
+    # ---------- reads ----------
+
+    def _ensure_vocab(self):
+        if self._vocab is None:
+            self._vocab = sorted(self.postings)
+            delete_map = defaultdict(set)
+            for token in self._vocab:
+                if len(token) >= MIN_FUZZY_LENGTH - 1:
+                    for variant in _deletes(token):
+                        delete_map[variant].add(token)
+            self._delete_map = delete_map
+
+    def _expand(self, term: str) -> Dict[str, float]:
+        """Index tokens matching one query term, with their match quality"""
+        self._ensure_vocab()
+        matches: Dict[str, float] = {}
+
+        start = bisect.bisect_left(self._vocab, term)
+        for token in self._vocab[start:]:
+            if not token.startswith(term):
+                break
+            matches[token] = EXACT if token == term else PREFIX
+
+        if len(term) >= MIN_FUZZY_LENGTH:
+            # Symmetric delete: one insertion, deletion, substitution or swap apart
+            for variant in _deletes(term):
+                for token in self._delete_map.get(variant, ()):
+                    matches.setdefault(token, FUZZY)
+        return matches
+
+    def search(self, query: str, limit: int) -> List[dict]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        scores: Optional[Dict[str, float]] = None
+        for term in terms:
+            term_scores: Dict[str, float] = {}
+            for token, quality in self._expand(term).items():
+                for item_id, weight in self.postings[token].items():
+                    score = weight * quality
+                    if score > term_scores.get(item_id, 0.0):
+                        term_scores[item_id] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {i: s + term_scores[i] for i, s in scores.items() if i in term_scores}
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda hit: (-hit[1], self.docs[hit[0]]["item_name"] or ""))
+        return [self.docs[item_id] for item_id, _ in ranked[:limit]]
+
+
+class MenuSearchIndex:
+    def __init__(self, ttl: int = MENU_SEARCH_TTL):
+        self.ttl = ttl
+        self._branches: Dict[str, BranchMenuIndex] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def document(item: MenuItem, category_name: Optional[str], effective: Optional[dict] = None) -> dict:
+        doc = {c: _as_float(getattr(item, c)) for c in TEXT_COLUMNS}
+        values = effective or {c: getattr(item, c) for c in ("price", "discount_percent", "status")}
+        doc.update({c: _as_float(v) for c, v in values.items()})
+        doc["category_name"] = category_name
+        return doc
+
+    def _load(self, db: Session, branch_id: str, tenant_id: str) -> BranchMenuIndex:
+        rows = branch_menu_query(
+            db, branch_id, tenant_id, MenuItem, Category.category_name, statuses=(SEARCHABLE_STATUS,)
+        ).options(load_only(*[getattr(MenuItem, c) for c in TEXT_COLUMNS])).all()
+
+        index = BranchMenuIndex()
+        for row in rows:
+            index.add(self.document(row[0], row.category_name, effective_fields(row)))
+        print(f"🔎 Menu search index built for branch {branch_id}: {len(rows)} items")
+        return index
+
+    def search(self, db: Session, branch_id: str, tenant_id: str, query: str, limit: int = 20) -> List[dict]:
+        with self._lock:
+            index = self._branches.get(branch_id)
+            if index is None or time.monotonic() - index.loaded_at >= self.ttl:
+                index = self._load(db, branch_id, tenant_id)
+                self._branches[branch_id] = index
+            return index.search(query, limit)
+
+    # ---------- incremental updates (call after commit) ----------
+    # Branches that were never searched have no index yet: their first
+    # search reads the committed state anyway.
+
+    def item_changed(self, item: MenuItem, category_name: Optional[str]):
+        """Branch items only; for master items drop the tenant's branches instead"""
+        with self._lock:
+            index = self._branches.get(item.branch_id)
+            if index is None:
+                return
+            if item.status == SEARCHABLE_STATUS:
+                index.add(self.document(item, category_name))
+            else:
+                index.remove(item.menu_item_id)
+
+    def item_removed(self, branch_id: str, menu_item_id: str):
+        with self._lock:
+            index = self._branches.get(branch_id)
+            if index is not None:
+                index.remove(menu_item_id)
+
+    def drop_branch(self, *branch_ids: str):
+        with self._lock:
+            for branch_id in branch_ids:
+                self._branches.pop(branch_id, None)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, ForeignKey, TIMESTAMP, DECIMAL, Integer, Boolean, Text
+from sqlalchemy import Column, String, Date, ForeignKey, TIMESTAMP, DECIMAL, Integer, Boolean, Text, UniqueConstraint, Computed, Index
 from sqlalchemy.dialects.mysql import LONGTEXT
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -40,6 +40,9 @@ class Branch(Base):
     opening_hours = Column(String(10))  # Format: "HH:MM" (24-hour format, e.g., "08:00")
     closing_hours = Column(String(10))  # Format: "HH:MM" (24-hour format, e.g., "22:00")
     google_maps_link = Column(String(500))  # Google Maps URL
+    # ✅ NEW: Coordinates for branch discovery (entered directly or parsed from google_maps_link)
+    latitude = Column(DECIMAL(9, 6))
+    longitude = Column(DECIMAL(9, 6))
     created_at = Column(TIMESTAMP, server_default=func.current_timestamp())
     
     # Relationships
@@ -48,6 +51,7 @@ class Branch(Base):
     staff = relationship("Staff", back_populates="branch", cascade="all, delete-orphan")
     reservations = relationship("Reservation", back_populates="branch", cascade="all, delete-orphan")
     menu_items = relationship("MenuItem", back_populates="branch", cascade="all, delete-orphan")  # ✅ NEW
+    menu_overrides = relationship("MenuItemOverride", back_populates="branch", cascade="all, delete-orphan")
 
 
 class User(Base):
@@ -124,6 +128,33 @@ class PointTransaction(Base):
     customer = relationship("Customer", back_populates="point_transactions")
     bill = relationship("Bill", back_populates="point_transactions")
 
+    # ✅ NEW: Balance history reads one customer's tail after a snapshot
+    __table_args__ = (Index("ix_point_transaction_customer_time", "customer_id", "created_at"),)
+
+
+class LoyaltyAward(Base):
+    """
+    Points waiting to be credited for a paid bill (see loyalty.py).
+    One row per bill, so a bill is never awarded twice.
+    """
+    __tablename__ = "loyalty_award"
+
+    bill_id = Column(String(36), ForeignKey("bill.bill_id", ondelete="CASCADE"), primary_key=True)
+    customer_id = Column(String(36), ForeignKey("customer.customer_id", ondelete="CASCADE"), nullable=False)
+    points = Column(DECIMAL(12, 2), nullable=False)
+    description = Column(String(255))
+    created_at = Column(TIMESTAMP, server_default=func.current_timestamp())
+    applied_at = Column(TIMESTAMP, nullable=True, index=True)  # NULL while queued
+
+
+class PointBalanceSnapshot(Base):
+    """A customer's ledger balance: the sum of their transactions created before taken_at"""
+    __tablename__ = "point_balance_snapshot"
+
+    customer_id = Column(String(36), ForeignKey("customer.customer_id", ondelete="CASCADE"), primary_key=True)
+    taken_at = Column(TIMESTAMP, primary_key=True)
+    balance = Column(DECIMAL(12, 2), nullable=False)
+
 
 class DiningTable(Base):
     __tablename__ = "dining_table"
@@ -133,6 +164,7 @@ class DiningTable(Base):
     table_number = Column(String(20), nullable=False)
     capacity = Column(Integer)
     status = Column(String(29), nullable=False)
+    open_tab_id = Column(String(36))  # ✅ NEW: Tab of the table's unpaid sessions (NULL = none open)
     created_at = Column(TIMESTAMP, server_default=func.current_timestamp())
     
     # Relationships
@@ -175,7 +207,8 @@ class MenuItem(Base):
     
     menu_item_id = Column(String(36), primary_key=True)
     category_id = Column(String(36), ForeignKey("category.category_id", ondelete="CASCADE"), nullable=False)
-    branch_id = Column(String(36), ForeignKey("branch.branch_id", ondelete="CASCADE"), nullable=False)  # ✅ ADDED
+    # ✅ CHANGED: NULL = tenant master menu item, shared by every branch (see MenuItemOverride)
+    branch_id = Column(String(36), ForeignKey("branch.branch_id", ondelete="CASCADE"), nullable=True)
     item_name = Column(String(255), nullable=False)
     description = Column(String(255))
     price = Column(DECIMAL(10, 2), nullable=False)
@@ -188,6 +221,29 @@ class MenuItem(Base):
     category = relationship("Category", back_populates="menu_items")
     branch = relationship("Branch", back_populates="menu_items")  # ✅ ADDED
     order_items = relationship("OrderItem", back_populates="menu_item")
+    overrides = relationship("MenuItemOverride", back_populates="menu_item", cascade="all, delete-orphan")
+
+
+class MenuItemOverride(Base):
+    """
+    Per-branch changes to a tenant master menu item.
+    NULL columns inherit the master item's value.
+    """
+    __tablename__ = "menu_item_override"
+    __table_args__ = (UniqueConstraint("menu_item_id", "branch_id", name="uq_menu_item_override"),)
+
+    override_id = Column(String(36), primary_key=True)
+    menu_item_id = Column(String(36), ForeignKey("menu_item.menu_item_id", ondelete="CASCADE"), nullable=False)
+    branch_id = Column(String(36), ForeignKey("branch.branch_id", ondelete="CASCADE"), nullable=False)
+    price = Column(DECIMAL(10, 2))
+    discount_percent = Column(DECIMAL(5, 2))
+    status = Column(String(29))
+    is_hidden = Column(Boolean, nullable=False, default=False)
+    created_at = Column(TIMESTAMP, server_default=func.current_timestamp())
+
+    # Relationships
+    menu_item = relationship("MenuItem", back_populates="overrides")
+    branch = relationship("Branch", back_populates="menu_overrides")
 
 
 class Session(Base):
@@ -199,6 +255,15 @@ class Session(Base):
     start_time = Column(TIMESTAMP, server_default=func.current_timestamp())
     end_time = Column(TIMESTAMP)
     status = Column(String(29), nullable=False)
+    tab_id = Column(String(36), index=True)  # ✅ NEW: Sessions billed together (see DiningTable.open_tab_id)
+    # ✅ NEW: table_id while the session is active, NULL otherwise; the unique
+    # index allows at most one active session per table (virtual, since
+    # table_id has an ON DELETE CASCADE foreign key)
+    active_table_id = Column(
+        String(36),
+        Computed("CASE WHEN status = 'active' THEN table_id END", persisted=False),
+        unique=True
+    )
     
     # Relationships
     dining_table = relationship("DiningTable", back_populates="sessions")
@@ -240,6 +305,9 @@ class Bill(Base):
     
     bill_id = Column(String(36), primary_key=True)
     session_id = Column(String(36), ForeignKey("session.session_id", ondelete="CASCADE"), nullable=False, unique=True)
+    # ✅ NEW: Running totals, maintained as order items are added (see add_to_bill in main.py)
+    subtotal = Column(DECIMAL(12, 2), nullable=False, default=0)
+    vat_amount = Column(DECIMAL(12, 2), nullable=False, default=0)
     total_amount = Column(DECIMAL(12, 2), nullable=False)
     points_earned = Column(DECIMAL(12, 2), default=0)  # ✅ NEW: Points earned from this bill
     points_redeemed = Column(DECIMAL(12, 2), default=0)  # ✅ NEW: Points used for discount
@@ -252,6 +320,25 @@ class Bill(Base):
     point_transactions = relationship("PointTransaction", back_populates="bill", cascade="all, delete-orphan")  # ✅ NEW
 
 
+class BranchDailyStats(Base):
+    """
+    Per-branch, per-day rollup read by the dashboards (see daily_stats.py).
+    Kept up to date in the transactions that create orders and settle bills.
+    """
+    __tablename__ = "branch_daily_stats"
+
+    branch_id = Column(String(36), ForeignKey("branch.branch_id", ondelete="CASCADE"), primary_key=True)
+    business_date = Column(Date, primary_key=True, index=True)  # Cross-branch reports scan by date
+    revenue = Column(DECIMAL(14, 2), nullable=False, default=0)  # Total of the bills settled that day
+    bills = Column(Integer, nullable=False, default=0)  # Bills settled that day
+    orders = Column(Integer, nullable=False, default=0)  # Orders placed that day
+    covers = Column(Integer, nullable=False, default=0)  # Guest sessions on the tabs closed that day
+
+    @property
+    def average_ticket(self):
+        return self.revenue / self.bills if self.bills else 0
+
+
 class Reservation(Base):
     __tablename__ = "reservation"
     
@@ -0,0 +1,98 @@
+"""
+Live staff payment feed (server-sent events)
+
+The cashier screen subscribes once per branch instead of polling the
+cash-pending / QR-paid lists. The payment endpoints in main.py publish an
+event after they commit:
+    cash_pending  a guest chose to pay cash          (data: bill entry)
+    qr_paid       a guest paid by bank transfer      (data: bill entry)
+    settled       staff confirmed / verified a bill  (data: {"bill_id"})
+
+Subscribers are per process, like the in-memory directories. Events from
+a write handled by another worker process are not delivered, so every
+stream also sends a `resync` event every PAYMENT_FEED_RESYNC seconds, which
+tells the client to reload the lists once. Comment lines are sent as
+keep-alives so proxies do not close idle streams.
+"""
+
+import asyncio
+import os
+import threading
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+
+from fast_json import dumps
+
+PAYMENT_FEED_KEEPALIVE = int(os.getenv("PAYMENT_FEED_KEEPALIVE", "15"))
+PAYMENT_FEED_RESYNC = int(os.getenv("PAYMENT_FEED_RESYNC", "60"))
+PAYMENT_FEED_QUEUE_SIZE = 100
+
+_Subscriber = Tuple[asyncio.AbstractEventLoop, asyncio.Queue]
+
+
+def format_event(event: str, data=None) -> bytes:
+    payload = f"event: {event}\n".encode("utf-8")
+    if data is not None:
+        payload += b"data: " + dumps(data) + b"\n"
+    return payload + b"\n"
+
+
+class PaymentFeed:
+    def __init__(self):
+        self._subscribers: Dict[str, Set[_Subscriber]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def has_subscribers(self, branch_id: str) -> bool:
+        return bool(self._subscribers.get(branch_id))
+
+    def publish(self, branch_id: str, event: str, data=None):
+        """Queue an event for every subscriber of the branch (safe from any thread)"""
+        message = format_event(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers.get(branch_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._offer, queue, message)
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, message: Optional[bytes]):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A client this far behind reloads everything instead
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(format_event("resync"))
+
+    async def stream(self, branch_id: str, is_disconnected) -> AsyncIterator[bytes]:
+        """Event stream for one client; ends when is_disconnected() says so"""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(PAYMENT_FEED_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers[branch_id].add(subscriber)
+        print(f"📡 Payment feed opened for branch {branch_id}")
+
+        loop = subscriber[0]
+        queue = subscriber[1]
+        next_resync = loop.time() + PAYMENT_FEED_RESYNC
+        try:
+            yield format_event("ready")
+            while True:
+                timeout = min(PAYMENT_FEED_KEEPALIVE, max(0.0, next_resync - loop.time()))
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+
+                if await is_disconnected():
+                    return
+                if loop.time() >= next_resync:
+                    next_resync = loop.time() + PAYMENT_FEED_RESYNC
+                    yield format_event("resync")
+                else:
+                    yield b": keepalive\n\n"
+        finally:
+            with self._lock:
+                self._subscribers[branch_id].discard(subscriber)
+                if not self._subscribers[branch_id]:
+                    del self._subscribers[branch_id]
+            print(f"📡 Payment feed closed for branch {branch_id}")
@@ -0,0 +1,143 @@
+"""
+QR code image rendering for printable table stickers
+
+- render_qr_images(): renders PNG or SVG images for many tables at once in
+  a process pool. Images are cached on disk under QR_CACHE_DIR, keyed by
+  the encoded data (which contains the table's qr_content, and so its QR
+  version) plus the format and RENDER_VERSION. Each sticker is therefore
+  rendered once until its QR code is regenerated.
+- render_qr_image(): one image, rendered in the calling thread (payment
+  QR codes), with the same disk cache.
+- stream_zip(): yields a ZIP archive of those files chunk by chunk, so a
+  large branch is never held in memory as a whole archive.
+
+Needs the `qrcode` package (PNG output uses its pure-Python pypng backend).
+"""
+
+import os
+import hashlib
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import qrcode
+except ImportError:  # Only needed for the QR sticker download
+    qrcode = None
+
+QR_CACHE_DIR = os.getenv("QR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "scan_order_qr"))
+QR_RENDER_WORKERS = int(os.getenv("QR_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Bump when the sticker look (size, border, error correction) changes
+RENDER_VERSION = 1
+QR_FORMATS = ("png", "svg")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def available() -> bool:
+    return qrcode is not None
+
+
+def cache_path(data: str, fmt: str) -> str:
+    digest = hashlib.sha256(f"{RENDER_VERSION}|{fmt}|{data}".encode("utf-8")).hexdigest()
+    return os.path.join(QR_CACHE_DIR, digest[:2], f"{digest}.{fmt}")
+
+
+def _render(data: str, fmt: str, path: str) -> str:
+    """Render one QR image to path (runs in a worker process)"""
+    if fmt == "svg":
+        from qrcode.image.svg import SvgPathImage
+        factory = SvgPathImage
+    else:
+        from qrcode.image.pure import PyPNGImage
+        factory = PyPNGImage
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=10, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    image = qr.make_image(image_factory=factory)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so a concurrent reader never sees a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        image.save(f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=QR_RENDER_WORKERS)
+        return _pool
+
+
+def render_qr_images(items: Iterable[Tuple[str, str]], fmt: str) -> List[Tuple[str, str]]:
+    """
+    Render (arcname, data) pairs and return (arcname, image path) pairs.
+    Cached images are reused; only the misses go to the process pool.
+    """
+    results, misses = [], []
+    for arcname, data in items:
+        path = cache_path(data, fmt)
+        results.append((arcname, path))
+        if not os.path.exists(path):
+            misses.append((data, path))
+
+    if misses:
+        pool = _get_pool()
+        futures = [pool.submit(_render, data, fmt, path) for data, path in misses]
+        for future in futures:
+            future.result()
+        print(f"🖨️ Rendered {len(misses)} QR images ({len(results) - len(misses)} from cache)")
+
+    return results
+
+
+def render_qr_image(data: str, fmt: str = "png") -> str:
+    """Path of one rendered QR image, rendered in-process on a cache miss"""
+    path = cache_path(data, fmt)
+    if not os.path.exists(path):
+        _render(data, fmt, path)
+    return path
+
+
+class _ChunkBuffer:
+    """Write-only file object whose contents are drained after each entry"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """Yield a ZIP of (arcname, path) files one entry at a time"""
+    buffer = _ChunkBuffer()
+    # Images are already compressed (PNG) or tiny (SVG): store them as-is
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for arcname, path in files:
+            archive.write(path, arcname)
+            yield buffer.drain()
+    yield buffer.drain()
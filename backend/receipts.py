@@ -0,0 +1,320 @@
+"""
+Bill receipts (HTML and PDF)
+
+A receipt covers the whole tab the bill belongs to, since one payment
+settles every session on the table's tab (update_bill_status in main.py):
+load_receipt() reads the bill with its table and branch, the tab's bills,
+and their sessions' items with their names, in three queries. Totals are
+the sum of the bills' stored running totals (see add_to_bill).
+
+Receipts are rendered in a process pool (RECEIPT_RENDER_WORKERS), so
+building a PDF never blocks the API's event loop or threads:
+  - once every bill on the tab is paid the receipt can no longer change
+    (a paid tab is closed, so no session joins it), so it is rendered once
+    to RECEIPT_CACHE_DIR (keyed by bill_id, format and RENDER_VERSION) and
+    every later request is served from that file;
+  - receipts of unpaid tabs are rendered on each request and not stored.
+The receipt never shows cash/QR verification state, so a bill moving from
+'paid' to 'verified' keeps its cached receipt.
+
+PDF output needs the `reportlab` package. Vietnamese text needs a Unicode
+TrueType font (RECEIPT_PDF_FONT, e.g. DejaVuSans.ttf); without one the PDF
+falls back to Helvetica with accents stripped.
+"""
+
+import asyncio
+import html
+import io
+import os
+import tempfile
+import threading
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from models import Bill, Branch, DiningTable, MenuItem, Order, OrderItem, Session as DBSession
+
+try:
+    from reportlab.lib.units import mm
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:  # Only needed for PDF receipts
+    canvas = None
+
+RECEIPT_CACHE_DIR = os.getenv("RECEIPT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "scan_order_receipts"))
+RECEIPT_RENDER_WORKERS = int(os.getenv("RECEIPT_RENDER_WORKERS", str(min(2, os.cpu_count() or 1))))
+RECEIPT_PDF_FONT = os.getenv("RECEIPT_PDF_FONT", "")
+
+# Bump when the receipt layout changes (old cached receipts are then ignored)
+RENDER_VERSION = 2
+RECEIPT_FORMATS = ("html", "pdf")
+MEDIA_TYPES = {"html": "text/html", "pdf": "application/pdf"}  # Starlette adds the charset
+
+# Bill states whose receipt is final
+FINAL_STATUSES = ("paid", "verified", "completed")
+
+PAYMENT_METHODS = {"cash": "Tiền mặt", "bank_transfer": "Chuyển khoản QR"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def pdf_available() -> bool:
+    return canvas is not None
+
+
+def cache_path(bill_id: str, fmt: str) -> str:
+    return os.path.join(RECEIPT_CACHE_DIR, bill_id[:2], f"{bill_id}.v{RENDER_VERSION}.{fmt}")
+
+
+def cached_receipt(bill_id: str, fmt: str) -> Optional[str]:
+    """Path of an already rendered final receipt, if any (no database access needed)"""
+    path = cache_path(bill_id, fmt)
+    return path if os.path.exists(path) else None
+
+
+# ============== Loading ==============
+
+def load_receipt(db: Session, bill_id: str) -> Optional[dict]:
+    """Plain-data receipt of the tab a bill is on (picklable, for the render workers), or None"""
+    row = db.query(
+        Bill.bill_id, Bill.session_id, Bill.payment_method, Bill.created_at,
+        DBSession.tab_id, DiningTable.table_number,
+        Branch.branch_name, Branch.address, Branch.phone
+    ).join(
+        DBSession, Bill.session_id == DBSession.session_id
+    ).join(
+        DiningTable, DBSession.table_id == DiningTable.table_id
+    ).join(
+        Branch, DiningTable.branch_id == Branch.branch_id
+    ).filter(Bill.bill_id == bill_id).first()
+    if not row:
+        return None
+
+    # Every bill the payment settled: the tab's (a session from before tabs is billed alone)
+    on_tab = DBSession.tab_id == row.tab_id if row.tab_id else DBSession.session_id == row.session_id
+    bills = db.query(
+        Bill.session_id, Bill.subtotal, Bill.vat_amount, Bill.total_amount,
+        Bill.points_earned, Bill.points_redeemed, Bill.status, DBSession.end_time
+    ).join(
+        DBSession, Bill.session_id == DBSession.session_id
+    ).filter(on_tab, Bill.status != "void").all()
+    if not bills:
+        return None
+
+    def total(column):
+        return sum((Decimal(str(getattr(bill, column) or 0)) for bill in bills), Decimal('0'))
+
+    ended = [bill.end_time for bill in bills if bill.end_time]
+
+    items = db.query(
+        OrderItem.quantity, OrderItem.price, OrderItem.note, MenuItem.item_name
+    ).join(
+        Order, OrderItem.order_id == Order.order_id
+    ).outerjoin(
+        MenuItem, OrderItem.menu_item_id == MenuItem.menu_item_id
+    ).filter(
+        Order.session_id.in_([bill.session_id for bill in bills])
+    ).order_by(Order.order_time).all()
+
+    return {
+        "bill_id": row.bill_id,
+        "final": all(bill.status in FINAL_STATUSES for bill in bills),
+        "branch_name": row.branch_name,
+        "address": row.address,
+        "phone": row.phone,
+        "table_number": row.table_number,
+        "issued_at": max(ended) if ended else row.created_at,
+        "payment_method": PAYMENT_METHODS.get(row.payment_method, row.payment_method or ""),
+        "items": [
+            {
+                "name": item.item_name or "Món ăn",
+                "quantity": item.quantity,
+                "price": Decimal(str(item.price)),
+                "amount": Decimal(str(item.price)) * item.quantity,
+                "note": item.note,
+            }
+            for item in items
+        ],
+        "subtotal": total("subtotal"),
+        "vat": total("vat_amount"),
+        "points_redeemed": total("points_redeemed"),
+        "total": total("total_amount"),
+        "points_earned": total("points_earned"),
+    }
+
+
+# ============== Rendering (worker processes) ==============
+
+def _number(amount: Decimal) -> str:
+    """165000 -> "165.000" (vi-VN grouping)"""
+    return f"{int(amount.quantize(Decimal('1'))):,}".replace(",", ".")
+
+
+def _money(amount: Decimal) -> str:
+    return _number(amount) + "đ"
+
+
+def _issued(receipt: dict) -> str:
+    issued = receipt["issued_at"]
+    return issued.strftime("%H:%M %d/%m/%Y") if isinstance(issued, datetime) else ""
+
+
+def _lines(receipt: dict):
+    """(label, amount) rows under the items"""
+    rows = [("Tạm tính", receipt["subtotal"]), ("VAT (10%)", receipt["vat"])]
+    if receipt["points_redeemed"]:
+        rows.append(("Điểm đã dùng", -receipt["points_redeemed"]))
+    return rows
+
+
+def render_html(receipt: dict) -> bytes:
+    e = html.escape
+    items = "".join(
+        f"<tr><td>{e(item['name'])}"
+        + (f"<div class=note>{e(item['note'])}</div>" if item["note"] else "")
+        + f"</td><td class=c>{item['quantity']}</td><td class=r>{_money(item['price'])}</td>"
+        f"<td class=r>{_money(item['amount'])}</td></tr>"
+        for item in receipt["items"]
+    )
+    totals = "".join(
+        f"<tr><td colspan=3>{e(label)}</td><td class=r>{_money(amount)}</td></tr>"
+        for label, amount in _lines(receipt)
+    )
+    status = "Đã thanh toán" if receipt["final"] else "Chưa thanh toán"
+    points = (f"<p class=c>Điểm tích lũy: +{_number(receipt['points_earned'])}</p>"
+              if receipt["final"] and receipt["points_earned"] else "")
+    return f"""<!DOCTYPE html>
+<html lang="vi"><head><meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Hóa đơn {e(receipt['bill_id'][:8].upper())}</title>
+<style>
+body{{font-family:"Courier New",monospace;max-width:360px;margin:16px auto;padding:0 12px;color:#111}}
+h1{{font-size:18px;text-align:center;margin:0 0 4px}}
+p{{margin:2px 0;font-size:13px}}
+table{{width:100%;border-collapse:collapse;font-size:13px;margin:8px 0}}
+th,td{{padding:3px 0;vertical-align:top}}
+thead th{{border-bottom:1px dashed #111;text-align:left}}
+tfoot td{{border-top:1px dashed #111}}
+.c{{text-align:center}}.r{{text-align:right}}.note{{font-size:11px;color:#555}}
+.total td{{font-weight:bold;font-size:15px}}
+@media print{{body{{margin:0}}}}
+</style></head><body>
+<h1>{e(receipt['branch_name'] or '')}</h1>
+<p class=c>{e(receipt['address'] or '')}</p>
+<p class=c>{e(receipt['phone'] or '')}</p>
+<p class=c><b>HÓA ĐƠN THANH TOÁN</b></p>
+<p>Số: {e(receipt['bill_id'][:8].upper())}</p>
+<p>Bàn: {e(str(receipt['table_number']))}</p>
+<p>Thời gian: {_issued(receipt)}</p>
+<table><thead><tr><th>Món</th><th class=c>SL</th><th class=r>Đơn giá</th><th class=r>T.Tiền</th></tr></thead>
+<tbody>{items}</tbody>
+<tfoot>{totals}<tr class=total><td colspan=3>TỔNG CỘNG</td><td class=r>{_money(receipt['total'])}</td></tr></tfoot>
+</table>
+<p>Thanh toán: {e(receipt['payment_method'])} - {status}</p>
+{points}
+<p class=c>Cảm ơn quý khách!</p>
+</body></html>""".encode("utf-8")
+
+
+def _pdf_font():
+    """(font name, text transform) for the PDF"""
+    if RECEIPT_PDF_FONT:
+        if "Receipt" not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont("Receipt", RECEIPT_PDF_FONT))
+        return "Receipt", str
+
+    def strip_accents(text):
+        text = str(text).replace("đ", "d").replace("Đ", "D")
+        decomposed = unicodedata.normalize("NFD", text)
+        return "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+    return "Helvetica", strip_accents
+
+
+def render_pdf(receipt: dict) -> bytes:
+    """80 mm receipt-printer page, as tall as its content"""
+    font, text = _pdf_font()
+    width = 80 * mm
+    line = 4.5 * mm
+    rows = 12 + len(receipt["items"]) * 2 + len(_lines(receipt))
+    height = rows * line + 20 * mm
+
+    output = io.BytesIO()
+    pdf = canvas.Canvas(output, pagesize=(width, height))
+    pdf.setTitle(f"Receipt {receipt['bill_id']}")
+    y = height - 10 * mm
+
+    def write(value, size=8, align="left", bold=False, x=5 * mm):
+        pdf.setFont(font if not bold or font != "Helvetica" else "Helvetica-Bold", size)
+        value = text(value)
+        if align == "center":
+            pdf.drawCentredString(width / 2, y, value)
+        elif align == "right":
+            pdf.drawRightString(width - 5 * mm, y, value)
+        else:
+            pdf.drawString(x, y, value)
+
+    write(receipt["branch_name"] or "", 11, "center", bold=True); y -= line * 1.3
+    write(receipt["address"] or "", 7, "center"); y -= line
+    write("HÓA ĐƠN THANH TOÁN", 9, "center", bold=True); y -= line * 1.3
+    write(f"Số: {receipt['bill_id'][:8].upper()}   Bàn: {receipt['table_number']}"); y -= line
+    write(f"Thời gian: {_issued(receipt)}"); y -= line
+    pdf.line(5 * mm, y + 2.5 * mm, width - 5 * mm, y + 2.5 * mm); y -= line * 0.3
+
+    for item in receipt["items"]:
+        write(item["name"][:40]); y -= line
+        write(f"{item['quantity']} x {_money(item['price'])}", 7, x=8 * mm)
+        write(_money(item["amount"]), 8, "right"); y -= line
+
+    pdf.line(5 * mm, y + 2.5 * mm, width - 5 * mm, y + 2.5 * mm); y -= line * 0.3
+    for label, amount in _lines(receipt):
+        write(label); write(_money(amount), align="right"); y -= line
+    write("TỔNG CỘNG", 10, bold=True); write(_money(receipt["total"]), 10, "right", bold=True); y -= line * 1.3
+
+    status = "Đã thanh toán" if receipt["final"] else "Chưa thanh toán"
+    write(f"Thanh toán: {receipt['payment_method']} - {status}", 7); y -= line
+    write("Cảm ơn quý khách!", 8, "center")
+
+    pdf.showPage()
+    pdf.save()
+    return output.getvalue()
+
+
+def _render(receipt: dict, fmt: str, path: Optional[str]):
+    """Render a receipt (runs in a worker process): to path when given, else return the bytes"""
+    content = render_pdf(receipt) if fmt == "pdf" else render_html(receipt)
+    if path is None:
+        return content
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so a concurrent reader never sees a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=RECEIPT_RENDER_WORKERS)
+        return _pool
+
+
+async def render_receipt(receipt: dict, fmt: str):
+    """
+    Render in the worker pool without blocking the event loop.
+    Final receipts are written to the cache and their path is returned;
+    others are returned as bytes.
+    """
+    path = cache_path(receipt["bill_id"], fmt) if receipt["final"] else None
+    result = await asyncio.wrap_future(_get_pool().submit(_render, receipt, fmt, path))
+    print(f"🧾 Rendered {fmt} receipt for bill {receipt['bill_id']}" + (" (cached)" if path else ""))
+    return result
@@ -0,0 +1,87 @@
+"""
+Backfill the running bill totals (bill.subtotal / vat_amount / total_amount)
+
+Bills created before these columns existed have subtotal = vat_amount = 0,
+and add_to_bill() only adds new orders on top of them. Run this once after
+adding the columns:
+
+    ALTER TABLE bill
+        ADD COLUMN subtotal DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        ADD COLUMN vat_amount DECIMAL(12, 2) NOT NULL DEFAULT 0;
+
+It recomputes the totals of open bills from their order items and opens a
+bill for active sessions that have orders but no bill yet. Pass --all to
+also recompute paid bills (this rewrites historical revenue figures).
+
+Run from backend/:  python scripts/backfill_bill_totals.py [--all]
+"""
+
+import os
+import sys
+import uuid
+
+from sqlalchemy import func, select, update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import SessionLocal  # noqa: E402
+from models import Bill, Order, OrderItem, Session as DBSession  # noqa: E402
+
+VAT_RATE = 0.1
+PAID_BILL_STATUSES = ("paid", "verified", "completed")
+
+
+def main(include_paid: bool):
+    db = SessionLocal()
+    try:
+        items_total = select(
+            func.coalesce(func.sum(OrderItem.price * OrderItem.quantity), 0)
+        ).join(Order, OrderItem.order_id == Order.order_id).where(
+            Order.session_id == Bill.session_id
+        ).scalar_subquery()
+
+        bills = update(Bill).execution_options(synchronize_session=False)
+        if not include_paid:
+            bills = bills.where(Bill.status.notin_(PAID_BILL_STATUSES))
+
+        # Two statements, so neither depends on the order SET clauses are applied in
+        updated = db.execute(bills.values(subtotal=items_total)).rowcount
+        vat = func.round(Bill.subtotal * VAT_RATE, 2)
+        db.execute(bills.values(
+            vat_amount=vat,
+            total_amount=Bill.subtotal + vat - func.coalesce(Bill.points_redeemed, 0)  # Redeemed points stay off
+        ))
+
+        # Active sessions with orders but no bill
+        missing = db.query(
+            Order.session_id,
+            func.sum(OrderItem.price * OrderItem.quantity)
+        ).join(OrderItem, OrderItem.order_id == Order.order_id).join(
+            DBSession, DBSession.session_id == Order.session_id
+        ).outerjoin(
+            Bill, Bill.session_id == Order.session_id
+        ).filter(
+            DBSession.status == "active",
+            Bill.bill_id.is_(None)
+        ).group_by(Order.session_id).all()
+
+        for session_id, subtotal in missing:
+            vat_amount = round(float(subtotal) * VAT_RATE, 2)
+            db.add(Bill(
+                bill_id=str(uuid.uuid4()),
+                session_id=session_id,
+                subtotal=subtotal,
+                vat_amount=vat_amount,
+                total_amount=float(subtotal) + vat_amount,
+                points_earned=0,
+                points_redeemed=0,
+                status="pending"
+            ))
+
+        db.commit()
+        print(f"✅ Recomputed {updated} bills, opened {len(missing)} missing bills")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main(include_paid="--all" in sys.argv[1:])
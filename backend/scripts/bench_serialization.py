@@ -0,0 +1,144 @@
+"""
+Serialization microbenchmark for the hot API payloads
+
+Compares three ways of turning a payload into response bytes:
+  1. FastAPI default:  response_model validation + jsonable_encoder + json.dumps
+  2. ORJSONResponse:   response_model validation + jsonable_encoder + orjson
+  3. Trusted path:     fast_json.dumps straight from the dicts (TrustedJSONResponse)
+
+Payloads: a 200-item guest menu and a 500-order kitchen list.
+
+Run from backend/:  python scripts/bench_serialization.py
+(No database needed; the schemas below mirror the ones in main.py.)
+"""
+
+import asyncio
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from pydantic import BaseModel
+import orjson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fast_json import dumps  # noqa: E402
+
+
+# ---- Mirrors of main.py response schemas ----
+
+class GuestMenuItemResponse(BaseModel):
+    menu_item_id: str
+    item_name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    discount_percent: Optional[float] = None
+    status: Optional[str] = None
+    category_id: Optional[str] = None
+    category_name: Optional[str] = None
+    image: Optional[str] = None
+
+
+class OrderItemResponse(BaseModel):
+    order_item_id: str
+    menu_item_id: str
+    menu_item_name: str
+    menu_item_image: Optional[str]
+    quantity: int
+    price: float
+    note: Optional[str] = None
+
+
+class OrderResponse(BaseModel):
+    order_id: str
+    session_id: str
+    table_id: str
+    table_number: str
+    branch_id: str
+    branch_name: str
+    status: str
+    order_time: datetime
+    items: List[OrderItemResponse]
+    wait_minutes: int
+
+
+# ---- Synthetic payloads ----
+
+def make_menu(n=200):
+    return [
+        {
+            "menu_item_id": f"00000000-0000-0000-0000-{i:012d}",
+            "item_name": f"Phở bò tái chín số {i}",
+            "description": "Nước dùng hầm xương bò 12 tiếng, bánh phở tươi, hành lá, rau thơm",
+            "price": 55000.0 + i,
+            "discount_percent": float(i % 20),
+            "status": "available",
+            "category_id": f"cat-{i % 8}",
+            "category_name": ["Món chính", "Khai vị", "Đồ uống", "Tráng miệng"][i % 4],
+        }
+        for i in range(n)
+    ]
+
+
+def make_kitchen_list(n=500, items_per_order=4):
+    now = datetime.now()
+    return [
+        {
+            "order_id": f"order-{o:08d}",
+            "session_id": f"session-{o:08d}",
+            "table_id": f"table-{o % 40:04d}",
+            "table_number": f"T{o % 40}",
+            "branch_id": "branch-0001",
+            "branch_name": "Chi nhánh Quận 1",
+            "status": ["ordered", "cooking", "ready", "serving"][o % 4],
+            "order_time": now - timedelta(minutes=o % 90),
+            "items": [
+                {
+                    "order_item_id": f"oi-{o:08d}-{k}",
+                    "menu_item_id": f"mi-{k:04d}",
+                    "menu_item_name": "Bún chả Hà Nội",
+                    "menu_item_image": None,
+                    "quantity": 1 + k % 3,
+                    "price": 45000.0,
+                    "note": "Không hành" if k % 2 else None,
+                }
+                for k in range(items_per_order)
+            ],
+            "wait_minutes": o % 90,
+        }
+        for o in range(n)
+    ]
+
+
+def fastapi_path(field, payload, render):
+    content = asyncio.run(serialize_response(field=field, response_content=payload))
+    return render(content)
+
+
+def bench(label, fn, number):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"  {label:<42} {seconds * 1000:8.3f} ms")
+    return seconds
+
+
+def run(name, model, payload, number):
+    field = create_response_field(name="response", type_=List[model], mode="serialization")
+    std_json = lambda c: json.dumps(c, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    or_json = lambda c: orjson.dumps(c, option=orjson.OPT_NON_STR_KEYS)
+
+    print(f"\n{name}")
+    base = bench("FastAPI default (validate + json)", lambda: fastapi_path(field, payload, std_json), number)
+    bench("ORJSONResponse (validate + orjson)", lambda: fastapi_path(field, payload, or_json), number)
+    bench("jsonable_encoder + orjson (no validation)", lambda: or_json(jsonable_encoder(payload)), number)
+    fast = bench("TrustedJSONResponse (orjson only)", lambda: dumps(payload), number)
+    print(f"  speed-up of trusted path: {base / fast:.1f}x, body {len(dumps(payload)) / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+    run("Guest menu, 200 items", GuestMenuItemResponse, make_menu(200), number=50)
+    run("Kitchen list, 500 orders x 4 items", OrderResponse, make_kitchen_list(500), number=10)
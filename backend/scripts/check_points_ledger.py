@@ -0,0 +1,90 @@
+"""
+Loyalty ledger maintenance
+
+    python scripts/check_points_ledger.py check [--fix] [--chunk 500]
+        Compare every customer's points_balance with the sum of their point
+        transactions, one chunk of customers at a time. --fix resets the
+        mismatched balances to the ledger. Exits with status 1 when
+        mismatches were found (and not fixed).
+
+    python scripts/check_points_ledger.py snapshot
+        Take balance snapshots now (the API's loyalty worker also does this
+        every LOYALTY_SNAPSHOT_INTERVAL seconds).
+
+    python scripts/check_points_ledger.py apply
+        Apply every queued award (e.g. after the API was down for a while).
+
+New tables and index, for databases created before them:
+
+    CREATE TABLE loyalty_award (
+        bill_id VARCHAR(36) PRIMARY KEY,
+        customer_id VARCHAR(36) NOT NULL,
+        points DECIMAL(12, 2) NOT NULL,
+        description VARCHAR(255),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        applied_at TIMESTAMP NULL,
+        INDEX ix_loyalty_award_applied_at (applied_at),
+        FOREIGN KEY (bill_id) REFERENCES bill (bill_id) ON DELETE CASCADE,
+        FOREIGN KEY (customer_id) REFERENCES customer (customer_id) ON DELETE CASCADE
+    );
+    CREATE TABLE point_balance_snapshot (
+        customer_id VARCHAR(36) NOT NULL,
+        taken_at TIMESTAMP NOT NULL,
+        balance DECIMAL(12, 2) NOT NULL,
+        PRIMARY KEY (customer_id, taken_at),
+        FOREIGN KEY (customer_id) REFERENCES customer (customer_id) ON DELETE CASCADE
+    );
+    CREATE INDEX ix_point_transaction_customer_time ON point_transaction (customer_id, created_at);
+
+Run from backend/.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import SessionLocal  # noqa: E402
+import loyalty  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=("check", "snapshot", "apply"))
+    parser.add_argument("--fix", action="store_true", help="reset mismatched balances to the ledger")
+    parser.add_argument("--chunk", type=int, default=loyalty.CUSTOMER_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "snapshot":
+            loyalty.take_snapshots(db, args.chunk)
+            return
+        if args.command == "apply":
+            applied = 0
+            while True:
+                batch = loyalty.apply_pending_awards(db)
+                applied += batch
+                if batch < loyalty.LOYALTY_AWARD_BATCH:
+                    break
+            print(f"✅ Applied {applied} queued awards")
+            return
+
+        mismatches = 0
+        for mismatch in loyalty.check_balances(db, args.chunk, fix=args.fix):
+            mismatches += 1
+            print(f"❌ {mismatch.customer_id}: balance {mismatch.points_balance}, "
+                  f"ledger {mismatch.ledger_balance}")
+        if not mismatches:
+            print("✅ Every balance matches its ledger")
+        elif args.fix:
+            print(f"🔧 Reset {mismatches} balances to their ledger")
+        else:
+            print(f"⚠️ {mismatches} balances differ from their ledger (run with --fix to reset them)")
+            sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Rebuild the daily branch stats rollup (branch_daily_stats)
+
+The API keeps the rollup up to date as orders are placed and bills are
+settled; run this once to backfill the history, or again for a range whose
+figures were changed outside the API (e.g. backfill_bill_totals.py --all).
+Each month of the range is rebuilt in its own transaction.
+
+    CREATE TABLE branch_daily_stats (
+        branch_id VARCHAR(36) NOT NULL,
+        business_date DATE NOT NULL,
+        revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        bills INT NOT NULL DEFAULT 0,
+        orders INT NOT NULL DEFAULT 0,
+        covers INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (branch_id, business_date),
+        INDEX ix_branch_daily_stats_business_date (business_date),
+        FOREIGN KEY (branch_id) REFERENCES branch (branch_id) ON DELETE CASCADE
+    );
+
+Run from backend/:
+    python scripts/rebuild_daily_stats.py [--from 2024-01-01] [--to 2024-12-31] [--branch BRANCH_ID ...]
+"""
+
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import SessionLocal  # noqa: E402
+from models import Order, Session as DBSession  # noqa: E402
+import daily_stats  # noqa: E402
+
+
+def first_day(db) -> date:
+    """Earliest business date with an order or a finished session"""
+    days = [
+        db.query(func.min(func.date(Order.order_time))).scalar(),
+        db.query(func.min(func.date(DBSession.end_time))).scalar(),
+    ]
+    days = [day if isinstance(day, date) else date.fromisoformat(str(day)) for day in days if day]
+    return min(days) if days else date.today()
+
+
+def months(start: date, end: date):
+    """[start, end] split at month boundaries"""
+    while start <= end:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        yield start, min(end, next_month - timedelta(days=1))
+        start = next_month
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, help="first day (default: first order)")
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, help="last day (default: tomorrow)")
+    parser.add_argument("--branch", action="append", help="only these branches (repeatable)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        start = args.start or first_day(db)
+        # Settlement dates are UTC, so "today" may already be tomorrow's row
+        end = args.end or date.today() + timedelta(days=1)
+        written = 0
+        for month_start, month_end in months(start, end):
+            written += daily_stats.rebuild(db, month_start, month_end, args.branch)
+        print(f"✅ Rebuilt {written} rows from {start} to {end}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Concurrency check for points redemption
+
+Fires N simultaneous redemptions (POST /api/guest/sessions/{id}/bill/redeem-points)
+for one customer at a running API and checks that no points were spent
+twice: the balance drop must equal the successful redemptions, and the
+balance must not go below zero.
+
+Run against a dev/staging server, with a customer token and an open
+session of that customer whose bill is larger than the redemptions:
+    python scripts/stress_points_redemption.py --base-url http://localhost:8000 \\
+        --token <customer JWT> --session-id <uuid> [--requests 50] [--points 100]
+
+Pick --points so that requests * points exceeds the balance, so that some
+redemptions have to be refused. Exits with status 1 if the ledger does not
+add up or a request failed with anything but 409.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def call(base_url: str, token: str, path: str, body=None):
+    request = urllib.request.Request(
+        f"{base_url}{path}",
+        data=json.dumps(body).encode("utf-8") if body is not None else None,
+        headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"},
+        method="POST" if body is not None else "GET",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8", "replace")[:200]
+
+
+def redeem(args, start: threading.Barrier):
+    start.wait()  # Release every request at the same moment
+    return call(args.base_url, args.token, f"/api/guest/sessions/{args.session_id}/bill/redeem-points",
+                {"points": args.points})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--session-id", required=True)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--points", type=float, default=100)
+    args = parser.parse_args()
+    args.base_url = args.base_url.rstrip("/")
+
+    code, before = call(args.base_url, args.token, "/api/customers/me/points")
+    if code != 200:
+        sys.exit(f"❌ Could not read the balance: {code} {before}")
+
+    start = threading.Barrier(args.requests)
+    with ThreadPoolExecutor(max_workers=args.requests) as pool:
+        results = list(pool.map(lambda _: redeem(args, start), range(args.requests)))
+
+    _, after = call(args.base_url, args.token, "/api/customers/me/points")
+    codes = Counter(code for code, _ in results)
+    succeeded = codes[200]
+    spent = round(before["points_balance"] - after["points_balance"], 2)
+
+    print(f"📊 {args.requests} redemptions of {args.points}: {dict(codes)}")
+    print(f"   balance {before['points_balance']} → {after['points_balance']} (spent {spent})")
+    for code, body in [r for r in results if r[0] not in (200, 409)][:5]:
+        print(f"   ❌ {code}: {body}")
+
+    # Awards credited by the loyalty worker meanwhile would also move the balance
+    if after["pending_points"] or before["pending_points"]:
+        print("⚠️ Points were being awarded during the run; rerun when pending_points is 0")
+    ok = (spent == round(succeeded * args.points, 2)
+          and after["points_balance"] >= 0
+          and set(codes) <= {200, 409})
+    if not ok:
+        sys.exit(1)
+    print("✅ Every point was spent at most once")
+
+
+if __name__ == "__main__":
+    main()
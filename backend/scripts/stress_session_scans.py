@@ -0,0 +1,68 @@
+"""
+Concurrency check for guest session creation
+
+Fires N simultaneous "QR scans" (POST /api/guest/sessions) at one table of a
+running API and checks that every guest got the same active session, i.e.
+that session.active_table_id (unique) prevents duplicate active sessions.
+
+Run against a dev/staging server whose table has no active session yet:
+    python scripts/stress_session_scans.py --base-url http://localhost:8000 --table-id <uuid> [--scans 50]
+
+Exits with status 1 if the scans ended up in more than one session or any
+scan failed.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def scan(base_url: str, table_id: str, start: threading.Barrier):
+    request = urllib.request.Request(
+        f"{base_url}/api/guest/sessions",
+        data=json.dumps({"table_id": table_id}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    start.wait()  # Release every request at the same moment
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())["session_id"]
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8", "replace")[:200]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--table-id", required=True)
+    parser.add_argument("--scans", type=int, default=50)
+    args = parser.parse_args()
+
+    start = threading.Barrier(args.scans)
+    with ThreadPoolExecutor(max_workers=args.scans) as pool:
+        results = list(pool.map(
+            lambda _: scan(args.base_url.rstrip("/"), args.table_id, start), range(args.scans)
+        ))
+
+    sessions = Counter(body for code, body in results if code == 200)
+    failures = [(code, body) for code, body in results if code != 200]
+
+    print(f"📊 {args.scans} scans → {len(sessions)} session(s), {len(failures)} failed")
+    for session_id, count in sessions.most_common():
+        print(f"   {session_id}: {count}")
+    for code, body in failures[:5]:
+        print(f"   ❌ {code}: {body}")
+
+    if len(sessions) != 1 or failures:
+        sys.exit(1)
+    print("✅ All scans share one active session")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+In-memory table directory for the Scan&Order API
+
+Maps every dining table to its branch, tenant, number, capacity, status
+and current QR version, so resolving a QR scan (get_guest_table_info,
+guest session creation, QR token checks) does not query MySQL.
+
+Loaded lazily with one query and kept current by the table, session and
+settlement write paths in main.py. Like the branch directory, each
+worker process holds its own copy and fully reloads every
+TABLE_DIRECTORY_TTL seconds; a table missing from the map (e.g. just
+created by another worker) is fetched individually and added.
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from models import Branch, DiningTable, QRCode
+from qr_tokens import LEGACY_VERSION
+
+TABLE_DIRECTORY_TTL = int(os.getenv("TABLE_DIRECTORY_TTL", "300"))
+
+
+@dataclass
+class TableEntry:
+    table_id: str
+    branch_id: str
+    tenant_id: str
+    table_number: str
+    capacity: Optional[int]
+    status: str
+    qr_version: int = LEGACY_VERSION
+
+    def as_dict(self) -> dict:
+        return {
+            "table_id": self.table_id,
+            "table_number": self.table_number,
+            "capacity": self.capacity,
+            "status": self.status,
+            "branch_id": self.branch_id,
+        }
+
+
+class TableDirectory:
+    def __init__(self, version_of, ttl: int = TABLE_DIRECTORY_TTL):
+        # version_of(qr_content) -> int, from the QR token signer
+        self.version_of = version_of
+        self.ttl = ttl
+        self._tables: Dict[str, TableEntry] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.RLock()
+
+    def _query(self, db: Session):
+        return db.query(
+            DiningTable.table_id, DiningTable.branch_id, Branch.tenant_id,
+            DiningTable.table_number, DiningTable.capacity, DiningTable.status,
+            QRCode.qr_content
+        ).join(Branch, DiningTable.branch_id == Branch.branch_id).outerjoin(
+            QRCode, QRCode.table_id == DiningTable.table_id
+        )
+
+    def _entry(self, row) -> TableEntry:
+        table_id, branch_id, tenant_id, table_number, capacity, table_status, qr_content = row
+        return TableEntry(table_id, branch_id, tenant_id, table_number, capacity,
+                          table_status, self.version_of(qr_content))
+
+    # ---------- loading ----------
+
+    def ensure_loaded(self, db: Session):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        self.reload(db)
+
+    def reload(self, db: Session):
+        tables = {row[0]: self._entry(row) for row in self._query(db).all()}
+        with self._lock:
+            self._tables = tables
+            self._loaded_at = time.monotonic()
+        print(f"📇 Table directory loaded: {len(tables)} tables")
+
+    # ---------- reads ----------
+
+    def get(self, db: Session, table_id: str) -> Optional[TableEntry]:
+        self.ensure_loaded(db)
+        entry = self._tables.get(table_id)
+        if entry is None:
+            row = self._query(db).filter(DiningTable.table_id == table_id).first()
+            if row is None:
+                return None
+            entry = self._entry(row)
+            with self._lock:
+                self._tables[table_id] = entry
+        return entry
+
+    # ---------- incremental updates (call after commit) ----------
+
+    def upsert_table(self, table: DiningTable, tenant_id: str, qr_version: Optional[int] = None):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            existing = self._tables.get(table.table_id)
+            if qr_version is None:
+                qr_version = existing.qr_version if existing else LEGACY_VERSION
+            self._tables[table.table_id] = TableEntry(
+                table.table_id, table.branch_id, tenant_id, table.table_number,
+                table.capacity, table.status, qr_version
+            )
+
+    def set_status(self, table_id: str, table_status: str):
+        entry = self._tables.get(table_id)
+        if entry is not None:
+            entry.status = table_status
+
+    def remove_table(self, table_id: str):
+        with self._lock:
+            self._tables.pop(table_id, None)
+
+    def remove_branch(self, branch_id: str):
+        with self._lock:
+            self._tables = {k: v for k, v in self._tables.items() if v.branch_id != branch_id}
+
+    def remove_tenant(self, tenant_id: str):
+        with self._lock:
+            self._tables = {k: v for k, v in self._tables.items() if v.tenant_id != tenant_id}
@@ -0,0 +1,151 @@
+"""
+Statement parsing and matching (bank_statements.py), without a database.
+
+Run from backend/:  python -m pytest tests
+"""
+
+import io
+from decimal import Decimal
+
+import pytest
+
+import bank_statements
+from bank_statements import (
+    PaymentIndex, RowError, Transaction, memo_references, parse_amount, reconcile
+)
+
+
+# ============== parse_amount ==============
+
+@pytest.mark.parametrize("text, expected", [
+    ("1.650.000", Decimal("1650000")),        # Dots group thousands
+    ("1,650,000", Decimal("1650000")),        # Commas group thousands
+    ("1,650,000.00", Decimal("1650000.00")),  # Comma thousands, dot decimals
+    ("1.650.000,50", Decimal("1650000.50")),  # Dot thousands, comma decimals
+    ("165.000", Decimal("165000")),           # Lone separator + 3 digits: thousands
+    ("165,000", Decimal("165000")),
+    ("165000.5", Decimal("165000.5")),        # Lone separator + 1 digit: decimals
+    ("165000,50", Decimal("165000.50")),
+    ("165000", Decimal("165000")),
+    ("-50,000 VND", Decimal("-50000")),
+    ("+ 20.000 đ", Decimal("20000")),
+    (165000, Decimal("165000")),
+])
+def test_parse_amount(text, expected):
+    assert parse_amount(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "   ", None])
+def test_parse_amount_blank_is_none(text):
+    assert parse_amount(text) is None
+
+
+@pytest.mark.parametrize("text", ["abc", "1.2.3,4,5"])
+def test_parse_amount_rejects_garbage(text):
+    with pytest.raises(RowError):
+        parse_amount(text)
+
+
+# ============== memo_references ==============
+
+def test_memo_references_plain():
+    assert memo_references("SO1A2B3C4D5E thanh toan") == ["SO1A2B3C4D5E"]
+
+
+def test_memo_references_split_by_bank():
+    # Banks insert spaces, dashes and lower-case the message
+    assert memo_references("CUSTOMER CK so1a2b - 3c4d5e THANH TOAN") == ["SO1A2B3C4D5E"]
+
+
+def test_memo_references_several_and_none():
+    assert memo_references("SO0000000001 SO0000000002") == ["SO0000000001", "SO0000000002"]
+    assert memo_references("chuyen tien an trua") == []
+    assert memo_references("") == []
+
+
+# ============== _ofx_elements ==============
+
+OFX = ("<OFX><STMTTRN><TRNTYPE>CREDIT<TRNAMT>165000.00<FITID>X1"
+       "<MEMO>SO1A2B3C4D5E thanh toan</STMTTRN></OFX>")
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 5, 7, 64 * 1024])
+def test_ofx_elements_chunk_boundaries(monkeypatch, read_size):
+    # Small reads end chunks in the middle of tags and values
+    monkeypatch.setattr(bank_statements, "OFX_READ_SIZE", read_size)
+    elements = list(bank_statements._ofx_elements(io.StringIO(OFX)))
+    assert elements == [
+        (False, "OFX", ""),
+        (False, "STMTTRN", ""),
+        (False, "TRNTYPE", "CREDIT"),
+        (False, "TRNAMT", "165000.00"),
+        (False, "FITID", "X1"),
+        (False, "MEMO", "SO1A2B3C4D5E thanh toan"),
+        (True, "STMTTRN", ""),
+        (True, "OFX", ""),
+    ]
+
+
+def test_read_transactions_ofx(monkeypatch):
+    monkeypatch.setattr(bank_statements, "OFX_READ_SIZE", 4)
+    rows = list(bank_statements.read_transactions(io.BytesIO(OFX.encode()), "ofx"))
+    assert len(rows) == 1
+    number, transaction = rows[0]
+    assert number == 1
+    assert transaction.amount == Decimal("165000.00")
+    assert transaction.reference == "X1"
+    assert memo_references(transaction.memo) == ["SO1A2B3C4D5E"]
+
+
+# ============== reconcile ==============
+
+def _row(number, amount, memo):
+    return number, Transaction(row=number, amount=Decimal(amount), memo=memo)
+
+
+def _index():
+    index = PaymentIndex()
+    index.add(165000, ("bill-1",), ["SO000000000A"])
+    # A tab of two bills paid with one transfer, either reference works
+    index.add(300000, ("bill-2", "bill-3"), ["SO000000000B", "SO000000000C"])
+    return index
+
+
+def test_reconcile_claims_a_bill_once():
+    result = reconcile(_index(), [
+        _row(2, "165000", "SO000000000A"),
+        _row(3, "165000", "CK SO000000000A lan 2"),  # Same bill paid again
+    ])
+    assert result.matched == 1
+    assert result.bill_ids == ["bill-1"]
+    assert result.unmatched == 1
+    assert result.unmatched_rows[0]["reason"] == "Bill already matched by another transaction"
+
+
+def test_reconcile_tab_claims_all_its_bills_once():
+    result = reconcile(_index(), [
+        _row(2, "300000", "SO000000000B"),
+        _row(3, "300000", "SO000000000C"),  # Other reference of the same tab
+    ])
+    assert result.matched == 1
+    assert sorted(result.bill_ids) == ["bill-2", "bill-3"]
+    assert result.unmatched == 1
+
+
+def test_reconcile_amount_mismatch_and_skips():
+    result = reconcile(_index(), [
+        _row(2, "166000", "SO000000000A"),
+        _row(3, "-50000", "PHI"),
+        _row(4, "20000", "chuyen tien"),
+        (5, RowError("Amount is not a number: 'abc'")),
+    ])
+    assert result.matched == 0
+    assert result.skipped == 1
+    assert result.failed == 1
+    reasons = [row["reason"] for row in result.unmatched_rows]
+    assert reasons == ["Amount differs from the bill (165000)", "No bill reference in the description"]
+
+
+def test_reconcile_rounds_to_whole_vnd():
+    result = reconcile(_index(), [_row(2, "165000.40", "SO000000000A")])
+    assert result.bill_ids == ["bill-1"]
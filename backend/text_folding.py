@@ -0,0 +1,21 @@
+"""
+Vietnamese-aware text folding
+
+fold_text("Phở Hà Nội") == "pho ha noi": lowercases, strips tone and
+vowel marks, maps đ -> d and collapses whitespace, so user input typed
+without diacritics matches stored names.
+"""
+
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fold_text(text: str) -> str:
+    if not text:
+        return ""
+    text = text.replace("đ", "d").replace("Đ", "D")
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+    return _WHITESPACE.sub(" ", stripped.lower()).strip()
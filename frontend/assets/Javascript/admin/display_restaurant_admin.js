@@ -20,18 +20,20 @@ const API_CONFIG = {
 // DATA
 // ============================================
 let restaurantsData = [];
-let filteredData = [];
-let isSearching = false;
+let searchTerm = '';  // ✅ CHANGED: Searched, sorted and paged by the server
+let currentSort = 'name';
+let searchTimer = null;
 
 // ============================================
 // PAGINATION
 // ============================================
 const ITEMS_PER_PAGE = 5;
 let currentPage = 1;
+let totalRestaurants = 0;
+let pageCursors = {};  // ✅ NEW: page number -> cursor that loads it (next_cursor of the page before)
 
 function getTotalPages() {
-    const data = isSearching ? filteredData : restaurantsData;
-    return Math.ceil(data.length / ITEMS_PER_PAGE);
+    return Math.ceil(totalRestaurants / ITEMS_PER_PAGE);
 }
 
 // ============================================
@@ -47,12 +49,17 @@ async function fetchRestaurantsFromAPI(page = 1, search = null) {
     try {
         const params = new URLSearchParams({
             page: page,
-            limit: ITEMS_PER_PAGE
+            limit: ITEMS_PER_PAGE,
+            sort: currentSort
         });
         
         if (search) {
             params.append('search', search);
         }
+        // ✅ NEW: Continue after the previous page's last row when we know it
+        if (pageCursors[page]) {
+            params.set('cursor', pageCursors[page]);
+        }
         
         const url = `${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.GET_ALL}?${params}`;
         console.log('📄 Fetching restaurants:', url);
@@ -188,13 +195,18 @@ async function deleteRestaurant(tenantId) {
 // INITIALIZE DATA
 // ============================================
 async function initializeData() {
-    const apiData = await fetchRestaurantsFromAPI(currentPage);
+    const apiData = await fetchRestaurantsFromAPI(currentPage, searchTerm);
     
     if (apiData && apiData.data) {
         restaurantsData = apiData.data;
+        totalRestaurants = apiData.total;
+        if (apiData.next_cursor) {
+            pageCursors[currentPage + 1] = apiData.next_cursor;
+        }
         console.log(`✅ Loaded ${restaurantsData.length} restaurants from API`);
     } else {
         restaurantsData = [];
+        totalRestaurants = 0;
         console.log('⚠️ Using empty data (no restaurants found)');
     }
     
@@ -211,7 +223,7 @@ function renderRestaurants(page) {
     const tbody = document.getElementById('restaurant-tbody');
     if (!tbody) return;
     
-    const data = isSearching ? filteredData : restaurantsData;
+    const data = restaurantsData;
     
     if (data.length === 0) {
         tbody.innerHTML = `
@@ -278,9 +290,9 @@ function renderRestaurants(page) {
 
     // Update pagination info
     const start = (page - 1) * ITEMS_PER_PAGE + 1;
-    const end = Math.min(page * ITEMS_PER_PAGE, data.length);
+    const end = start + data.length - 1;
     document.getElementById('pagination-info').textContent = 
-        `Hiển thị ${start}-${end} trong ${data.length} nhà hàng`;
+        `Hiển thị ${start}-${end} trong ${totalRestaurants} nhà hàng`;
 }
 
 // ============================================
@@ -359,7 +371,6 @@ function renderPageNumbers() {
     const container = document.getElementById('page-numbers');
     if (!container) return;
     
-    const data = isSearching ? filteredData : restaurantsData;
     const totalPages = getTotalPages();
     
     if (totalPages <= 1) {
@@ -398,9 +409,7 @@ function goToPage(page) {
     const totalPages = getTotalPages();
     if (page < 1 || page > totalPages) return;
     currentPage = page;
-    renderRestaurants(currentPage);
-    renderPageNumbers();
-    updateButtons();
+    initializeData();  // ✅ CHANGED: Each page is loaded from the server
 }
 
 function nextPage() {
@@ -422,7 +431,7 @@ function updateButtons() {
     const nextBtn = document.getElementById('next-btn');
     
     if (prevBtn) prevBtn.disabled = currentPage === 1;
-    if (nextBtn) nextBtn.disabled = currentPage === totalPages;
+    if (nextBtn) nextBtn.disabled = currentPage >= totalPages;
 }
 
 // ============================================
@@ -432,29 +441,14 @@ function handleSearch() {
     const searchInput = document.getElementById('search-input');
     if (!searchInput) return;
     
-    const searchTerm = searchInput.value.toLowerCase().trim();
-    
-    if (!searchTerm) {
-        isSearching = false;
-        filteredData = [];
+    // ✅ CHANGED: The server searches name, owner and email across all restaurants
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => {
+        searchTerm = searchInput.value.trim();
         currentPage = 1;
-        renderRestaurants(currentPage);
-        renderPageNumbers();
-        updateButtons();
-        return;
-    }
-    
-    isSearching = true;
-    filteredData = restaurantsData.filter(restaurant => 
-        restaurant.name.toLowerCase().includes(searchTerm) ||
-        restaurant.owner_name.toLowerCase().includes(searchTerm) ||
-        restaurant.owner_email.toLowerCase().includes(searchTerm)
-    );
-    
-    currentPage = 1;
-    renderRestaurants(currentPage);
-    renderPageNumbers();
-    updateButtons();
+        pageCursors = {};
+        initializeData();
+    }, 300);
 }
 
 // ============================================
@@ -18,6 +18,7 @@ const API_CONFIG = {
 // ============================================
 let revenueData = [];
 let currentPeriod = 'today';  // ✅ NEW: Track current period filter
+let currentSort = 'revenue';  // ✅ NEW: Sorted by the server ("revenue", "orders" or "name")
 
 // ============================================
 // PAGINATION
@@ -26,9 +27,10 @@ const ITEMS_PER_PAGE = 5;
 let currentPage = 1;
 let totalRestaurants = 0;
 let totalOrders = 0;
+let pageCursors = {};  // ✅ NEW: page number -> cursor that loads it (next_cursor of the page before)
 
 function getTotalPages() {
-    return Math.ceil(revenueData.length / ITEMS_PER_PAGE);
+    return Math.ceil(totalRestaurants / ITEMS_PER_PAGE);
 }
 
 // ============================================
@@ -45,8 +47,13 @@ async function fetchRevenueFromAPI(page = 1) {
         const params = new URLSearchParams({
             page: page,
             limit: ITEMS_PER_PAGE,
-            period: currentPeriod  // ✅ NEW: Include period filter
+            period: currentPeriod,  // ✅ NEW: Include period filter
+            sort: currentSort
         });
+        // ✅ NEW: Continue after the previous page's last row when we know it
+        if (pageCursors[page]) {
+            params.set('cursor', pageCursors[page]);
+        }
         
         const url = `${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.GET_REVENUE}?${params}`;
         console.log('🔄 Fetching revenue data:', url);
@@ -83,6 +90,9 @@ async function initializeData() {
         revenueData = apiData.data;
         totalRestaurants = apiData.total;
         totalOrders = apiData.total_orders;
+        if (apiData.next_cursor) {
+            pageCursors[currentPage + 1] = apiData.next_cursor;
+        }
         console.log(`✅ Loaded revenue for ${revenueData.length} restaurants from API`);
     } else {
         revenueData = [];
@@ -174,7 +184,7 @@ function renderRevenue(page) {
 
     // Update pagination info
     const start = (page - 1) * ITEMS_PER_PAGE + 1;
-    const end = Math.min(page * ITEMS_PER_PAGE, revenueData.length);
+    const end = start + revenueData.length - 1;
     document.getElementById('pagination-info').textContent = 
         `Hiển thị ${start}-${end} trong ${totalRestaurants} nhà hàng`;
 }
@@ -224,9 +234,7 @@ function goToPage(page) {
     const totalPages = getTotalPages();
     if (page < 1 || page > totalPages) return;
     currentPage = page;
-    renderRevenue(currentPage);
-    renderPageNumbers();
-    updateButtons();
+    initializeData();  // ✅ CHANGED: Each page is loaded from the server
 }
 
 function nextPage() {
@@ -248,7 +256,7 @@ function updateButtons() {
     const nextBtn = document.getElementById('next-btn');
     
     if (prevBtn) prevBtn.disabled = currentPage === 1;
-    if (nextBtn) nextBtn.disabled = currentPage === totalPages;
+    if (nextBtn) nextBtn.disabled = currentPage >= totalPages;
 }
 
 // ============================================
@@ -259,6 +267,7 @@ function changePeriod(period) {
     
     currentPeriod = period;
     currentPage = 1;  // Reset to first page
+    pageCursors = {};
     
     // Update UI button states
     document.querySelectorAll('[data-period]').forEach(btn => {
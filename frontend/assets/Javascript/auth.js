@@ -347,6 +347,18 @@ const TableAPI = {
         });
     },
     
+    /**
+     * Create many tables at once
+     * tablesData: { pattern: "T{n}", start: 1, count: 80, capacity: 4 }
+     *         or  { table_numbers: ["VIP-1", "VIP-2"], capacity: 6 }
+     */
+    async createBulk(branchId, tablesData) {
+        return apiCall(`/branches/${branchId}/tables:bulk`, {
+            method: 'POST',
+            body: JSON.stringify(tablesData)
+        });
+    },
+    
     /**
      * Update a table
      */
@@ -407,7 +419,8 @@ const MenuAPI = {
     },
     
     async getByCategory(categoryId, branchId) {
-        return apiCall(`/categories/${categoryId}/menu-items?branch_id=${branchId}`);
+        // Menu cards show thumbnails, so ask for the image column too
+        return apiCall(`/categories/${categoryId}/menu-items?branch_id=${branchId}&fields=*`);
     },
 
     // ALSO ADDED a new method:
@@ -601,6 +614,47 @@ const BillAPI = {
         return apiCall(`/staff/qr-paid/${billId}/verify`, {
             method: 'PUT'
         });
+    },
+
+    /**
+     * Follow the branch's live payment feed (server-sent events).
+     * Read with fetch rather than EventSource so the JWT stays in the
+     * Authorization header. Calls onEvent(type, data) for every event and
+     * resolves when the server closes the stream.
+     */
+    async streamPaymentFeed(branchId, onEvent) {
+        const response = await fetch(`${API_CONFIG.BASE_URL}/staff/payment-feed?branch_id=${branchId}`, {
+            headers: {
+                'Authorization': `Bearer ${TokenManager.getToken()}`,
+                'Accept': 'text/event-stream'
+            }
+        });
+        if (!response.ok || !response.body) {
+            throw new Error(`Payment feed unavailable (${response.status})`);
+        }
+
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) return;
+            buffer += value;
+
+            // Events are separated by a blank line; ":" lines are keep-alives
+            let end;
+            while ((end = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, end);
+                buffer = buffer.slice(end + 2);
+
+                let type = null;
+                let data = '';
+                for (const line of block.split('\n')) {
+                    if (line.startsWith('event:')) type = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                }
+                if (type) onEvent(type, data ? JSON.parse(data) : null);
+            }
+        }
     }
 };
 
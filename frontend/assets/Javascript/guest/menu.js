@@ -167,7 +167,7 @@ async function loadMenuFromAPI() {
         console.log('📡 Fetching menu from API for branch:', branchId);
         
         const response = await fetch(
-            `${MENU_API_CONFIG.BASE_URL}${MENU_API_CONFIG.ENDPOINTS.GET_MENU}?branch_id=${branchId}`
+            `${MENU_API_CONFIG.BASE_URL}${MENU_API_CONFIG.ENDPOINTS.GET_MENU}?branch_id=${branchId}&fields=*`
         );
         
         if (!response.ok) {
@@ -29,6 +29,9 @@ const PaymentState = {
         accountNumber: null,
         accountName: null
     },
+    // VietQR payload generated by the backend for the amount due
+    vietqr: null,
+    billReference: null,
     qrPayment: {
         qrCodeUrl: null,
         qrCodeData: null,
@@ -124,6 +127,8 @@ async function loadOrderData() {
                 accountNumber: sessionData.bill.bank_account_number || '0123456789',
                 accountName: sessionData.bill.bank_account_name || 'NHA HANG'
             };
+            PaymentState.vietqr = sessionData.bill.vietqr || null;
+            PaymentState.billReference = sessionData.bill.bill_reference || null;
         }
 
         console.log('✅ Order:', PaymentState.orderDetails);
@@ -176,7 +181,11 @@ function generateVietQRData() {
     const accountNumber = PaymentState.bankInfo.accountNumber;
     const accountName = PaymentState.bankInfo.accountName;
 
-    const qrCodeUrl = `https://img.vietqr.io/image/${bankCode}-${accountNumber}-compact2.png?amount=${amount}&addInfo=${encodeURIComponent(description)}&accountName=${encodeURIComponent(accountName)}`;
+    // Prefer the server-rendered VietQR (amount due + bill reference);
+    // fall back to the public image service when the backend has none
+    const qrCodeUrl = PaymentState.vietqr
+        ? `${API_CONFIG.baseURL}/api/guest/sessions/${PaymentState.orderDetails.sessionId}/payment-qr?format=png&t=${Date.now()}`
+        : `https://img.vietqr.io/image/${bankCode}-${accountNumber}-compact2.png?amount=${amount}&addInfo=${encodeURIComponent(description)}&accountName=${encodeURIComponent(accountName)}`;
 
     console.log('📱 Generated QR URL:', qrCodeUrl);
 
@@ -185,7 +194,7 @@ function generateVietQRData() {
         data: {
             paymentId: 'PAY-' + Date.now(),
             qrCodeUrl: qrCodeUrl,
-            qrCodeData: `VietQR|${bankCode}|${accountNumber}|${amount}|${description}`,
+            qrCodeData: PaymentState.vietqr || `VietQR|${bankCode}|${accountNumber}|${amount}|${description}`,
             bankInfo: {
                 bankCode: bankCode,
                 accountNumber: accountNumber,
@@ -455,10 +464,12 @@ async function simulatePaymentSuccess() {
             throw new Error(errorData.detail || 'Không thể cập nhật trạng thái thanh toán');
         }
 
+        const billResult = await response.json();
         console.log('✅ Bill status updated to paid');
         
         // Save confirmation data to localStorage for the confirmation page
         const confirmationData = {
+            billId: billResult.bill_id,
             orderId: PaymentState.orderDetails.orderId,
             sessionId: PaymentState.orderDetails.sessionId,
             tableNumber: PaymentState.orderDetails.tableNumber,
@@ -386,7 +386,8 @@ document.addEventListener("DOMContentLoaded", async () => {
   setInterval(async () => {
     console.log("🔄 Auto-refreshing orders...");
     await loadOrders();
-    if (activeTab === "payment") {
+    // Payments arrive through the live feed; poll only while it is down
+    if (activeTab === "payment" && !paymentFeedLive) {
       await loadPayments();
     }
   }, 5000); // Refresh every 5 seconds
@@ -455,6 +456,54 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
   }
 
+  // ================== LIVE PAYMENT FEED ==================
+  let paymentFeedLive = false;
+
+  function upsertBill(list, bill) {
+    const index = list.findIndex(b => b.bill_id === bill.bill_id);
+    if (index === -1) list.push(bill);
+    else list[index] = bill;
+  }
+
+  function handlePaymentEvent(type, data) {
+    if (type === "ready" || type === "resync") {
+      paymentFeedLive = true;
+      loadPayments();
+      return;
+    }
+
+    if (type === "cash_pending") {
+      console.log("💵 New cash-pending bill:", data.table_number);
+      upsertBill(cashPendingBills, data);
+      qrPaidBills = qrPaidBills.filter(b => b.bill_id !== data.bill_id); // A bill is in one list only
+    } else if (type === "qr_paid") {
+      console.log("💳 New QR-paid bill:", data.table_number);
+      upsertBill(qrPaidBills, data);
+      cashPendingBills = cashPendingBills.filter(b => b.bill_id !== data.bill_id);
+    } else if (type === "settled") {
+      cashPendingBills = cashPendingBills.filter(b => b.bill_id !== data.bill_id);
+      qrPaidBills = qrPaidBills.filter(b => b.bill_id !== data.bill_id);
+    } else {
+      return;
+    }
+    renderPayments();
+    updatePaymentBadge();
+  }
+
+  async function connectPaymentFeed() {
+    while (true) {
+      try {
+        await BillAPI.streamPaymentFeed(currentBranch.branch_id, handlePaymentEvent);
+      } catch (error) {
+        console.warn("⚠️ Payment feed disconnected:", error.message);
+      }
+      paymentFeedLive = false;
+      await new Promise(resolve => setTimeout(resolve, 5000)); // Reconnect after 5 seconds
+    }
+  }
+
+  connectPaymentFeed();
+
   function updatePaymentBadge() {
     const totalCount = cashPendingBills.length + qrPaidBills.length;
     if (cashPendingBadge) {